@@ -1,6 +1,9 @@
 from app import create_app
 
-app = create_app()
+# Password hash workers are spawned and re-import this file as __mp_main__; only
+# the real process builds the app (BigQuery clients, user index warm-up, prewarmer)
+if __name__ != '__mp_main__':
+    app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
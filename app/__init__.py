@@ -2,24 +2,154 @@ from flask import Flask
 from flask_login import LoginManager
 from flask_session import Session
 from config import Config
+import click
+import json
 
 login_manager = LoginManager()
 sess = Session()
 
+class VehicleCost(click.ParamType):
+    """A VEHICLE=COST_PER_KWH command line value, as (vehicle, cost)"""
+    name = 'vehicle=cost'
+
+    def convert(self, value, param, ctx):
+        vehicle, _, price = value.rpartition('=')
+        if not vehicle:
+            self.fail(f"Expected VEHICLE=COST_PER_KWH, got {value!r}", param, ctx)
+        try:
+            cost = float(price)
+        except ValueError:
+            self.fail(f"Cost for {vehicle} must be a number, got {price!r}", param, ctx)
+        if cost < 0:
+            self.fail(f"Cost for {vehicle} can't be negative", param, ctx)
+        return vehicle, cost
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
     
     # Initialize extensions
-    sess.init_app(app)
+    if app.config['SESSION_TYPE'] == 'sqlite':
+        from app.sessions import SqliteSessionInterface
+        app.session_interface = SqliteSessionInterface(
+            app.config['SESSION_SQLITE_PATH'],
+            memory_max=app.config['SESSION_MEMORY_MAX'],
+            memory_ttl=app.config['SESSION_MEMORY_TTL'],
+            sweep_interval=app.config['SESSION_SWEEP_INTERVAL']
+        )
+    else:
+        sess.init_app(app)
     login_manager.init_app(app)
+    from app.compression import init_compression
+    init_compression(app)
     login_manager.login_view = 'auth.login'
     
     # Register blueprints
     from app.auth import bp as auth_bp
     from app.trips import bp as trips_bp
+    from app.stations import bp as stations_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(trips_bp, url_prefix='/trips')
+    app.register_blueprint(stations_bp, url_prefix='/stations')
+    
+    # Load taken usernames/emails so registration can reject them without a query
+    from app.auth.routes import db as auth_db
+    from app.services.user_index import user_index
+    if not user_index.warm:
+        user_index.warm_up(auth_db)
+    
+    # Keep caches for popular corridors warm
+    from app.trips.routes import db as trips_db
+    from app.services.prewarm import CorridorPrewarmer
+    prewarmer = CorridorPrewarmer(trips_db)
+    if app.config['PREWARM_ENABLED']:
+        prewarmer.start()
+    
+    @app.cli.command('migrate-schema')
+    def migrate_schema_command():
+        """Create missing BigQuery tables and columns from app.schemas"""
+        changes = trips_db.migrate_schema()
+        for change in changes:
+            print(change)
+        print(f"{len(changes)} schema changes")
+    
+    @app.cli.command('prewarm')
+    def prewarm_command():
+        """Run one corridor prewarm cycle and print its stats"""
+        print(prewarmer.run_cycle())
+    
+    @app.cli.command('export-trips')
+    @click.argument('out_dir')
+    @click.option('--format', 'fmt', type=click.Choice(['parquet', 'arrow']), default='parquet')
+    @click.option('--columns', help='Comma-separated trip columns (default: all)')
+    @click.option('--filters', help='JSON object with the filters /trips/search accepts')
+    @click.option('--stations', is_flag=True, help='Also export the trips\' stations')
+    def export_trips_command(out_dir, fmt, columns, filters, stations):
+        """Export trip history to Parquet or Arrow IPC files"""
+        from app.services.trip_export import TripExporter
+        stats = TripExporter(trips_db).export(
+            out_dir,
+            fmt=fmt,
+            columns=columns.split(',') if columns else None,
+            filters=json.loads(filters) if filters else None,
+            include_stations=stations
+        )
+        print(stats)
+    
+    @app.cli.command('reprice')
+    @click.option('--cost', 'costs', type=VehicleCost(), multiple=True, required=True, help='VEHICLE=COST_PER_KWH, repeatable')
+    @click.option('--start-date', help='Only reprice trips starting on or after this timestamp')
+    @click.option('--end-date', help='Only reprice trips starting on or before this timestamp')
+    @click.option('--dry-run', is_flag=True, help='Report affected trips and bytes without changing anything')
+    def reprice_command(costs, start_date, end_date, dry_run):
+        """Update vehicle electricity costs and recompute trip costs"""
+        print(trips_db.reprice_trips(dict(costs), start_date=start_date, end_date=end_date, dry_run=dry_run))
+    
+    @app.cli.command('import-trips')
+    @click.argument('path')
+    @click.option('--user-id', help='user_id for rows that don\'t have one')
+    @click.option('--chunk-rows', type=int, help='Rows per load job')
+    @click.option('--restart', is_flag=True, help='Ignore saved progress and start from the first row')
+    def import_trips_command(path, user_id, chunk_rows, restart):
+        """Load historical trips from a CSV or Parquet file (run rebuild-heatmap after for trips without route_geometry)"""
+        from app.services.trip_import import TripImporter
+        print(TripImporter(trips_db).import_file(path, user_id=user_id, chunk_rows=chunk_rows, restart=restart))
+    
+    @app.cli.command('rebuild-heatmap')
+    def rebuild_heatmap_command():
+        """Rebuild the route heatmap from every stored trip"""
+        from app.services.heatmap import get_heatmap
+        heatmap = get_heatmap()
+        heatmap.clear()
+        count = 0
+        for trip in trips_db.search_trips():
+            if trip.get('route_geometry'):
+                heatmap.add_trip(trip['user_id'], json.loads(trip['route_geometry']), trip.get('energy_used_kWh'))
+                count += 1
+        heatmap.flush()
+        print(f"Added {count} trips to the heatmap")
+    
+    @app.cli.command('bench-logins')
+    @click.option('--threads', type=click.IntRange(min=1), default=16, help='Concurrent callers')
+    @click.option('--seconds', type=click.FloatRange(min=0.1), default=10.0, help='How long to run')
+    @click.option('--inline', is_flag=True, help='Check passwords on the calling threads instead of the hash pool')
+    def bench_logins_command(threads, seconds, inline):
+        """Measure password checks per second, the CPU cost of a login"""
+        from app.services.passwords import hasher, benchmark_logins
+        print(benchmark_logins(hasher, threads, seconds, inline=inline))
+    
+    @app.cli.command('query-report')
+    @click.option('--order', type=click.Choice(['bytes', 'latency', 'calls', 'slots']), default='bytes')
+    @click.option('--limit', type=int, default=20)
+    @click.option('--by-name', is_flag=True, help='Fold each query\'s stats across endpoints')
+    @click.option('--reset', is_flag=True, help='Clear the recorded stats after printing')
+    def query_report_command(order, limit, by_name, reset):
+        """Show the top BigQuery queries by cost or latency"""
+        from app.services.query_profiler import query_profiler
+        for row in query_profiler.report(order=order, limit=limit, by_endpoint=not by_name):
+            print(row)
+        if reset:
+            query_profiler.reset()
     
     return app
 
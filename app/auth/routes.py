@@ -1,8 +1,11 @@
 from flask import Blueprint, request, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import login_user, logout_user, login_required, current_user
 from app.models import User
 from app.database import BigQueryDatabase
+from app.services.passwords import hasher
+from app.services.user_index import user_index
+from app.services.query_profiler import QueryBudgetExceeded
+from app.errors import handle_query_budget_error
 import logging
 import uuid
 import traceback
@@ -21,9 +24,11 @@ def register():
         if not all(k in data for k in ['username', 'email', 'password']):
             return jsonify({'error': 'Missing required fields'}), 400
 
-        # Check if username already exists
-        if db.check_username_exists(data['username']):
+        # Known names are rejected without touching BigQuery
+        if user_index.has_username(data['username']):
             return jsonify({'error': 'Username already exists'}), 400
+        if user_index.has_email(data['email']):
+            return jsonify({'error': 'Email already exists'}), 400
 
         # Generate UUID for new user
         user_id = str(uuid.uuid4())
@@ -33,14 +38,20 @@ def register():
             'user_id': user_id,
             'username': data['username'],
             'email': data['email'],
-            'password_hash': generate_password_hash(data['password'])
+            'password_hash': hasher.hash(data['password'])
         }
         
-        db.create_user(user_data)
+        # Anything the index missed is caught by the conditional insert
+        if not db.create_user_if_absent(user_data):
+            return jsonify({'error': 'Username or email already exists'}), 400
+        user_index.add(user_data['username'], user_data['email'])
         logger.info(f"Successfully registered user: {user_data['username']} with ID: {user_id}")
         
         return jsonify({'message': 'Registration successful'}), 201
 
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
     except Exception as e:
         logger.error(f"Registration error: {str(e)}")
         return jsonify({'error': 'Registration failed'}), 500
@@ -65,10 +76,19 @@ def login():
         logger.info(f"Found user: {user_data['username']}")
 
         # Check password
-        if not check_password_hash(user_data['password_hash'], data['password']):
+        if not hasher.verify(user_data['password_hash'], data['password']):
             logger.error("Password check failed")
             return jsonify({'error': 'Login failed'}), 401
 
+        # Upgrade the stored hash if the hashing config has changed
+        if hasher.needs_rehash(user_data['password_hash']):
+            try:
+                user_data['password_hash'] = hasher.hash(data['password'])
+                db.update_password_hash(user_data['user_id'], user_data['password_hash'])
+                logger.info(f"Rehashed password for user: {user_data['username']}")
+            except Exception as e:
+                logger.error(f"Password rehash failed: {str(e)}")
+
         # Create user object and log them in
         user = User(user_data)
         login_user(user)
@@ -76,6 +96,9 @@ def login():
 
         return jsonify({'message': 'Login successful'}), 200
 
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
     except Exception as e:
         logger.error(f"Login error: {str(e)}\n{traceback.format_exc()}")
         return jsonify({'error': 'Login failed'}), 500
@@ -1,18 +1,70 @@
 from flask import current_app
 from google.cloud import bigquery
 from google.oauth2 import service_account
+from google.api_core.exceptions import BadRequest, NotFound
 import logging
 import os
 from config import Config
 from werkzeug.security import check_password_hash
 import requests
 import json
-from app.services.charging import ChargingService
+from app.models import TripBatch
+from app.schemas import USERS_SCHEMA, TRIPS_SCHEMA, ROUTES_SCHEMA, TRIP_STATIONS_SCHEMA, LOCKS_SCHEMA
+from app.services.routing import RoutingService
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.charging_planner import plan_charging_stops
+from app.services.heatmap import record_trip
+from app.services.trip_versions import bump_trip_versions
+from app.services.query_profiler import query_profiler
+from app.services.stages import StageGraph
+from app.services.route_store import route_cache, route_hash, canonical_geometry, leg_key, join_geometries
+from app.services.station_tiles import (
+    get_tile_cache, tile_key, tile_center, corridor_tiles, stations_in_corridor,
+    fetch_tile, find_corridor_stations
+)
+import concurrent.futures
 import uuid
 import traceback
+import random
+import time
 
 logger = logging.getLogger(__name__)
 
+# Stages of create_trip, in the order their failures are reported
+CREATE_TRIP_STAGES = (
+    'route', 'vehicle', 'energy', 'stored_route', 'store_route', 'insert_trip',
+    'stations', 'store_route_stations', 'insert_stations', 'charging_plan'
+)
+
+# Column order and parameter types for trip inserts
+TRIP_INSERT_COLUMNS = [
+    ("trip_id", "STRING"),
+    ("user_id", "STRING"),
+    ("car_type", "STRING"),
+    ("battery_level_start", "FLOAT64"),
+    ("start_lat", "FLOAT64"),
+    ("start_lng", "FLOAT64"),
+    ("end_lat", "FLOAT64"),
+    ("end_lng", "FLOAT64"),
+    ("start_date", "TIMESTAMP"),
+    ("duration_seconds", "INTEGER"),
+    ("distance_meters", "FLOAT64"),
+    ("average_speed_kph", "FLOAT64"),
+    ("route_geometry", "STRING"),
+    ("energy_used_kWh", "FLOAT64"),
+    ("cost_dollars", "FLOAT64"),
+    ("start_battery_capacity_kWh", "FLOAT64"),
+    ("route_hash", "STRING"),
+    ("legs", "STRING"),
+    ("updated_at", "TIMESTAMP")
+]
+
+# Trip columns set to the time of the write rather than passed as parameters
+TRIP_TIMESTAMP_COLUMNS = ('start_date', 'updated_at')
+
+# Tile cache namespace for OCM results fetched with Config.OCM_API_KEY in verbose form
+OCM_TILE_SOURCE = 'ocm'
+
 class BigQueryDatabase:
     def __init__(self):
         # Initialize BigQuery client using application default credentials
@@ -22,6 +74,70 @@ class BigQueryDatabase:
         self.trips_table = 'trips'
         self.trip_stations_table = 'trip_stations'
         self.osrm_base_url = Config.OSRM_BASE_URL
+        self.routing = RoutingService(self.osrm_base_url)
+
+    def run_job(self, name, query, job_config=None, timeout=None):
+        """Run a named query through the profiler and return the finished job"""
+        return query_profiler.run(self.client, name, query, job_config, timeout=timeout)[0]
+
+    def run_query(self, name, query, job_config=None, timeout=None, page_size=None):
+        """Run a named query through the profiler and return its rows"""
+        return query_profiler.run(self.client, name, query, job_config, timeout=timeout, page_size=page_size)[1]
+
+    def migrate_schema(self):
+        """
+        Bring the dataset's tables in line with app.schemas: create missing
+        tables, add missing columns and relax columns that became NULLABLE
+        (e.g. trips.route_geometry once geometry moved to the routes table).
+        Only additive changes are made, so it's safe to run repeatedly.
+        Returns a list of the changes made.
+        """
+        tables = {
+            Config.BQ_USERS_TABLE: USERS_SCHEMA,
+            Config.BQ_TRIPS_TABLE: TRIPS_SCHEMA,
+            Config.BQ_ROUTES_TABLE: ROUTES_SCHEMA,
+            Config.BQ_TRIP_STATIONS_TABLE: TRIP_STATIONS_SCHEMA,
+            Config.BQ_LOCKS_TABLE: LOCKS_SCHEMA
+        }
+        changes = []
+        for name, schema in tables.items():
+            table_id = f"{self.client.project}.{self.dataset}.{name}"
+            try:
+                table = self.client.get_table(table_id)
+            except NotFound:
+                self.client.create_table(bigquery.Table(table_id, schema=schema))
+                changes.append(f"created {name}")
+                continue
+                
+            existing = {field.name: field for field in table.schema}
+            new_schema = []
+            for field in table.schema:
+                wanted = next((w for w in schema if w.name == field.name), None)
+                if wanted is not None and field.mode == 'REQUIRED' and wanted.mode != 'REQUIRED':
+                    field = bigquery.SchemaField(field.name, field.field_type, mode='NULLABLE', description=field.description)
+                    changes.append(f"relaxed {name}.{field.name} to NULLABLE")
+                new_schema.append(field)
+            for field in schema:
+                if field.name not in existing:
+                    # BigQuery can only add NULLABLE (or REPEATED) columns to an existing table
+                    new_schema.append(bigquery.SchemaField(field.name, field.field_type, mode='NULLABLE'))
+                    changes.append(f"added {name}.{field.name}")
+                    
+            if new_schema != list(table.schema):
+                table.schema = new_schema
+                self.client.update_table(table, ['schema'])
+                
+        # Registration's lock row has to exist before two registrations race to create it
+        job = self.run_job('seed_locks', f"""
+        MERGE `{self.dataset}.{Config.BQ_LOCKS_TABLE}` l
+        USING (SELECT 'users' AS name) s
+        ON l.name = s.name
+        WHEN NOT MATCHED THEN
+            INSERT (name, version, updated_at) VALUES (s.name, 0, CURRENT_TIMESTAMP())
+        """)
+        if job.num_dml_affected_rows:
+            changes.append(f"seeded {Config.BQ_LOCKS_TABLE}.users")
+        return changes
 
     @staticmethod
     def execute_query(query, params=None):
@@ -29,8 +145,7 @@ class BigQueryDatabase:
             job_config = bigquery.QueryJobConfig(
                 query_parameters=params if params else []
             )
-            query_job = current_app.bigquery_client.query(query, job_config=job_config)
-            return query_job.result()
+            return query_profiler.run(current_app.bigquery_client, 'execute_query', query, job_config)[1]
         except Exception as e:
             logger.error(f"Database error: {str(e)}")
             raise
@@ -49,7 +164,7 @@ class BigQueryDatabase:
             ]
         )
         
-        results = self.client.query(query, job_config=job_config).result()
+        results = self.run_query('get_user_by_username', query, job_config)
         user = next(iter(results), None)
         
         if user:
@@ -75,136 +190,1111 @@ class BigQueryDatabase:
             ]
         )
         
-        self.client.query(query, job_config=job_config).result()
+        self.run_query('create_user', query, job_config)
+
+    def create_user_if_absent(self, user_data):
+        """
+        Insert a user only if the username and email are both unused.
+        Returns False if either is taken.
+        
+        Concurrent INSERTs don't conflict in BigQuery, so two conditional
+        inserts for the same name could both succeed. Instead the check and
+        insert run in a transaction that also bumps the 'users' row of the
+        locks table: transactions mutating the same table can't commit
+        concurrently, so a racing registration is aborted and, on retry,
+        sees the committed user.
+        """
+        script = f"""
+        BEGIN TRANSACTION;
+        
+        MERGE `{self.dataset}.{Config.BQ_LOCKS_TABLE}` l
+        USING (SELECT 'users' AS name) s
+        ON l.name = s.name
+        WHEN MATCHED THEN
+            UPDATE SET version = l.version + 1, updated_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN
+            INSERT (name, version, updated_at) VALUES (s.name, 1, CURRENT_TIMESTAMP());
+        
+        INSERT INTO `{self.dataset}.{self.users_table}`
+        (user_id, username, email, password_hash, created_at)
+        SELECT @user_id, @username, @email, @password_hash, CURRENT_TIMESTAMP()
+        FROM UNNEST([1])
+        WHERE NOT EXISTS (
+            SELECT 1
+            FROM `{self.dataset}.{self.users_table}`
+            WHERE username = @username OR email = @email
+        );
+        
+        COMMIT TRANSACTION;
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("user_id", "STRING", user_data['user_id']),
+                bigquery.ScalarQueryParameter("username", "STRING", user_data['username']),
+                bigquery.ScalarQueryParameter("email", "STRING", user_data['email']),
+                bigquery.ScalarQueryParameter("password_hash", "STRING", user_data['password_hash'])
+            ]
+        )
+        
+        for attempt in range(Config.REGISTRATION_MAX_ATTEMPTS):
+            try:
+                job = self.run_job('create_user_if_absent', script, job_config)
+                break
+            except BadRequest as e:
+                if 'concurrent update' not in str(e) or attempt == Config.REGISTRATION_MAX_ATTEMPTS - 1:
+                    raise
+                logger.info(f"Registration for {user_data['username']} conflicted with another; retrying")
+                time.sleep(random.uniform(0.1, 0.5) * (attempt + 1))
+                
+        return any(
+            child.statement_type == 'INSERT' and child.num_dml_affected_rows
+            for child in self.client.list_jobs(parent_job=job.job_id)
+        )
+
+    def get_all_usernames_and_emails(self):
+        query = f"""
+        SELECT username, email
+        FROM `{self.dataset}.{self.users_table}`
+        """
+        
+        results = self.run_query('get_all_usernames_and_emails', query)
+        usernames, emails = set(), set()
+        for row in results:
+            usernames.add(row['username'])
+            emails.add(row['email'])
+        return usernames, emails
+
+    def update_password_hash(self, user_id, password_hash):
+        query = f"""
+        UPDATE `{self.dataset}.{self.users_table}`
+        SET password_hash = @password_hash
+        WHERE user_id = @user_id
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("user_id", "STRING", user_id),
+                bigquery.ScalarQueryParameter("password_hash", "STRING", password_hash)
+            ]
+        )
+        
+        self.run_query('update_password_hash', query, job_config)
 
-    def create_trip(self, user_id, car_type, battery_level_start, start_coords, end_coords):
+    def get_vehicles(self, car_types, deadline=None):
+        """Get efficiency and cost data for several vehicle types in one query, keyed by vehicle name"""
+        query = f"""
+        SELECT Vehicle, A, B, C, CostPer_kWh_Dollars, BatteryCapacity_kWh
+        FROM `{self.dataset}.{Config.BQ_CAR_ENERGY_COSTS_TABLE}`
+        WHERE Vehicle IN UNNEST(@car_types)
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("car_types", "STRING", sorted(car_types))
+            ]
+        )
+        
         try:
-            trip_id = str(uuid.uuid4())
+            timeout = deadline.timeout() if deadline else None
+            results = self.run_query('get_vehicles', query, job_config, timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            raise DeadlineExceeded("Vehicle lookup timed out")
+        return {row['Vehicle']: dict(row) for row in results}
+
+    def reprice_trips(self, costs, start_date=None, end_date=None, dry_run=False):
+        """
+        Set new per-kWh costs for vehicles and recompute cost_dollars for their
+        trips, and for each leg of multi-stop trips (optionally only trips
+        starting within [start_date, end_date]). Both updates run in one transaction in a single job. With dry_run nothing is
+        changed; the affected trips are counted and the job's bytes estimated.
+        costs: {vehicle name: cost per kWh in dollars}
+        """
+        trip_conditions = ["t.car_type = s.vehicle"]
+        params = [
+            bigquery.ArrayQueryParameter("costs", "STRUCT", [
+                bigquery.StructQueryParameter(
+                    None,
+                    bigquery.ScalarQueryParameter("vehicle", "STRING", vehicle),
+                    bigquery.ScalarQueryParameter("cost", "FLOAT64", cost)
+                )
+                for vehicle, cost in sorted(costs.items())
+            ])
+        ]
+        if start_date:
+            trip_conditions.append("t.start_date >= @start_date")
+            params.append(bigquery.ScalarQueryParameter("start_date", "TIMESTAMP", start_date))
+        if end_date:
+            trip_conditions.append("t.start_date <= @end_date")
+            params.append(bigquery.ScalarQueryParameter("end_date", "TIMESTAMP", end_date))
+        where = ' AND '.join(trip_conditions)
+        
+        # One transaction, so prices never change without the trips priced from them
+        script = f"""
+        BEGIN TRANSACTION;
+        
+        UPDATE `{self.dataset}.{Config.BQ_CAR_ENERGY_COSTS_TABLE}` c
+        SET CostPer_kWh_Dollars = s.cost
+        FROM UNNEST(@costs) s
+        WHERE c.Vehicle = s.vehicle;
+        
+        UPDATE `{self.dataset}.{Config.BQ_TRIPS_TABLE}` t
+        SET cost_dollars = t.energy_used_kWh * s.cost,
+            legs = IF(t.legs IS NULL, NULL, (
+                SELECT TO_JSON_STRING(ARRAY_AGG(
+                    JSON_SET(leg, '$.cost_dollars', LAX_FLOAT64(leg.energy_used_kWh) * s.cost) ORDER BY i
+                ))
+                FROM UNNEST(JSON_QUERY_ARRAY(PARSE_JSON(t.legs))) leg WITH OFFSET i
+            )),
+            updated_at = CURRENT_TIMESTAMP()
+        FROM UNNEST(@costs) s
+        WHERE {where} AND t.energy_used_kWh IS NOT NULL;
+        
+        COMMIT TRANSACTION;
+        """
+        
+        if dry_run:
+            estimate = self.run_job(
+                'reprice_trips_estimate', script, bigquery.QueryJobConfig(query_parameters=params, dry_run=True)
+            )
+            query = f"""
+            SELECT COUNT(*) AS trips,
+                   SUM(t.energy_used_kWh * s.cost - IFNULL(t.cost_dollars, 0)) AS cost_change_dollars
+            FROM `{self.dataset}.{Config.BQ_TRIPS_TABLE}` t
+            JOIN UNNEST(@costs) s ON {where}
+            WHERE t.energy_used_kWh IS NOT NULL
+            """
+            row = next(iter(self.run_query(
+                'reprice_trips_preview', query, bigquery.QueryJobConfig(query_parameters=params)
+            )))
+            return {
+                'dry_run': True,
+                'vehicles': len(costs),
+                'trips': row['trips'],
+                'cost_change_dollars': row['cost_change_dollars'] or 0.0,
+                'bytes_processed': estimate.total_bytes_processed
+            }
+            
+        job = self.run_job('reprice_trips', script, bigquery.QueryJobConfig(query_parameters=params))
+        
+        # Each statement of the script runs as a child job
+        children = sorted(self.client.list_jobs(parent_job=job.job_id), key=lambda child: child.created)
+        affected = [child.num_dml_affected_rows or 0 for child in children if child.statement_type == 'UPDATE']
+        vehicles_updated, trips_updated = (affected + [0, 0])[:2]
+        if trips_updated:
+            bump_trip_versions(everyone=True)
+        return {
+            'dry_run': False,
+            'vehicles': vehicles_updated,
+            'trips': trips_updated,
+            'bytes_processed': job.total_bytes_processed
+        }
+
+    @staticmethod
+    def calculate_trip_energy(route, vehicle_data, battery_level_start):
+        """Compute speed, energy, cost and starting battery capacity for a route"""
+        # Calculate average speed
+        average_speed_kph = (route['distance']/1000)/(route['duration']/3600)
+        
+        # Calculate efficiency (Wh/km)
+        efficiency = (vehicle_data['A'] + 
+                     vehicle_data['B'] * average_speed_kph + 
+                     vehicle_data['C'] * (average_speed_kph ** 2))
+        
+        # Calculate energy used (kWh)
+        energy_used = (route['distance'] / 1000) * (efficiency / 1000)
+        
+        return {
+            'average_speed_kph': average_speed_kph,
+            'energy_used_kWh': energy_used,
+            'cost_dollars': energy_used * vehicle_data['CostPer_kWh_Dollars'],
+            'start_battery_capacity_kWh': (battery_level_start / 100) * vehicle_data['BatteryCapacity_kWh']
+        }
+
+    def _trip_row(self, trip_id, user_id, car_type, battery_level_start, start_coords, end_coords, route, energy):
+        # The geometry itself lives in the routes table, referenced by route_hash
+        return {
+            'trip_id': trip_id,
+            'user_id': user_id,
+            'car_type': car_type,
+            'battery_level_start': battery_level_start,
+            'start_lat': start_coords[0],
+            'start_lng': start_coords[1],
+            'end_lat': end_coords[0],
+            'end_lng': end_coords[1],
+            'duration_seconds': int(route['duration']),
+            'distance_meters': route['distance'],
+            'average_speed_kph': energy['average_speed_kph'],
+            'route_geometry': None,
+            'energy_used_kWh': energy['energy_used_kWh'],
+            'cost_dollars': energy['cost_dollars'],
+            'start_battery_capacity_kWh': energy['start_battery_capacity_kWh'],
+            'route_hash': route_hash(route['geometry']),
+            'legs': None
+        }
+
+    def insert_trips(self, rows):
+        """
+        Store trip rows with as few INSERTs as BigQuery's parameter and request
+        size limits allow; start_date and updated_at are set to the insert time
+        """
+        self._insert_in_chunks(
+            'insert_trips', self._insert_trip_chunk, rows, len(TRIP_INSERT_COLUMNS) - len(TRIP_TIMESTAMP_COLUMNS)
+        )
+        if rows:
+            bump_trip_versions(*{row['user_id'] for row in rows})
+
+    def _insert_trip_chunk(self, rows):
+        value_parts = []
+        params = []
+        for n, row in enumerate(rows):
+            value_parts.append(
+                "(" + ", ".join(
+                    "CURRENT_TIMESTAMP()" if column in TRIP_TIMESTAMP_COLUMNS else f"@{column}_{n}"
+                    for column, _ in TRIP_INSERT_COLUMNS
+                ) + ")"
+            )
+            params.extend(
+                bigquery.ScalarQueryParameter(f"{column}_{n}", column_type, row[column])
+                for column, column_type in TRIP_INSERT_COLUMNS if column not in TRIP_TIMESTAMP_COLUMNS
+            )
             
-            # Get route from OSRM
-            route_url = f"{self.osrm_base_url}{start_coords[1]},{start_coords[0]};{end_coords[1]},{end_coords[0]}?geometries=geojson&overview=full"
-            response = requests.get(route_url)
-            route_data = response.json()
+        query = f"""
+        INSERT INTO `{self.dataset}.{Config.BQ_TRIPS_TABLE}`
+        ({', '.join(column for column, _ in TRIP_INSERT_COLUMNS)})
+        VALUES
+        {', '.join(value_parts)}
+        """
+        
+        job_config = bigquery.QueryJobConfig(query_parameters=params)
+        self.run_query('insert_trips', query, job_config)
+
+    def _insert_in_chunks(self, name, insert_chunk, rows, params_per_row):
+        """
+        Split rows for multi-row parameterized INSERTs so each stays under
+        BQ_INSERT_MAX_PARAMETERS and roughly BQ_INSERT_MAX_BYTES of values, and
+        run the chunks concurrently when there is more than one
+        """
+        chunks = []
+        chunk, size = [], 0
+        for row in rows:
+            row_bytes = len(json.dumps(row, default=str))
+            if chunk and (
+                (len(chunk) + 1) * params_per_row > Config.BQ_INSERT_MAX_PARAMETERS
+                or size + row_bytes > Config.BQ_INSERT_MAX_BYTES
+            ):
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append(row)
+            size += row_bytes
+        if chunk:
+            chunks.append(chunk)
             
-            if response.status_code != 200 or 'routes' not in route_data or not route_data['routes']:
-                raise Exception("Failed to get route from OSRM")
-                
-            route = route_data['routes'][0]
+        if len(chunks) <= 1:
+            for chunk in chunks:
+                insert_chunk(chunk)
+            return
+        logger.info(f"Splitting {name} of {len(rows)} rows into {len(chunks)} INSERTs")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(chunks), Config.TRIP_BATCH_WORKERS)) as executor:
+            for future in [executor.submit(insert_chunk, chunk) for chunk in chunks]:
+                future.result()
+
+    def store_routes(self, routes):
+        """
+        Store routes by hash. routes: list of (route_hash, route, stations)
+        where stations is None when the corridor search was incomplete.
+
+        Routes not known to be stored are appended with INSERT ... WHERE NOT
+        EXISTS, which doesn't count against BigQuery's per-table limit on
+        concurrent mutating DML, so trips on new routes don't queue behind or
+        conflict with each other. Only refreshing the stations of a stored
+        route runs an UPDATE. Two hosts can race to insert the same route;
+        readers take one row per hash.
+        """
+        inserts = {}
+        refreshes = {}
+        for key, route, stations in routes:
+            cached = route_cache.get(key)
+            if cached is None:
+                inserts[key] = (route, stations)
+            elif stations is not None and self._fresh_stations(cached) is None:
+                refreshes[key] = (route, stations)
             
-            # Calculate average speed
-            average_speed_kph = (route['distance']/1000)/(route['duration']/3600)
+        if inserts:
+            query = f"""
+            INSERT INTO `{self.dataset}.{Config.BQ_ROUTES_TABLE}`
+                (route_hash, route_geometry, distance_meters, duration_seconds,
+                 stations, stations_updated_at, created_at)
+            SELECT s.route_hash, s.route_geometry, s.distance_meters, s.duration_seconds,
+                   s.stations, IF(s.stations IS NULL, NULL, CURRENT_TIMESTAMP()), CURRENT_TIMESTAMP()
+            FROM UNNEST(@routes) s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM `{self.dataset}.{Config.BQ_ROUTES_TABLE}` r WHERE r.route_hash = s.route_hash
+            )
+            """
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ArrayQueryParameter("routes", "STRUCT", [
+                    bigquery.StructQueryParameter(
+                        None,
+                        bigquery.ScalarQueryParameter("route_hash", "STRING", key),
+                        bigquery.ScalarQueryParameter("route_geometry", "STRING", canonical_geometry(route['geometry'])),
+                        bigquery.ScalarQueryParameter("distance_meters", "FLOAT64", route['distance']),
+                        bigquery.ScalarQueryParameter("duration_seconds", "INTEGER", int(route['duration'])),
+                        bigquery.ScalarQueryParameter("stations", "STRING", json.dumps(stations) if stations is not None else None)
+                    )
+                    for key, (route, stations) in inserts.items()
+                ])]
+            )
+            self.run_query('store_routes', query, job_config)
             
-            # Get vehicle efficiency parameters and battery capacity from car_energy_costs table
+        if refreshes:
             query = f"""
-            SELECT A, B, C, CostPer_kWh_Dollars, BatteryCapacity_kWh
-            FROM `{self.dataset}.car_energy_costs`
-            WHERE Vehicle = @car_type
-            LIMIT 1
+            UPDATE `{self.dataset}.{Config.BQ_ROUTES_TABLE}` r
+            SET stations = s.stations, stations_updated_at = CURRENT_TIMESTAMP()
+            FROM UNNEST(@routes) s
+            WHERE r.route_hash = s.route_hash
+            """
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ArrayQueryParameter("routes", "STRUCT", [
+                    bigquery.StructQueryParameter(
+                        None,
+                        bigquery.ScalarQueryParameter("route_hash", "STRING", key),
+                        bigquery.ScalarQueryParameter("stations", "STRING", json.dumps(stations))
+                    )
+                    for key, (route, stations) in refreshes.items()
+                ])]
+            )
+            self.run_query('refresh_route_stations', query, job_config)
+        
+        now = time.time()
+        for key, (route, stations) in {**inserts, **refreshes}.items():
+            cached = route_cache.get(key) or {}
+            route_cache.put(key, {
+                'route_geometry': canonical_geometry(route['geometry']),
+                'distance_meters': route['distance'],
+                'duration_seconds': int(route['duration']),
+                'stations': stations if stations is not None else cached.get('stations'),
+                'stations_updated_at': now if stations is not None else cached.get('stations_updated_at')
+            })
+
+    def get_routes(self, route_hashes):
+        """Get stored routes by hash, from the in-process cache where possible"""
+        found = {}
+        missing = []
+        for key in set(route_hashes):
+            cached = route_cache.get(key)
+            if cached:
+                found[key] = cached
+            else:
+                missing.append(key)
+                
+        if missing:
+            query = f"""
+            SELECT route_hash, route_geometry, distance_meters, duration_seconds,
+                   stations, stations_updated_at
+            FROM `{self.dataset}.{Config.BQ_ROUTES_TABLE}`
+            WHERE route_hash IN UNNEST(@route_hashes)
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY route_hash ORDER BY stations_updated_at DESC) = 1
             """
             
             job_config = bigquery.QueryJobConfig(
                 query_parameters=[
-                    bigquery.ScalarQueryParameter("car_type", "STRING", car_type)
+                    bigquery.ArrayQueryParameter("route_hashes", "STRING", missing)
                 ]
             )
             
-            results = self.client.query(query, job_config=job_config).result()
-            vehicle_data = next(iter(results), None)
-            
-            if not vehicle_data:
-                raise Exception(f"No efficiency data found for vehicle type: {car_type}")
+            for row in self.run_query('get_routes', query, job_config):
+                entry = {
+                    'route_geometry': row['route_geometry'],
+                    'distance_meters': row['distance_meters'],
+                    'duration_seconds': row['duration_seconds'],
+                    'stations': json.loads(row['stations']) if row['stations'] else None,
+                    'stations_updated_at': row['stations_updated_at'].timestamp() if row['stations_updated_at'] else None
+                }
+                route_cache.put(row['route_hash'], entry)
+                found[row['route_hash']] = entry
                 
-            # Calculate efficiency (Wh/km)
-            efficiency = (vehicle_data['A'] + 
-                         vehicle_data['B'] * average_speed_kph + 
-                         vehicle_data['C'] * (average_speed_kph ** 2))
+        return found
+
+    @staticmethod
+    def _fresh_stations(entry):
+        """Return a stored route's stations if they're recent enough to reuse, else None"""
+        if entry.get('stations') is None or not entry.get('stations_updated_at'):
+            return None
+        if time.time() - entry['stations_updated_at'] > Config.ROUTE_STATIONS_TTL_HOURS * 3600:
+            return None
+        return entry['stations']
+
+    def attach_route_geometry(self, trips):
+        """Fill in route_geometry for trips that reference stored routes, joining legs for multi-stop trips"""
+        route_hashes = []
+        for trip in trips:
+            if trip.get('route_geometry'):
+                continue
+            if trip.get('legs'):
+                route_hashes.extend(leg['route_hash'] for leg in json.loads(trip['legs']))
+            elif trip.get('route_hash'):
+                route_hashes.append(trip['route_hash'])
+        if not route_hashes:
+            return trips
+            
+        routes = self.get_routes(route_hashes)
+        for trip in trips:
+            if trip.get('route_geometry'):
+                continue
+            if trip.get('legs'):
+                leg_hashes = [leg['route_hash'] for leg in json.loads(trip['legs'])]
+                if all(key in routes for key in leg_hashes):
+                    trip['route_geometry'] = json.dumps(join_geometries(
+                        json.loads(routes[key]['route_geometry']) for key in leg_hashes
+                    ))
+            elif trip.get('route_hash') in routes:
+                trip['route_geometry'] = routes[trip['route_hash']]['route_geometry']
+        return trips
+
+    def _plan_charging(self, route, energy, vehicle_data, car_type, stations):
+        """Charging stops for a trip; a planner failure shouldn't fail the trip"""
+        try:
+            return plan_charging_stops(
+                route['geometry'], energy['energy_used_kWh'], energy['start_battery_capacity_kWh'],
+                vehicle_data['BatteryCapacity_kWh'], stations, car_type
+            )
+        except Exception as e:
+            logger.error(f"Error planning charging stops: {str(e)}")
+            return None
+
+    def create_trip(self, user_id, car_type, battery_level_start, start_coords, end_coords, deadline=None):
+        """
+        Plan and store a trip. The work runs as a small graph of stages so that
+        independent ones overlap: the vehicle lookup runs alongside routing, and
+        the trip insert alongside the charging-station search, so latency is
+        roughly route -> stations -> station insert rather than the sum of all
+        stages. A new route is stored before the trip that references it.
+        Per-stage timings are logged and returned under 'timings'.
+        """
+        try:
+            trip_id = str(uuid.uuid4())
+            deadline = deadline or Deadline(Config.TRIP_DEADLINE_SECONDS)
+
+            stages = StageGraph()
+            stages.add('route', self.routing.get_route, start_coords, end_coords, deadline=deadline)
+            stages.add('vehicle', self._vehicle_data, car_type, deadline)
+            stages.add(
+                'energy', self._trip_energy_row, trip_id, user_id, car_type, battery_level_start,
+                start_coords, end_coords, after=('route', 'vehicle')
+            )
+            stages.add('stored_route', lambda route: self.get_routes([route_hash(route['geometry'])]), after=('route',))
+            # Before the trip insert, so a stored trip never references a missing route
+            stages.add(
+                'store_route', lambda route, stored: self.store_routes([(route_hash(route['geometry']), route, None)]),
+                after=('route', 'stored_route')
+            )
+            stages.add(
+                'insert_trip', lambda route, energy, stored: self._insert_trip(route, energy, user_id),
+                after=('route', 'energy', 'store_route')
+            )
+            stages.add('stations', self._route_stations, deadline, after=('route', 'stored_route'))
+            stages.add('store_route_stations', self._store_route_stations, after=('route', 'stations', 'store_route'))
+            # Stations reference the trip, so they're only stored once it is
+            stages.add(
+                'insert_stations', lambda found, inserted: self.store_trip_stations(trip_id, found[0]),
+                after=('stations', 'insert_trip')
+            )
+            stages.add(
+                'charging_plan',
+                lambda route, vehicle_data, energy, found: self._plan_charging(
+                    route, energy[0], vehicle_data, car_type, found[0]
+                ),
+                after=('route', 'vehicle', 'energy', 'stations')
+            )
+
+            # Let every stage settle, then surface the first failure in stage order
+            stages.wait()
+            results = {name: stages.result(name) for name in CREATE_TRIP_STAGES}
+
+            timings = stages.summary()
+            logger.info(f"Created trip {trip_id} in {timings['total_ms']} ms: {timings['stages']}")
+
+            route = results['route']
+            energy, trip_row = results['energy']
+            stations, pending_points, searched = results['stations']
+            return {
+                'trip_id': trip_id,
+                'route_hash': trip_row['route_hash'],
+                'route': {
+                    'distance': route['distance'],
+                    'duration': route['duration'],
+                    'geometry': route['geometry']
+                },
+                'energy': {
+                    'used_kWh': energy['energy_used_kWh'],
+                    'cost_dollars': energy['cost_dollars'],
+                    'start_battery_capacity_kWh': energy['start_battery_capacity_kWh']
+                },
+                'stations': stations,
+                'stations_partial': bool(pending_points),
+                'stations_pending_points': pending_points,
+                'charging_plan': results['charging_plan'],
+                'timings': timings
+            }
+            
+        except Exception as e:
+            logger.error(f"Error creating trip: {str(e)}")
+            raise
+
+    def _vehicle_data(self, car_type, deadline):
+        """Efficiency parameters and battery capacity from the car_energy_costs table"""
+        vehicle_data = self.get_vehicles([car_type], deadline=deadline).get(car_type)
+        if not vehicle_data:
+            raise Exception(f"No efficiency data found for vehicle type: {car_type}")
+        return vehicle_data
+
+    def _trip_energy_row(self, route, vehicle_data, trip_id, user_id, car_type, battery_level_start,
+                         start_coords, end_coords):
+        """(energy, trip row) for a single-leg trip"""
+        energy = self.calculate_trip_energy(route, vehicle_data, battery_level_start)
+        trip_row = self._trip_row(
+            trip_id, user_id, car_type, battery_level_start,
+            start_coords, end_coords, route, energy
+        )
+        return energy, trip_row
+
+    def _insert_trip(self, route, energy_row, user_id):
+        """Store a trip in BigQuery and add it to the heatmap"""
+        energy, trip_row = energy_row
+        self.insert_trips([trip_row])
+        record_trip(user_id, route['geometry'], energy['energy_used_kWh'])
+
+    def _route_stations(self, route, stored, deadline):
+        """
+        (stations, pending points, searched) along a route. Reuses stations from
+        an earlier trip on the same route, otherwise searches, keeping whatever
+        was found if the deadline runs out.
+        """
+        entry = stored.get(route_hash(route['geometry']))
+        stations = self._fresh_stations(entry) if entry else None
+        if stations is not None:
+            return stations, [], False
+        stations, pending_points = self.find_charging_stations_along_route(route['geometry'], deadline=deadline)
+        return stations, pending_points, True
+
+    def _store_route_stations(self, route, found, stored):
+        """
+        Save a complete station search with the route for later trips on it.
+        This only feeds a cache and runs after the trip is stored, so a failure
+        is logged rather than failing the trip.
+        """
+        stations, pending_points, searched = found
+        if not searched or pending_points:
+            return
+        try:
+            self.store_routes([(route_hash(route['geometry']), route, stations)])
+        except Exception as e:
+            logger.error(f"Error storing route stations: {str(e)}")
+
+    def _route_legs(self, waypoints, car_type, deadline, known_routes=None):
+        """
+        Route each consecutive pair of (lat, lng) waypoints, alongside the vehicle lookup.
+        known_routes maps leg_key(start, end) to a stored route hash; those legs come
+        from the routes table instead of OSRM. Returns (routes, vehicle_data, rerouted legs).
+        """
+        pairs = list(zip(waypoints, waypoints[1:]))
+        known_routes = known_routes or {}
+        stored = self.get_routes(
+            known_routes[leg_key(*pair)] for pair in pairs if leg_key(*pair) in known_routes
+        ) if known_routes else {}
+        
+        routes = [None] * len(pairs)
+        for n, pair in enumerate(pairs):
+            entry = stored.get(known_routes.get(leg_key(*pair)))
+            if entry:
+                routes[n] = {
+                    'distance': entry['distance_meters'],
+                    'duration': entry['duration_seconds'],
+                    'geometry': json.loads(entry['route_geometry'])
+                }
+        rerouted = [n for n, route in enumerate(routes) if route is None]
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=Config.TRIP_BATCH_WORKERS) as executor:
+            vehicles_future = executor.submit(self.get_vehicles, [car_type], deadline)
+            route_futures = {
+                n: executor.submit(self.routing.get_route, pairs[n][0], pairs[n][1], deadline)
+                for n in rerouted
+            }
+            for n, future in route_futures.items():
+                routes[n] = future.result()
+            vehicle_data = vehicles_future.result().get(car_type)
             
-            # Calculate energy used (kWh)
-            energy_used = (route['distance'] / 1000) * (efficiency / 1000)
+        if not vehicle_data:
+            raise Exception(f"No efficiency data found for vehicle type: {car_type}")
+        return routes, vehicle_data, rerouted
+
+    def _plan_multi_stop(self, trip_id, user_id, car_type, battery_level_start, waypoints, deadline, known_routes=None):
+        """
+        Route, price and find stations for a multi-stop trip. Energy and state of
+        charge carry over from leg to leg; stations are searched once per distinct
+        leg route and shared through the routes table like single trips.
+        Returns (trip row, response).
+        """
+        routes, vehicle_data, rerouted = self._route_legs(waypoints, car_type, deadline, known_routes)
+        
+        start_energy = (battery_level_start / 100) * vehicle_data['BatteryCapacity_kWh']
+        energy_left = start_energy
+        legs = []
+        for (start, end), route in zip(zip(waypoints, waypoints[1:]), routes):
+            energy = self.calculate_trip_energy(route, vehicle_data, battery_level_start)
+            energy_left -= energy['energy_used_kWh']
+            legs.append({
+                'start_lat': start[0],
+                'start_lng': start[1],
+                'end_lat': end[0],
+                'end_lng': end[1],
+                'route_hash': route_hash(route['geometry']),
+                'distance_meters': route['distance'],
+                'duration_seconds': int(route['duration']),
+                'average_speed_kph': energy['average_speed_kph'],
+                'energy_used_kWh': energy['energy_used_kWh'],
+                'cost_dollars': energy['cost_dollars'],
+                'arrival_soc_percent': 100 * energy_left / vehicle_data['BatteryCapacity_kWh']
+            })
             
-            # Calculate cost
-            cost = energy_used * vehicle_data['CostPer_kWh_Dollars']
+        # Stations per distinct leg route: stored results where fresh, else one corridor search
+        leg_routes = {leg['route_hash']: route for leg, route in zip(legs, routes)}
+        stored = self.get_routes(leg_routes)
+        stations_by_id = {}
+        pending_points = []
+        route_entries = []
+        for key, route in leg_routes.items():
+            stations = self._fresh_stations(stored[key]) if key in stored else None
+            if stations is None:
+                stations, pending = self.find_charging_stations_along_route(route['geometry'], deadline=deadline)
+                pending_points.extend(pending)
+                route_entries.append((key, route, None if pending else stations))
+            for station in stations:
+                if station['id'] not in stations_by_id or station['distance_km'] < stations_by_id[station['id']]['distance_km']:
+                    stations_by_id[station['id']] = station
+        stations = list(stations_by_id.values())
+        self.store_routes(route_entries)
+        
+        total_distance = sum(leg['distance_meters'] for leg in legs)
+        total_duration = sum(route['duration'] for route in routes)
+        trip_route = {
+            'distance': total_distance,
+            'duration': total_duration,
+            'geometry': join_geometries(route['geometry'] for route in routes)
+        }
+        energy = {
+            'average_speed_kph': (total_distance / 1000) / (total_duration / 3600),
+            'energy_used_kWh': sum(leg['energy_used_kWh'] for leg in legs),
+            'cost_dollars': sum(leg['cost_dollars'] for leg in legs),
+            'start_battery_capacity_kWh': start_energy
+        }
+        
+        trip_row = self._trip_row(
+            trip_id, user_id, car_type, battery_level_start,
+            waypoints[0], waypoints[-1], trip_route, energy
+        )
+        # The whole-trip geometry is rebuilt from the legs' stored routes on read
+        trip_row['route_hash'] = None
+        trip_row['legs'] = json.dumps(legs)
+        
+        return trip_row, {
+            'trip_id': trip_id,
+            'route': trip_route,
+            'legs': legs,
+            'legs_rerouted': len(rerouted),
+            'energy': {
+                'used_kWh': energy['energy_used_kWh'],
+                'cost_dollars': energy['cost_dollars'],
+                'start_battery_capacity_kWh': start_energy
+            },
+            'stations': stations,
+            'stations_partial': bool(pending_points),
+            'stations_pending_points': pending_points,
+            'charging_plan': self._plan_charging(trip_route, energy, vehicle_data, car_type, stations)
+        }
+
+    def create_multi_stop_trip(self, user_id, car_type, battery_level_start, waypoints, deadline=None):
+        """Create one trip through several (lat, lng) waypoints, stored as a single row with leg detail"""
+        try:
+            deadline = deadline or Deadline(Config.TRIP_DEADLINE_SECONDS)
+            trip_id = str(uuid.uuid4())
+            trip_row, result = self._plan_multi_stop(
+                trip_id, user_id, car_type, battery_level_start, waypoints, deadline
+            )
+            self.insert_trips([trip_row])
+            record_trip(user_id, result['route']['geometry'], trip_row['energy_used_kWh'])
+            self.store_trip_stations(trip_id, result['stations'])
+            return result
             
-            # Calculate start battery capacity in kWh
-            start_battery_capacity = (battery_level_start / 100) * vehicle_data['BatteryCapacity_kWh']
+        except Exception as e:
+            logger.error(f"Error creating multi-stop trip: {str(e)}")
+            raise
+
+    def replan_trip(self, trip_id, user_id, waypoints, deadline=None):
+        """
+        Change a trip's waypoints. Legs whose endpoints didn't change reuse their
+        stored routes and stations, so only new legs are routed and searched.
+        Returns None if the trip doesn't exist.
+        """
+        trip = self.get_trip(trip_id, user_id)
+        if not trip:
+            return None
             
-            # Store trip in BigQuery
-            query = f"""
-            INSERT INTO `{self.dataset}.{Config.BQ_TRIPS_TABLE}`
-            (trip_id, user_id, car_type, battery_level_start, 
-             start_lat, start_lng, end_lat, end_lng,
-             start_date, duration_seconds, distance_meters, 
-             average_speed_kph, route_geometry, energy_used_kWh,
-             cost_dollars, start_battery_capacity_kWh)
-            VALUES
-            (@trip_id, @user_id, @car_type, @battery_level_start,
-             @start_lat, @start_lng, @end_lat, @end_lng,
-             CURRENT_TIMESTAMP(), @duration_seconds, @distance_meters,
-             @average_speed_kph, @route_geometry, @energy_used_kWh,
-             @cost_dollars, @start_battery_capacity_kWh)
-            """
+        deadline = deadline or Deadline(Config.TRIP_DEADLINE_SECONDS)
+        if trip.get('legs'):
+            old_legs = json.loads(trip['legs'])
+        elif trip.get('route_hash'):
+            old_legs = [trip]
+        else:
+            old_legs = []
+        known_routes = {
+            leg_key((leg['start_lat'], leg['start_lng']), (leg['end_lat'], leg['end_lng'])): leg['route_hash']
+            for leg in old_legs
+        }
+        
+        trip_row, result = self._plan_multi_stop(
+            trip_id, user_id, trip['car_type'], trip['battery_level_start'],
+            waypoints, deadline, known_routes
+        )
+        self.update_trip(trip_row)
+        if trip.get('route_geometry'):
+            record_trip(user_id, json.loads(trip['route_geometry']), trip.get('energy_used_kWh'), remove=True)
+        record_trip(user_id, result['route']['geometry'], trip_row['energy_used_kWh'])
+        self.replace_trip_stations(trip_id, result['stations'])
+        return result
+
+    def update_trip(self, row):
+        """Overwrite a trip's route, energy and legs; its id, owner and start date are kept"""
+        columns = [
+            (column, column_type) for column, column_type in TRIP_INSERT_COLUMNS
+            if column not in ('trip_id', 'user_id') + TRIP_TIMESTAMP_COLUMNS
+        ]
+        query = f"""
+        UPDATE `{self.dataset}.{Config.BQ_TRIPS_TABLE}`
+        SET {', '.join(f"{column} = @{column}" for column, _ in columns)}, updated_at = CURRENT_TIMESTAMP()
+        WHERE trip_id = @trip_id AND user_id = @user_id
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter(column, column_type, row[column])
+                for column, column_type in columns + [("trip_id", "STRING"), ("user_id", "STRING")]
+            ]
+        )
+        self.run_query('update_trip', query, job_config)
+        bump_trip_versions(row['user_id'])
+
+    def replace_trip_stations(self, trip_id, stations):
+        """Swap a trip's stored stations for a new set"""
+        query = f"""
+        DELETE FROM `{self.dataset}.{self.trip_stations_table}`
+        WHERE trip_id = @trip_id
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id)
+            ]
+        )
+        self.run_query('replace_trip_stations', query, job_config)
+        self.store_trip_stations(trip_id, stations)
+
+    def check_reachability(self, car_type, battery_level_start, origin, destinations, deadline=None):
+        """
+        Which destinations a car can reach from origin on its current charge,
+        using one OSRM table call and one vehicle lookup for all of them.
+        Margins are the energy left above the planning reserve (negative if unreachable).
+        """
+        deadline = deadline or Deadline(Config.TRIP_DEADLINE_SECONDS)
+        legs = self.routing.get_table(origin, destinations, deadline=deadline)
+        vehicle_data = self.get_vehicles([car_type], deadline=deadline).get(car_type)
+        if not vehicle_data:
+            raise Exception(f"No efficiency data found for vehicle type: {car_type}")
             
-            params = [
-                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
-                bigquery.ScalarQueryParameter("user_id", "STRING", user_id),
-                bigquery.ScalarQueryParameter("car_type", "STRING", car_type),
-                bigquery.ScalarQueryParameter("battery_level_start", "FLOAT64", battery_level_start),
-                bigquery.ScalarQueryParameter("start_lat", "FLOAT64", start_coords[0]),
-                bigquery.ScalarQueryParameter("start_lng", "FLOAT64", start_coords[1]),
-                bigquery.ScalarQueryParameter("end_lat", "FLOAT64", end_coords[0]),
-                bigquery.ScalarQueryParameter("end_lng", "FLOAT64", end_coords[1]),
-                bigquery.ScalarQueryParameter("duration_seconds", "INTEGER", int(route['duration'])),
-                bigquery.ScalarQueryParameter("distance_meters", "FLOAT64", route['distance']),
-                bigquery.ScalarQueryParameter("average_speed_kph", "FLOAT64", average_speed_kph),
-                bigquery.ScalarQueryParameter("route_geometry", "STRING", json.dumps(route['geometry'])),
-                bigquery.ScalarQueryParameter("energy_used_kWh", "FLOAT64", energy_used),
-                bigquery.ScalarQueryParameter("cost_dollars", "FLOAT64", cost),
-                bigquery.ScalarQueryParameter("start_battery_capacity_kWh", "FLOAT64", start_battery_capacity)
+        start_energy = (battery_level_start / 100) * vehicle_data['BatteryCapacity_kWh']
+        usable = start_energy - vehicle_data['BatteryCapacity_kWh'] * Config.CHARGE_RESERVE_PERCENT / 100
+        energies = [
+            self.calculate_trip_energy(leg, vehicle_data, battery_level_start)['energy_used_kWh'] if leg else None
+            for leg in legs
+        ]
+        
+        return [
+            {
+                'lat': lat,
+                'lng': lng,
+                'routable': leg is not None,
+                'reachable': energy is not None and energy <= usable,
+                'distance_meters': leg['distance'] if leg else None,
+                'duration_seconds': leg['duration'] if leg else None,
+                'energy_kWh': energy,
+                'margin_kWh': usable - energy if energy is not None else None,
+                'arrival_soc_percent': 100 * (start_energy - energy) / vehicle_data['BatteryCapacity_kWh'] if energy is not None else None
+            }
+            for (lat, lng), leg, energy in zip(destinations, legs, energies)
+        ]
+
+    def create_trips_batch(self, user_id, trips, deadline=None):
+        """
+        Create many trips at once. Routes are fetched concurrently, vehicle data
+        comes from one query, stations are searched once per sample point shared
+        between trips, and trips and stations are each written with one insert.
+        trips: list of dicts with car_type, battery_level_start, start_coords, end_coords
+        Returns one result per input trip; failed trips have an 'error' key instead.
+        """
+        deadline = deadline or Deadline(Config.TRIP_DEADLINE_SECONDS)
+        results = [None] * len(trips)
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=Config.TRIP_BATCH_WORKERS) as executor:
+            vehicles_future = executor.submit(self.get_vehicles, {trip['car_type'] for trip in trips}, deadline)
+            route_futures = [
+                executor.submit(self.routing.get_route, trip['start_coords'], trip['end_coords'], deadline)
+                for trip in trips
             ]
+            vehicles = vehicles_future.result()
             
-            job_config = bigquery.QueryJobConfig(query_parameters=params)
-            self.client.query(query, job_config=job_config).result()
+            # Energy for every routed trip in one pass
+            planned = []
+            for i, (trip, route_future) in enumerate(zip(trips, route_futures)):
+                try:
+                    route = route_future.result()
+                except Exception as e:
+                    logger.error(f"Error routing batch trip {i}: {str(e)}")
+                    results[i] = {'error': 'Failed to get route'}
+                    continue
+                    
+                vehicle_data = vehicles.get(trip['car_type'])
+                if not vehicle_data:
+                    results[i] = {'error': f"No efficiency data found for vehicle type: {trip['car_type']}"}
+                    continue
+                    
+                energy = self.calculate_trip_energy(route, vehicle_data, trip['battery_level_start'])
+                planned.append((i, str(uuid.uuid4()), trip, route, energy))
+                
+            # Trips on a route with stored stations reuse them; the rest share
+            # corridor tiles, so each tile is served from cache or fetched once
+            stored_routes = self.get_routes(route_hash(route['geometry']) for i, trip_id, trip, route, energy in planned)
+            reused_stations = {}
+            trip_corridors = {}
+            for i, trip_id, trip, route, energy in planned:
+                stored = stored_routes.get(route_hash(route['geometry']))
+                stations = self._fresh_stations(stored) if stored else None
+                if stations is not None:
+                    reused_stations[trip_id] = stations
+                    trip_corridors[trip_id] = {}
+                    continue
+                trip_corridors[trip_id] = corridor_tiles(route['geometry']['coordinates'], Config.STATION_CORRIDOR_KM)
+            unique_tiles = {key for corridor in trip_corridors.values() for key in corridor}
+            tile_stations = get_tile_cache().get_many(OCM_TILE_SOURCE, unique_tiles)
+            logger.info(f"Batch of {len(planned)} trips covers {len(unique_tiles)} tiles, {len(unique_tiles) - len(tile_stations)} not cached")
             
-            # Find and store charging stations
-            stations = self.find_charging_stations_along_route(route['geometry'])
-            self.store_trip_stations(trip_id, stations)
+            tile_futures = {
+                key: executor.submit(fetch_tile, OCM_TILE_SOURCE, key, self.fetch_ocm_area, deadline)
+                for key in unique_tiles if key not in tile_stations
+            }
+            for key, future in tile_futures.items():
+                try:
+                    stations = future.result()
+                    if stations is not None:
+                        tile_stations[key] = stations
+                except Exception as e:
+                    logger.error(f"Station lookup failed for tile {key}: {str(e)}")
+        
+        trip_rows = []
+        station_rows = []
+        route_entries = {}
+        for i, trip_id, trip, route, energy in planned:
+            if trip_id in reused_stations:
+                stations = reused_stations[trip_id]
+            else:
+                stations = self._process_corridor_stations(
+                    stations_in_corridor(trip_corridors[trip_id], tile_stations, Config.STATION_CORRIDOR_KM)
+                )
+            pending_points = [
+                [lng, lat] for lat, lng in (tile_center(key) for key in trip_corridors[trip_id] if key not in tile_stations)
+            ]
             
-            return {
+            trip_row = self._trip_row(
+                trip_id, user_id, trip['car_type'], trip['battery_level_start'],
+                trip['start_coords'], trip['end_coords'], route, energy
+            )
+            trip_rows.append(trip_row)
+            station_rows.extend(self._station_rows(trip_id, stations))
+            if trip_id not in reused_stations:
+                route_entries[trip_row['route_hash']] = (trip_row['route_hash'], route, None if pending_points else stations)
+            
+            results[i] = {
                 'trip_id': trip_id,
+                'route_hash': trip_row['route_hash'],
                 'route': {
                     'distance': route['distance'],
                     'duration': route['duration'],
                     'geometry': route['geometry']
                 },
                 'energy': {
-                    'used_kWh': energy_used,
-                    'cost_dollars': cost,
-                    'start_battery_capacity_kWh': start_battery_capacity
+                    'used_kWh': energy['energy_used_kWh'],
+                    'cost_dollars': energy['cost_dollars'],
+                    'start_battery_capacity_kWh': energy['start_battery_capacity_kWh']
                 },
-                'stations': stations
+                'stations': stations,
+                'stations_partial': bool(pending_points),
+                'stations_pending_points': pending_points,
+                'charging_plan': self._plan_charging(route, energy, vehicles[trip['car_type']], trip['car_type'], stations)
             }
             
-        except Exception as e:
-            logger.error(f"Error creating trip: {str(e)}")
-            raise
+        self.store_routes(list(route_entries.values()))
+        self.insert_trips(trip_rows)
+        self._insert_station_rows(station_rows)
+        for i, trip_id, trip, route, energy in planned:
+            record_trip(user_id, route['geometry'], energy['energy_used_kWh'])
+        
+        return results
 
-    def get_user_trips(self, username):
-        """Get all trips for a specific user"""
+    def get_trip(self, trip_id, user_id):
+        """Get a single trip owned by a user"""
         query = f"""
         SELECT *
         FROM `{self.dataset}.{self.trips_table}`
-        WHERE username = @username
+        WHERE trip_id = @trip_id AND user_id = @user_id
+        LIMIT 1
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id),
+                bigquery.ScalarQueryParameter("user_id", "STRING", user_id)
+            ]
+        )
+        
+        results = self.run_query('get_trip', query, job_config)
+        trip = next(iter(results), None)
+        return self.attach_route_geometry([dict(trip)])[0] if trip else None
+
+    def get_trip_station_ids(self, trip_id):
+        """Get the OCM ids of stations already stored for a trip"""
+        query = f"""
+        SELECT DISTINCT station_id
+        FROM `{self.dataset}.{self.trip_stations_table}`
+        WHERE trip_id = @trip_id
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("trip_id", "STRING", trip_id)
+            ]
+        )
+        
+        results = self.run_query('get_trip_station_ids', query, job_config)
+        return {row['station_id'] for row in results}
+
+    def fill_trip_stations(self, trip_id, user_id, sample_points=None, deadline=None):
+        """
+        Search the points a partial station search didn't get to (or the whole
+        route if none are given) and store any stations not already saved.
+        """
+        trip = self.get_trip(trip_id, user_id)
+        if not trip:
+            return None
+            
+        deadline = deadline or Deadline(Config.TRIP_DEADLINE_SECONDS)
+        route_geometry = json.loads(trip['route_geometry'])
+        stations, pending_points = self.find_charging_stations_along_route(
+            route_geometry, deadline=deadline, sample_points=sample_points
+        )
+        
+        stored_ids = self.get_trip_station_ids(trip_id)
+        new_stations = [station for station in stations if station['id'] not in stored_ids]
+        self.store_trip_stations(trip_id, new_stations)
+        
+        return {
+            'trip_id': trip_id,
+            'stations': new_stations,
+            'stations_partial': bool(pending_points),
+            'stations_pending_points': pending_points
+        }
+
+    def get_frequent_corridors(self, days, limit):
+        """
+        Most common start/end pairs among recent trips, with a route reference for
+        each. Endpoints are grouped on a PREWARM_CORRIDOR_DECIMALS grid, since trips
+        between the same places rarely share exact coordinates; each corridor is
+        reported at its most frequent exact endpoints, whose route URL is the one
+        most worth keeping warm.
+        """
+        query = f"""
+        SELECT top.value.start_lat, top.value.start_lng, top.value.end_lat, top.value.end_lng,
+               trip_count, route_hash, route_geometry
+        FROM (
+            SELECT COUNT(*) AS trip_count,
+                   APPROX_TOP_COUNT(STRUCT(start_lat, start_lng, end_lat, end_lng), 1)[OFFSET(0)] AS top,
+                   ANY_VALUE(route_hash) AS route_hash,
+                   ANY_VALUE(route_geometry) AS route_geometry
+            FROM `{self.dataset}.{self.trips_table}`
+            WHERE start_date >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+              AND legs IS NULL
+            GROUP BY ROUND(start_lat, @decimals), ROUND(start_lng, @decimals),
+                     ROUND(end_lat, @decimals), ROUND(end_lng, @decimals)
+        )
+        ORDER BY trip_count DESC
+        LIMIT @limit
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("days", "INT64", days),
+                bigquery.ScalarQueryParameter("decimals", "INT64", Config.PREWARM_CORRIDOR_DECIMALS),
+                bigquery.ScalarQueryParameter("limit", "INT64", limit)
+            ]
+        )
+        
+        results = self.run_query('get_frequent_corridors', query, job_config)
+        return self.attach_route_geometry([dict(row) for row in results])
+
+    def get_trip_set_version(self, user_id=None):
+        """
+        (tag, last modified) for one user's trips, or everyone's. Every trip
+        write sets updated_at, so the count plus a fingerprint of each trip's
+        id and updated_at changes whenever the listing could; since it's read
+        from BigQuery, all app hosts agree. Only a few narrow columns are
+        scanned, and the result comes from the query cache while the table is
+        unchanged.
+        """
+        query = f"""
+        SELECT COUNT(*) AS trips,
+               BIT_XOR(FARM_FINGERPRINT(CONCAT(trip_id, '|', IFNULL(CAST(updated_at AS STRING), '')))) AS fingerprint,
+               MAX(COALESCE(updated_at, start_date)) AS updated_at
+        FROM `{self.dataset}.{Config.BQ_TRIPS_TABLE}`
+        {"WHERE user_id = @user_id" if user_id is not None else ""}
+        """
+        
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("user_id", "STRING", user_id)
+            ] if user_id is not None else []
+        )
+        
+        row = next(iter(self.run_query('get_trip_set_version', query, job_config)))
+        return f"{row['trips']}.{(row['fingerprint'] or 0) & 0xffffffffffffffff:x}", row['updated_at']
+
+    def get_user_trips(self, user_id):
+        """Get all trips for a specific user, as a TripBatch"""
+        query = f"""
+        SELECT *
+        FROM `{self.dataset}.{self.trips_table}`
+        WHERE user_id = @user_id
         ORDER BY start_date DESC
         """
         
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
-                bigquery.ScalarQueryParameter("username", "STRING", username)
+                bigquery.ScalarQueryParameter("user_id", "STRING", user_id)
             ]
         )
         
-        results = self.client.query(query, job_config=job_config).result()
-        return [dict(row) for row in results]
+        results = self.run_query('get_user_trips', query, job_config)
+        trips = TripBatch.from_rows(results)
+        self.attach_route_geometry(list(trips))
+        return trips
 
     @staticmethod
     def search_trips(user_id, start_date=None, end_date=None, destination=None, min_cost=None, max_cost=None):
@@ -272,36 +1362,25 @@ class BigQueryDatabase:
             if 'charger_type' in filters:
                 query += f" AND Charger_Type = '{filters['charger_type']}'"
 
-        query_job = self.client.query(query)
-        return query_job.result()
+        return self.run_query('get_charging_stations', query)
 
-    def get_nearby_stations(self, latitude, longitude, radius_km=10):
+    def get_stored_stations(self):
+        """All stations saved for trips, one row per station, for the in-memory station index"""
         query = f"""
-        SELECT 
-            *,
-            ST_DISTANCE(
-                ST_GEOGPOINT(Longitude, Latitude),
-                ST_GEOGPOINT(@user_long, @user_lat)
-            ) / 1000 as distance_km
-        FROM `capsone-maya-demeure.{self.dataset}.{self.table}`
-        WHERE ST_DWITHIN(
-            ST_GEOGPOINT(Longitude, Latitude),
-            ST_GEOGPOINT(@user_long, @user_lat),
-            @radius * 1000
-        )
-        ORDER BY distance_km
+        SELECT station_id AS id,
+               ANY_VALUE(name) AS name,
+               ANY_VALUE(latitude) AS latitude,
+               ANY_VALUE(longitude) AS longitude,
+               ANY_VALUE(address) AS address,
+               ARRAY_AGG(DISTINCT connection_types IGNORE NULLS) AS connection_types,
+               MAX(power_kw) AS max_power_kw
+        FROM `{self.dataset}.{self.trip_stations_table}`
+        WHERE station_id IS NOT NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+        GROUP BY station_id
         """
-
-        job_config = bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("user_lat", "FLOAT64", latitude),
-                bigquery.ScalarQueryParameter("user_long", "FLOAT64", longitude),
-                bigquery.ScalarQueryParameter("radius", "FLOAT64", radius_km),
-            ]
-        )
-
-        query_job = self.client.query(query, job_config=job_config)
-        return query_job.result()
+        
+        results = self.run_query('get_stored_stations', query)
+        return [dict(row) for row in results]
 
     def get_station_details(self, station_id):
         query = f"""
@@ -316,8 +1395,7 @@ class BigQueryDatabase:
             ]
         )
 
-        query_job = self.client.query(query, job_config=job_config)
-        result = list(query_job.result())
+        result = list(self.run_query('get_station_details', query, job_config))
         return result[0] if result else None
 
     def list_tables(self):
@@ -375,7 +1453,7 @@ class BigQueryDatabase:
             """
 
             job_config = bigquery.QueryJobConfig(query_parameters=query_params)
-            results = self.client.query(query, job_config=job_config).result()
+            results = self.run_query('search_stations', query, job_config)
             
             return [dict(row) for row in results]
 
@@ -389,6 +1467,10 @@ class BigQueryDatabase:
             logger.info("No stations to store")
             return
         
+        self._insert_station_rows(self._station_rows(trip_id, stations))
+
+    def _station_rows(self, trip_id, stations):
+        """Flatten stations into trip_stations rows, one per connection"""
         rows_to_insert = []
         for idx, station in enumerate(stations):
             if not station:  # Skip if station is None
@@ -414,6 +1496,13 @@ class BigQueryDatabase:
                     logger.error(f"Error processing station {trip_station_id}: {str(e)}")
                     continue
 
+        return rows_to_insert
+
+    def _insert_station_rows(self, rows_to_insert):
+        """Write trip_stations rows, for any number of trips, in as few INSERTs as the limits allow"""
+        self._insert_in_chunks('insert_station_rows', self._insert_station_chunk, rows_to_insert, 11)
+
+    def _insert_station_chunk(self, rows_to_insert):
         if rows_to_insert:
             query = f"""
             INSERT INTO `{self.dataset}.{self.trip_stations_table}`
@@ -450,7 +1539,7 @@ class BigQueryDatabase:
             
             try:
                 job_config = bigquery.QueryJobConfig(query_parameters=params)
-                self.client.query(query, job_config=job_config).result()
+                self.run_query('insert_station_rows', query, job_config)
                 logger.info(f"Successfully stored {len(rows_to_insert)} stations")
             except Exception as e:
                 logger.error(f"Error storing stations: {str(e)}")
@@ -469,7 +1558,7 @@ class BigQueryDatabase:
             ]
         )
         
-        result = self.client.query(query, job_config=job_config).result()
+        result = self.run_query('check_username_exists', query, job_config)
         count = next(iter(result)).count
         return count > 0
 
@@ -486,7 +1575,7 @@ class BigQueryDatabase:
             ]
         )
         
-        result = self.client.query(query, job_config=job_config).result()
+        result = self.run_query('check_email_exists', query, job_config)
         count = next(iter(result)).count
         return count > 0
 
@@ -504,47 +1593,67 @@ class BigQueryDatabase:
             ]
         )
         
-        results = self.client.query(query, job_config=job_config).result()
+        results = self.run_query('get_user_by_id', query, job_config)
         user = next(iter(results), None)
         
         if user:
             return dict(user)
         return None
 
-    def find_charging_stations_along_route(self, route_geometry):
+    def find_charging_stations_along_route(self, route_geometry, deadline=None, sample_points=None):
+        """
+        Find stations within STATION_CORRIDOR_KM of a route using the shared OCM tile cache.
+        Returns (stations, pending_points) where pending_points are [lng, lat] centers of
+        tiles that weren't fetched before the deadline ran out. Passing points back as
+        sample_points limits the search to the tiles containing them.
+        """
+        only_tiles = {tile_key(lat, lng) for lng, lat in sample_points} if sample_points else None
         try:
-            coordinates = route_geometry['coordinates']
-            sample_points = coordinates[::50]
-            logger.info(f"Sampling {len(sample_points)} points from {len(coordinates)} coordinates")
-            
-            stations = []
-            for coord in sample_points:
-                lng, lat = coord
-                
-                ocm_url = f"https://api.openchargemap.io/v3/poi/?output=json&latitude={lat}&longitude={lng}&distance=10&distanceunit=km&maxresults=10"
-                headers = {
-                    "X-API-Key": Config.OCM_API_KEY,
-                    "User-Agent": "EV_Route_Planner/1.0"
-                }
-                
-                response = requests.get(ocm_url, headers=headers)
-                if response.status_code != 200:
-                    continue
-                    
-                for station in response.json():
-                    try:
-                        station_info = self._process_station(station)
-                        if station_info:
-                            stations.append(station_info)
-                    except Exception as e:
-                        logger.error(f"Error processing station: {str(e)}")
-                        continue
-            
-            return list({station['id']: station for station in stations}.values())
-            
+            found, pending = find_corridor_stations(
+                OCM_TILE_SOURCE, route_geometry['coordinates'], Config.STATION_CORRIDOR_KM,
+                self.fetch_ocm_area, deadline=deadline, only_tiles=only_tiles
+            )
         except Exception as e:
             logger.error(f"Error finding stations: {str(e)}")
-            return []
+            # Every tile is left pending, so the empty result isn't stored as the route's stations
+            found = []
+            pending = [
+                key for key in corridor_tiles(route_geometry['coordinates'], Config.STATION_CORRIDOR_KM)
+                if only_tiles is None or key in only_tiles
+            ]
+        pending_points = [[lng, lat] for lat, lng in map(tile_center, pending)]
+        return self._process_corridor_stations(found), pending_points
+
+    def _process_corridor_stations(self, found):
+        """Format (raw OCM station, distance to route) pairs from the tile search"""
+        stations = []
+        for station, distance_km in found:
+            try:
+                station_info = self._process_station(station)
+                if station_info:
+                    station_info['distance_km'] = distance_km
+                    stations.append(station_info)
+            except Exception as e:
+                logger.error(f"Error processing station: {str(e)}")
+                continue
+        return stations
+
+    @staticmethod
+    def fetch_ocm_area(lat, lng, radius_km, timeout=None):
+        """Query OCM for every station within radius_km of a point; None if the request fails"""
+        ocm_url = (
+            f"https://api.openchargemap.io/v3/poi/?output=json&latitude={lat}&longitude={lng}"
+            f"&distance={radius_km}&distanceunit=km&maxresults={Config.STATION_TILE_MAX_RESULTS}"
+        )
+        headers = {
+            "X-API-Key": Config.OCM_API_KEY,
+            "User-Agent": "EV_Route_Planner/1.0"
+        }
+        
+        response = requests.get(ocm_url, headers=headers, timeout=timeout)
+        if response.status_code != 200:
+            return None
+        return response.json()
 
     def _process_station(self, station):
         """Helper method to process a single station"""
@@ -585,9 +1694,64 @@ class BigQueryDatabase:
             logger.error(f"Error processing station data: {str(e)}")
             return None
 
+    @staticmethod
+    def trip_filter_conditions(filters):
+        """WHERE conditions and query parameters for the trip filters search_trips accepts"""
+        conditions = []
+        params = []
+
+        if filters:
+            if filters.get('car_types'):
+                car_types = filters['car_types']
+                placeholders = [f'@car_type_{i}' for i in range(len(car_types))]
+                conditions.append(f"car_type IN ({','.join(placeholders)})")
+                for i, car_type in enumerate(car_types):
+                    params.append(bigquery.ScalarQueryParameter(f"car_type_{i}", "STRING", car_type))
+
+            if filters.get('user_id'):
+                conditions.append("user_id = @user_id")
+                params.append(bigquery.ScalarQueryParameter("user_id", "STRING", filters['user_id']))
+
+            if filters.get('min_duration'):
+                conditions.append("duration_seconds >= @min_duration")
+                params.append(bigquery.ScalarQueryParameter("min_duration", "INTEGER", filters['min_duration']))
+            if filters.get('max_duration'):
+                conditions.append("duration_seconds <= @max_duration")
+                params.append(bigquery.ScalarQueryParameter("max_duration", "INTEGER", filters['max_duration']))
+
+            if filters.get('min_distance'):
+                conditions.append("distance_meters >= @min_distance")
+                params.append(bigquery.ScalarQueryParameter("min_distance", "FLOAT64", filters['min_distance']))
+            if filters.get('max_distance'):
+                conditions.append("distance_meters <= @max_distance")
+                params.append(bigquery.ScalarQueryParameter("max_distance", "FLOAT64", filters['max_distance']))
+
+            if filters.get('min_speed'):
+                conditions.append("average_speed_kph >= @min_speed")
+                params.append(bigquery.ScalarQueryParameter("min_speed", "FLOAT64", filters['min_speed']))
+            if filters.get('max_speed'):
+                conditions.append("average_speed_kph <= @max_speed")
+                params.append(bigquery.ScalarQueryParameter("max_speed", "FLOAT64", filters['max_speed']))
+
+            if filters.get('min_energy'):
+                conditions.append("energy_used_kWh >= @min_energy")
+                params.append(bigquery.ScalarQueryParameter("min_energy", "FLOAT64", filters['min_energy']))
+            if filters.get('max_energy'):
+                conditions.append("energy_used_kWh <= @max_energy")
+                params.append(bigquery.ScalarQueryParameter("max_energy", "FLOAT64", filters['max_energy']))
+
+            if filters.get('min_cost'):
+                conditions.append("cost_dollars >= @min_cost")
+                params.append(bigquery.ScalarQueryParameter("min_cost", "FLOAT64", filters['min_cost']))
+            if filters.get('max_cost'):
+                conditions.append("cost_dollars <= @max_cost")
+                params.append(bigquery.ScalarQueryParameter("max_cost", "FLOAT64", filters['max_cost']))
+
+        return conditions, params
+
     def search_trips(self, filters=None):
         """
-        Search trips with various filters
+        Search trips with various filters, returning a TripBatch
         filters can include:
         - car_types: list of car types
         - user_id: string
@@ -598,56 +1762,7 @@ class BigQueryDatabase:
         - min_cost, max_cost: in dollars
         """
         try:
-            conditions = []
-            params = []
-            param_count = 0
-
-            if filters:
-                if filters.get('car_types'):
-                    car_types = filters['car_types']
-                    placeholders = [f'@car_type_{i}' for i in range(len(car_types))]
-                    conditions.append(f"car_type IN ({','.join(placeholders)})")
-                    for i, car_type in enumerate(car_types):
-                        params.append(bigquery.ScalarQueryParameter(f"car_type_{i}", "STRING", car_type))
-
-                if filters.get('user_id'):
-                    conditions.append("user_id = @user_id")
-                    params.append(bigquery.ScalarQueryParameter("user_id", "STRING", filters['user_id']))
-
-                if filters.get('min_duration'):
-                    conditions.append("duration_seconds >= @min_duration")
-                    params.append(bigquery.ScalarQueryParameter("min_duration", "INTEGER", filters['min_duration']))
-                if filters.get('max_duration'):
-                    conditions.append("duration_seconds <= @max_duration")
-                    params.append(bigquery.ScalarQueryParameter("max_duration", "INTEGER", filters['max_duration']))
-
-                if filters.get('min_distance'):
-                    conditions.append("distance_meters >= @min_distance")
-                    params.append(bigquery.ScalarQueryParameter("min_distance", "FLOAT64", filters['min_distance']))
-                if filters.get('max_distance'):
-                    conditions.append("distance_meters <= @max_distance")
-                    params.append(bigquery.ScalarQueryParameter("max_distance", "FLOAT64", filters['max_distance']))
-
-                if filters.get('min_speed'):
-                    conditions.append("average_speed_kph >= @min_speed")
-                    params.append(bigquery.ScalarQueryParameter("min_speed", "FLOAT64", filters['min_speed']))
-                if filters.get('max_speed'):
-                    conditions.append("average_speed_kph <= @max_speed")
-                    params.append(bigquery.ScalarQueryParameter("max_speed", "FLOAT64", filters['max_speed']))
-
-                if filters.get('min_energy'):
-                    conditions.append("energy_used_kWh >= @min_energy")
-                    params.append(bigquery.ScalarQueryParameter("min_energy", "FLOAT64", filters['min_energy']))
-                if filters.get('max_energy'):
-                    conditions.append("energy_used_kWh <= @max_energy")
-                    params.append(bigquery.ScalarQueryParameter("max_energy", "FLOAT64", filters['max_energy']))
-
-                if filters.get('min_cost'):
-                    conditions.append("cost_dollars >= @min_cost")
-                    params.append(bigquery.ScalarQueryParameter("min_cost", "FLOAT64", filters['min_cost']))
-                if filters.get('max_cost'):
-                    conditions.append("cost_dollars <= @max_cost")
-                    params.append(bigquery.ScalarQueryParameter("max_cost", "FLOAT64", filters['max_cost']))
+            conditions, params = self.trip_filter_conditions(filters)
 
             # Build the query
             query = f"""
@@ -658,9 +1773,10 @@ class BigQueryDatabase:
             """
 
             job_config = bigquery.QueryJobConfig(query_parameters=params)
-            results = self.client.query(query, job_config=job_config).result()
-            
-            return [dict(row) for row in results]
+            results = self.run_query('search_trips', query, job_config)
+            trips = TripBatch.from_rows(results)
+            self.attach_route_geometry(list(trips))
+            return trips
 
         except Exception as e:
             logger.error(f"Error searching trips: {str(e)}")
@@ -4,4 +4,7 @@ def handle_404_error(e):
     return jsonify({'error': 'Not found'}), 404
 
 def handle_500_error(e):
-    return jsonify({'error': 'Internal server error'}), 500 
\ No newline at end of file
+    return jsonify({'error': 'Internal server error'}), 500
+
+def handle_query_budget_error(e):
+    return jsonify({'error': 'Request would scan more data than the query budget allows'}), 503
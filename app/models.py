@@ -1,5 +1,13 @@
-from werkzeug.security import check_password_hash
 from flask_login import UserMixin
+from werkzeug.http import http_date
+from app.services.passwords import hasher
+from datetime import date, datetime
+from decimal import Decimal
+from array import array
+import json
+import math
+import csv
+import io
 
 class User(UserMixin):
     def __init__(self, user_data):
@@ -10,16 +18,140 @@ class User(UserMixin):
         self.created_at = user_data.get('created_at')
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
 
 class Trip:
-    def __init__(self, trip_data):
-        self.trip_id = trip_data.get('trip_id')
-        self.username = trip_data.get('username')
-        self.start_lat = trip_data.get('start_lat')
-        self.start_lng = trip_data.get('start_lng')
-        self.end_lat = trip_data.get('end_lat')
-        self.end_lng = trip_data.get('end_lng')
-        self.start_date = trip_data.get('start_date')
-        self.duration_seconds = trip_data.get('duration_seconds')
-        self.distance_meters = trip_data.get('distance_meters') 
\ No newline at end of file
+    """Read/write view of one row of a TripBatch; holds no data of its own"""
+    __slots__ = ('_batch', '_index')
+
+    def __init__(self, batch, index):
+        self._batch = batch
+        self._index = index
+
+    def __getitem__(self, name):
+        return self._batch.columns[name][self._index]
+
+    def __setitem__(self, name, value):
+        self._batch.set(self._index, name, value)
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def get(self, name, default=None):
+        column = self._batch.columns.get(name)
+        return column[self._index] if column is not None else default
+
+    def to_dict(self):
+        return {name: column[self._index] for name, column in self._batch.columns.items()}
+
+class TripBatch:
+    """
+    Trips stored column by column: one list per column, or a typed array for
+    numeric columns without NULLs. Rows are only materialised as Trip views,
+    and serializers work a column at a time instead of building dicts per row.
+    """
+    NUMERIC_TYPES = {'FLOAT': 'd', 'FLOAT64': 'd', 'NUMERIC': 'd', 'INTEGER': 'q', 'INT64': 'q'}
+
+    def __init__(self, columns, length):
+        self.columns = columns
+        self.length = length
+
+    @classmethod
+    def from_rows(cls, results):
+        """Build from a BigQuery RowIterator, transposing one result page at a time"""
+        names = [field.name for field in results.schema or []]
+        columns = None
+        length = 0
+        for page in results.pages:
+            rows = list(page)
+            if not rows:
+                continue
+            if columns is None:
+                names = list(rows[0].keys())
+                columns = [[] for _ in names]
+            for column, values in zip(columns, zip(*(row.values() for row in rows))):
+                column.extend(values)
+            length += len(rows)
+        if columns is None:
+            columns = [[] for _ in names]
+        types = {field.name: field.field_type for field in results.schema or []}
+        return cls({name: cls._compact(column, types.get(name)) for name, column in zip(names, columns)}, length)
+
+    @classmethod
+    def _compact(cls, column, field_type):
+        typecode = cls.NUMERIC_TYPES.get(field_type)
+        if typecode and None not in column:
+            try:
+                return array(typecode, column)
+            except (TypeError, OverflowError):
+                pass
+        return column
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return (Trip(self, i) for i in range(self.length))
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return Trip(self, index)
+
+    def set(self, index, name, value):
+        if name not in self.columns:
+            self.columns[name] = [None] * self.length
+        column = self.columns[name]
+        if isinstance(column, array) and not isinstance(value, (int, float)):
+            column = self.columns[name] = list(column)
+        column[index] = value
+
+    def to_json(self, raw_json=()):
+        """
+        JSON array of row objects. Columns named in raw_json already hold JSON
+        text (e.g. route_geometry) and are embedded as-is rather than re-parsed.
+        Timestamps are written as HTTP dates, like Flask's jsonify, and NaN or
+        infinite numbers as null, since JSON has no literal for them.
+        """
+        if not self.length:
+            return '[]'
+        encoded = []
+        for name, column in self.columns.items():
+            prefix = json.dumps(name) + ':'
+            if name in raw_json:
+                values = [prefix + (value or 'null') for value in column]
+            elif isinstance(column, array):
+                values = [prefix + value for value in map(_json_float if column.typecode == 'd' else str, column)]
+            else:
+                values = [prefix + _json_value(value) for value in column]
+            encoded.append(values)
+        return '[' + ','.join('{' + ','.join(row) + '}' for row in zip(*encoded)) + ']'
+
+    def to_csv(self, columns=None):
+        """CSV with a header row; columns limits and orders the output"""
+        names = columns or list(self.columns)
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(names)
+        writer.writerows(zip(*(self.columns.get(name) or [None] * self.length for name in names)))
+        return out.getvalue()
+
+def _json_float(value):
+    return repr(value) if math.isfinite(value) else 'null'
+
+def _json_value(value):
+    if isinstance(value, float):
+        return _json_float(value)
+    return json.dumps(value, default=_json_default)
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return http_date(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value) if value.is_finite() else None
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
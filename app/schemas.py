@@ -21,10 +21,23 @@ TRIPS_SCHEMA = [
     bigquery.SchemaField("duration_seconds", "INTEGER", mode="REQUIRED"),
     bigquery.SchemaField("distance_meters", "FLOAT", mode="REQUIRED"),
     bigquery.SchemaField("average_speed_kph", "FLOAT", mode="REQUIRED"),
-    bigquery.SchemaField("route_geometry", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("route_geometry", "STRING", mode="NULLABLE"),  # Only set on trips stored before route_hash
     bigquery.SchemaField("energy_used_kWh", "FLOAT", mode="NULLABLE"),
     bigquery.SchemaField("cost_dollars", "FLOAT", mode="NULLABLE"),
-    bigquery.SchemaField("start_battery_capacity_kWh", "FLOAT", mode="NULLABLE")
+    bigquery.SchemaField("start_battery_capacity_kWh", "FLOAT", mode="NULLABLE"),
+    bigquery.SchemaField("route_hash", "STRING", mode="NULLABLE"),  # NULL for multi-stop trips; see legs
+    bigquery.SchemaField("legs", "STRING", mode="NULLABLE"),  # JSON list of legs, each with its own route_hash
+    bigquery.SchemaField("updated_at", "TIMESTAMP", mode="NULLABLE")  # Last write to the trip; NULL on trips stored before it existed
+]
+
+ROUTES_SCHEMA = [
+    bigquery.SchemaField("route_hash", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("route_geometry", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("distance_meters", "FLOAT", mode="REQUIRED"),
+    bigquery.SchemaField("duration_seconds", "INTEGER", mode="REQUIRED"),
+    bigquery.SchemaField("stations", "STRING", mode="NULLABLE"),  # JSON list of stations along the route
+    bigquery.SchemaField("stations_updated_at", "TIMESTAMP", mode="NULLABLE"),
+    bigquery.SchemaField("created_at", "TIMESTAMP", mode="REQUIRED")
 ]
 
 TRIP_STATIONS_SCHEMA = [
@@ -41,6 +54,14 @@ TRIP_STATIONS_SCHEMA = [
     bigquery.SchemaField("status", "STRING")
 ]
 
+# One row per serialized operation (e.g. 'users' for registration); bumped
+# inside transactions so concurrent ones conflict instead of both committing
+LOCKS_SCHEMA = [
+    bigquery.SchemaField("name", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("version", "INTEGER", mode="REQUIRED"),
+    bigquery.SchemaField("updated_at", "TIMESTAMP", mode="REQUIRED")
+]
+
 CAR_ENERGY_COSTS_SCHEMA = [
     bigquery.SchemaField("Vehicle", "STRING", mode="NULLABLE"),
     bigquery.SchemaField("A", "INTEGER", mode="NULLABLE"),
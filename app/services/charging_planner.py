@@ -0,0 +1,172 @@
+from config import Config
+from app.services.station_index import KDTree, to_unit_vector
+from app.services.station_tiles import haversine_km
+from collections import deque
+import logging
+import csv
+
+logger = logging.getLogger(__name__)
+
+_car_charge_data = None
+
+def load_car_charge_data(path=None):
+    """Per-car battery capacity and 0-100% charge time from final_AI_car_data.csv, keyed by car name"""
+    global _car_charge_data
+    if _car_charge_data is None:
+        data = {}
+        with open(path or Config.CAR_CHARGE_DATA_PATH, newline='') as f:
+            for row in csv.DictReader(f):
+                data[row['Car_Brand']] = {
+                    'battery_kWh': float(row['Battery_Capacity_kWh']),
+                    'charge_0_100_hours': float(row['Time_to_Charge_0_100_hours'])
+                }
+        _car_charge_data = data
+    return _car_charge_data
+
+def car_charge_rate_kw(car_type):
+    """The car's own charge rate from its 0-100% charge time, used on AC chargers"""
+    car = load_car_charge_data().get(car_type)
+    if not car:
+        return Config.DEFAULT_CHARGE_RATE_KW
+    return car['battery_kWh'] / car['charge_0_100_hours']
+
+def station_charge_rate_kw(station, car_rate_kw):
+    """DC fast chargers deliver their rated power; slower ones are capped by the car's AC rate"""
+    power_kw = max((conn.get('power_kw') or 0 for conn in station.get('connections', [])), default=0)
+    if power_kw >= Config.DC_FAST_MIN_KW:
+        return power_kw
+    return min(power_kw or car_rate_kw, car_rate_kw)
+
+def route_profile(coordinates):
+    """Route points thinned to about one per corridor step, with cumulative distance in km"""
+    profile = []
+    along_km = 0.0
+    for lng, lat in coordinates:
+        if profile:
+            step = haversine_km(profile[-1][0], profile[-1][1], lat, lng)
+            if step < Config.STATION_CORRIDOR_STEP_KM and (lng, lat) != tuple(coordinates[-1]):
+                continue
+            along_km += step
+        profile.append((lat, lng, along_km))
+    return profile
+
+def plan_charging_stops(route_geometry, energy_used_kWh, start_energy_kWh, battery_kWh, stations, car_type):
+    """
+    Choose charging stops that minimise total charging time (including a fixed
+    per-stop overhead) for a trip.
+
+    Energy is spread evenly over the route's distance. Each stop charges just
+    enough to reach the next one with the reserve left, never above
+    CHARGE_TARGET_PERCENT. The DP runs over stations ordered by distance
+    along the route; since charge time is linear in energy, each charger
+    speed keeps a sliding-window minimum, so a solve is O(stations x speeds).
+    """
+    profile = route_profile(route_geometry['coordinates'])
+    route_km = profile[-1][2] if profile else 0.0
+    per_km = energy_used_kWh / route_km if route_km else 0.0
+    reserve = battery_kWh * Config.CHARGE_RESERVE_PERCENT / 100
+    max_leg = battery_kWh * (Config.CHARGE_TARGET_PERCENT - Config.CHARGE_RESERVE_PERCENT) / 100
+    start_usable = start_energy_kWh - reserve
+
+    def soc(energy):
+        return round(100 * energy / battery_kWh, 1) if battery_kWh else None
+
+    if energy_used_kWh <= start_usable:
+        return {
+            'needs_charging': False,
+            'feasible': True,
+            'stops': [],
+            'total_charge_minutes': 0.0,
+            'arrival_soc_percent': soc(start_energy_kWh - energy_used_kWh)
+        }
+
+    # Place each station at its nearest route point
+    car_rate = car_charge_rate_kw(car_type)
+    tree = KDTree([to_unit_vector(lat, lng) for lat, lng, _ in profile])
+    candidates = []
+    for station in stations:
+        if station.get('latitude') is None or station.get('longitude') is None:
+            continue
+        nearest = tree.nearest(to_unit_vector(station['latitude'], station['longitude']), 1)
+        if nearest:
+            along_km = profile[nearest[0][1]][2]
+            candidates.append((along_km * per_km, station_charge_rate_kw(station, car_rate), along_km, station))
+    candidates.sort(key=lambda c: c[0])
+
+    energies = [c[0] for c in candidates] + [energy_used_kWh]
+    n = len(candidates)
+    overhead_hours = Config.CHARGE_STOP_OVERHEAD_MINUTES / 60
+    best = [float('inf')] * (n + 1)
+    prev = [None] * (n + 1)
+    windows = {}  # rate -> deque of (best[i] + overhead - base_i / rate, energy at i, i)
+
+    for j in range(n + 1):
+        e_j = energies[j]
+        if e_j <= start_usable:
+            best[j] = 0.0
+        else:
+            for rate, window in windows.items():
+                while window and e_j - window[0][1] > max_leg:
+                    window.popleft()
+                if window and window[0][0] + e_j / rate < best[j]:
+                    best[j] = window[0][0] + e_j / rate
+                    prev[j] = window[0][2]
+
+        if j < n and best[j] < float('inf'):
+            # Stops reachable on the starting charge only top up what the start doesn't cover
+            base = start_usable if e_j <= start_usable else e_j
+            rate = candidates[j][1]
+            value = best[j] + overhead_hours - base / rate
+            window = windows.setdefault(rate, deque())
+            while window and window[-1][0] >= value:
+                window.pop()
+            window.append((value, e_j, j))
+
+    if best[n] == float('inf'):
+        return {
+            'needs_charging': True,
+            'feasible': False,
+            'stops': [],
+            'total_charge_minutes': None,
+            'arrival_soc_percent': None
+        }
+
+    chain = []
+    node = prev[n]
+    while node is not None:
+        chain.append(node)
+        node = prev[node]
+    chain.reverse()
+
+    # Walk the chosen stops to report state of charge at each one
+    stops = []
+    energy = start_energy_kWh
+    position = 0.0
+    for k, i in enumerate(chain):
+        e_i, rate, along_km, station = candidates[i]
+        energy -= e_i - position
+        position = e_i
+        next_energy = energies[chain[k + 1]] if k + 1 < len(chain) else energy_used_kWh
+        charge = max(0.0, reserve + (next_energy - e_i) - energy)
+        stops.append({
+            'station_id': station.get('id'),
+            'name': station.get('name'),
+            'latitude': station.get('latitude'),
+            'longitude': station.get('longitude'),
+            'distance_along_route_km': round(along_km, 1),
+            'charge_rate_kw': round(rate, 1),
+            'arrival_soc_percent': soc(energy),
+            'charge_kWh': round(charge, 2),
+            'charge_minutes': round(60 * charge / rate, 1),
+            'departure_soc_percent': soc(energy + charge)
+        })
+        energy += charge
+    energy -= energy_used_kWh - position
+
+    return {
+        'needs_charging': True,
+        'feasible': True,
+        'stops': stops,
+        'total_charge_minutes': round(sum(stop['charge_minutes'] for stop in stops) + len(stops) * Config.CHARGE_STOP_OVERHEAD_MINUTES, 1),
+        'arrival_soc_percent': soc(energy)
+    }
@@ -0,0 +1,23 @@
+import time
+
+class DeadlineExceeded(Exception):
+    pass
+
+class Deadline:
+    """A per-request latency budget passed down to every upstream call"""
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap=None):
+        """Seconds an upstream call may take, optionally capped; raises if the budget is spent"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline of {self.seconds}s exceeded")
+        return min(remaining, cap) if cap else remaining
@@ -0,0 +1,247 @@
+from flask import current_app, has_app_context
+from config import Config
+from app.services.station_tiles import haversine_km
+import concurrent.futures
+import threading
+import sqlite3
+import logging
+import math
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+MAX_MERCATOR_LAT = 85.0511
+
+def mercator(lng, lat):
+    """Web Mercator position at zoom 0, as fractions of the world tile (0..1)"""
+    lat = math.radians(max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat)))
+    x = (lng + 180) / 360
+    y = (1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2
+    return x, y
+
+def segment_cells(x1, y1, x2, y2):
+    """
+    Split a straight segment in grid units at every grid line it crosses.
+    Yields ((column, row), fraction of the segment) for each cell it passes through.
+    """
+    ts = {0.0, 1.0}
+    for a, b in ((x1, x2), (y1, y2)):
+        if a != b:
+            low, high = sorted((a, b))
+            ts.update((edge - a) / (b - a) for edge in range(math.floor(low) + 1, math.ceil(high)))
+    ts = sorted(ts)
+    for t1, t2 in zip(ts, ts[1:]):
+        if t2 > t1:
+            t = (t1 + t2) / 2
+            yield (int(x1 + (x2 - x1) * t), int(y1 + (y2 - y1) * t)), t2 - t1
+
+def trip_cells(coordinates, energy_used_kWh, zooms, bins):
+    """
+    Bin a route into heatmap cells. coordinates: GeoJSON [lng, lat] pairs.
+    Each segment's length and its share of the trip's energy are split between
+    every cell it crosses, in proportion to the part of it inside each.
+    Returns {(z, x, y, cell): [energy_kWh, km]}.
+    """
+    segments = []
+    for (lng1, lat1), (lng2, lat2) in zip(coordinates, coordinates[1:]):
+        km = haversine_km(lat1, lng1, lat2, lng2)
+        if km > 0:
+            segments.append((mercator(lng1, lat1), mercator(lng2, lat2), km))
+    total_km = sum(km for _, _, km in segments)
+    per_km = energy_used_kWh / total_km if total_km and energy_used_kWh else 0.0
+
+    cells = {}
+    for z in zooms:
+        # Cells of every tile at this zoom, as one grid over the world
+        size = 2 ** z * bins
+        for (mx1, my1), (mx2, my2), km in segments:
+            for (column, row), fraction in segment_cells(mx1 * size, my1 * size, mx2 * size, my2 * size):
+                column, row = min(column, size - 1), min(row, size - 1)
+                key = (z, column // bins, row // bins, (row % bins) * bins + column % bins)
+                totals = cells.get(key)
+                if totals is None:
+                    cells[key] = [km * fraction * per_km, km * fraction]
+                else:
+                    totals[0] += km * fraction * per_km
+                    totals[1] += km * fraction
+    return cells
+
+class HeatmapStore:
+    """
+    Per-user route heatmap: for each zoom level's tiles, a bins x bins grid of
+    trip counts, energy and distance, in a SQLite (WAL) file. Trips are added
+    incrementally by a single background writer, so serving a tile reads at
+    most bins^2 rows however many trips the user has.
+    """
+    def __init__(self, path, min_zoom, max_zoom, bins):
+        self.path = path
+        self.zooms = range(min_zoom, max_zoom + 1)
+        self.bins = bins
+        self._local = threading.local()
+        self._writer = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='heatmap')
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS heatmap_cells (
+            user_id TEXT NOT NULL,
+            z INTEGER NOT NULL,
+            x INTEGER NOT NULL,
+            y INTEGER NOT NULL,
+            cell INTEGER NOT NULL,
+            trips INTEGER NOT NULL,
+            energy_kwh REAL NOT NULL,
+            km REAL NOT NULL,
+            PRIMARY KEY (user_id, z, x, y, cell)
+        ) WITHOUT ROWID
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS heatmap_tiles (
+            user_id TEXT NOT NULL,
+            z INTEGER NOT NULL,
+            x INTEGER NOT NULL,
+            y INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (user_id, z, x, y)
+        ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS heatmap_meta (generation TEXT NOT NULL)")
+        conn.execute(
+            "INSERT INTO heatmap_meta (generation) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM heatmap_meta)",
+            (uuid.uuid4().hex[:8],)
+        )
+
+    def _conn(self):
+        # One connection per thread; sqlite3 connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add_trip(self, user_id, route_geometry, energy_used_kWh):
+        """Queue a trip's route for the background writer"""
+        return self._writer.submit(self._apply, user_id, route_geometry, energy_used_kWh, 1)
+
+    def remove_trip(self, user_id, route_geometry, energy_used_kWh):
+        """Queue removal of a route added earlier, e.g. before a replanned trip is re-added"""
+        return self._writer.submit(self._apply, user_id, route_geometry, energy_used_kWh, -1)
+
+    def _apply(self, user_id, route_geometry, energy_used_kWh, sign):
+        try:
+            cells = trip_cells(route_geometry['coordinates'], energy_used_kWh, self.zooms, self.bins)
+            tiles = {(z, x, y) for z, x, y, _ in cells}
+            now = time.time()
+            conn = self._conn()
+            conn.execute("BEGIN")
+            conn.executemany(
+                """
+                INSERT INTO heatmap_cells (user_id, z, x, y, cell, trips, energy_kwh, km)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, z, x, y, cell) DO UPDATE SET
+                    trips = trips + excluded.trips,
+                    energy_kwh = energy_kwh + excluded.energy_kwh,
+                    km = km + excluded.km
+                """,
+                [(user_id, z, x, y, cell, sign, sign * energy, sign * km) for (z, x, y, cell), (energy, km) in cells.items()]
+            )
+            if sign < 0:
+                conn.executemany(
+                    "DELETE FROM heatmap_cells WHERE user_id = ? AND z = ? AND x = ? AND y = ? AND cell = ? AND trips <= 0",
+                    [(user_id, *key) for key in cells]
+                )
+            conn.executemany(
+                """
+                INSERT INTO heatmap_tiles (user_id, z, x, y, version, updated_at)
+                VALUES (?, ?, ?, ?, 1, ?)
+                ON CONFLICT (user_id, z, x, y) DO UPDATE SET
+                    version = version + 1,
+                    updated_at = excluded.updated_at
+                """,
+                [(user_id, z, x, y, now) for z, x, y in tiles]
+            )
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Error updating heatmap: {str(e)}")
+            try:
+                self._conn().execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+
+    def tile_version(self, user_id, z, x, y):
+        """
+        (generation, version, updated_at) of a tile; version is 0 and updated_at
+        None if no trip has touched it. Versions restart when the store is
+        cleared, so only generation and version together identify a tile's contents.
+        """
+        return self._conn().execute(
+            """
+            SELECT m.generation, IFNULL(t.version, 0), t.updated_at
+            FROM heatmap_meta m
+            LEFT JOIN heatmap_tiles t ON t.user_id = ? AND t.z = ? AND t.x = ? AND t.y = ?
+            """,
+            (user_id, z, x, y)
+        ).fetchone()
+
+    def tile(self, user_id, z, x, y):
+        """Cells of one tile as [column, row, trips, average kWh per km]"""
+        rows = self._conn().execute(
+            "SELECT cell, trips, energy_kwh, km FROM heatmap_cells WHERE user_id = ? AND z = ? AND x = ? AND y = ?",
+            (user_id, z, x, y)
+        ).fetchall()
+        return [
+            [cell % self.bins, cell // self.bins, trips, round(energy / km, 4) if km else None]
+            for cell, trips, energy, km in rows
+        ]
+
+    def clear(self):
+        """Empty the store, e.g. before a rebuild, under a new generation"""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM heatmap_cells")
+        conn.execute("DELETE FROM heatmap_tiles")
+        conn.execute("UPDATE heatmap_meta SET generation = ?", (uuid.uuid4().hex[:8],))
+        conn.execute("COMMIT")
+
+    def flush(self):
+        """Wait for queued trips to be written"""
+        self._writer.submit(lambda: None).result()
+
+_heatmap = None
+_heatmap_lock = threading.Lock()
+
+def get_heatmap():
+    """
+    The host's heatmap store, opened on first use with the running app's
+    settings (or Config outside an app) rather than at import time.
+    """
+    global _heatmap
+    if _heatmap is None:
+        with _heatmap_lock:
+            if _heatmap is None:
+                settings = current_app.config if has_app_context() else vars(Config)
+                _heatmap = HeatmapStore(
+                    settings['HEATMAP_PATH'],
+                    settings['HEATMAP_MIN_ZOOM'],
+                    settings['HEATMAP_MAX_ZOOM'],
+                    settings['HEATMAP_BINS']
+                )
+    return _heatmap
+
+def record_trip(user_id, route_geometry, energy_used_kWh, remove=False):
+    """
+    Queue a stored trip's route on (or, with remove, off) the host's heatmap.
+    The heatmap is derived from trips and can be rebuilt, so failing to open or
+    queue on it is logged rather than failing the write that stored the trip.
+    """
+    try:
+        heatmap = get_heatmap()
+        if remove:
+            return heatmap.remove_trip(user_id, route_geometry, energy_used_kWh)
+        return heatmap.add_trip(user_id, route_geometry, energy_used_kWh)
+    except Exception as e:
+        logger.error(f"Error queuing trip for the heatmap: {str(e)}")
+        return None
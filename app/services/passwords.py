@@ -0,0 +1,102 @@
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+from config import Config
+import multiprocessing
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class PasswordHasher:
+    """
+    Runs password hashing in a bounded process pool so the PBKDF2 work
+    doesn't hold the GIL on the request thread.
+    """
+    def __init__(self, method=None, salt_length=None, workers=None, max_pending=None):
+        self.method = method or Config.PASSWORD_HASH_METHOD
+        self.salt_length = salt_length or Config.PASSWORD_SALT_LENGTH
+        self.workers = workers or Config.PASSWORD_HASH_WORKERS
+        self._pending = threading.BoundedSemaphore(max_pending or Config.PASSWORD_HASH_MAX_PENDING)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        # Create the pool lazily so importing the app doesn't start workers. They're
+        # spawned, not forked: a fork would copy the app's threads' locks and clients mid-use
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._pool
+
+    def _run(self, func, *args):
+        with self._pending:
+            return self._get_pool().submit(func, *args).result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Check if a stored hash was made with different parameters than the current config"""
+        try:
+            method, salt, _ = password_hash.split('$', 2)
+        except ValueError:
+            return True
+        return method != self.method or len(salt) != self.salt_length
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+hasher = PasswordHasher()
+
+def benchmark_logins(hasher, threads, seconds, inline=False):
+    """
+    Password checks per second with `threads` concurrent callers, the CPU-bound
+    part of a login. With inline, checks run on the calling threads instead of
+    the hasher's pool, for comparison.
+    """
+    password = 'benchmark-password'
+    password_hash = generate_password_hash(password, hasher.method, hasher.salt_length)
+    if inline:
+        verify = lambda: check_password_hash(password_hash, password)
+    else:
+        verify = lambda: hasher.verify(password_hash, password)
+    verify()  # Start the pool outside the timed run
+
+    counts = [0] * threads
+    latencies = [0.0] * threads
+    stop_at = time.monotonic() + seconds
+
+    def caller(n):
+        while time.monotonic() < stop_at:
+            began = time.monotonic()
+            verify()
+            latencies[n] += time.monotonic() - began
+            counts[n] += 1
+
+    started = time.monotonic()
+    callers = [threading.Thread(target=caller, args=(n,)) for n in range(threads)]
+    for thread in callers:
+        thread.start()
+    for thread in callers:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    logins = sum(counts)
+    return {
+        'method': hasher.method,
+        'workers': 'inline' if inline else hasher.workers,
+        'threads': threads,
+        'logins': logins,
+        'logins_per_second': round(logins / elapsed, 1),
+        'mean_latency_ms': round(1000 * sum(latencies) / logins, 1) if logins else None
+    }
@@ -0,0 +1,88 @@
+from config import Config
+from app.database import OCM_TILE_SOURCE
+from app.services.routing import RoutingService, route_response_cache
+from app.services.station_tiles import get_tile_cache, corridor_tiles, fetch_tile
+import threading
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+
+class CorridorPrewarmer:
+    """
+    Refreshes the route and station caches for the most frequent recent
+    corridors before they expire, within a budget of upstream calls per cycle.
+    The tile cache is shared by every worker on the host; the OSRM response
+    cache is per process, so each worker that runs this warms its own routes.
+    """
+    def __init__(self, db, routing=None):
+        self.db = db
+        self.routing = routing or RoutingService()
+        self.cycles = 0
+        self.last_stats = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def run_cycle(self):
+        budget = Config.PREWARM_MAX_UPSTREAM_CALLS
+        ahead = Config.PREWARM_REFRESH_AHEAD_SECONDS
+        calls = routes_refreshed = tiles_refreshed = 0
+
+        corridors = self.db.get_frequent_corridors(Config.PREWARM_LOOKBACK_DAYS, Config.PREWARM_MAX_CORRIDORS)
+        for corridor in corridors:
+            if calls >= budget:
+                break
+            start_coords = (corridor['start_lat'], corridor['start_lng'])
+            end_coords = (corridor['end_lat'], corridor['end_lng'])
+
+            try:
+                geometry = None
+                if self.routing.route_expires_in(start_coords, end_coords) < ahead:
+                    calls += 1
+                    geometry = self.routing.refresh_route(start_coords, end_coords)['geometry']
+                    routes_refreshed += 1
+                elif corridor.get('route_geometry'):
+                    geometry = json.loads(corridor['route_geometry'])
+                if not geometry:
+                    continue
+
+                keys = corridor_tiles(geometry['coordinates'], Config.STATION_CORRIDOR_KM)
+                for key in get_tile_cache().stale_tiles(OCM_TILE_SOURCE, keys, ahead):
+                    if calls >= budget:
+                        break
+                    calls += 1
+                    if fetch_tile(OCM_TILE_SOURCE, key, self.db.fetch_ocm_area, prewarmed=True) is not None:
+                        tiles_refreshed += 1
+            except Exception as e:
+                logger.error(f"Error prewarming corridor {start_coords} -> {end_coords}: {str(e)}")
+                continue
+
+        self.cycles += 1
+        self.last_stats = {
+            'corridors': len(corridors),
+            'upstream_calls': calls,
+            'routes_refreshed': routes_refreshed,
+            'tiles_refreshed': tiles_refreshed,
+            'route_cache': route_response_cache.stats(),
+            'tile_cache': get_tile_cache().stats()
+        }
+        logger.info(f"Prewarm cycle {self.cycles}: {self.last_stats}")
+        return self.last_stats
+
+    def start(self, interval=None):
+        """Run prewarm cycles in a daemon thread"""
+        interval = interval or Config.PREWARM_INTERVAL_SECONDS
+
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.run_cycle()
+                except Exception as e:
+                    logger.error(f"Prewarm cycle failed: {str(e)}")
+                self._stop.wait(interval)
+
+        self._thread = threading.Thread(target=loop, name='corridor-prewarm', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,205 @@
+from flask import has_request_context, request
+from google.cloud import bigquery
+from config import Config
+from collections import OrderedDict
+import contextvars
+import threading
+import sqlite3
+import logging
+import hashlib
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+REPORT_ORDERS = {
+    'bytes': 'bytes_billed DESC',
+    'latency': 'total_seconds DESC',
+    'calls': 'calls DESC',
+    'slots': 'slot_millis DESC'
+}
+
+# Endpoint to record queries under when they run off the request's thread
+query_endpoint = contextvars.ContextVar('query_endpoint', default=None)
+
+class QueryBudgetExceeded(Exception):
+    """A query's dry run estimated more bytes than the configured budget"""
+    pass
+
+class QueryProfiler:
+    """
+    Runs BigQuery jobs for the database layer and records, per endpoint and
+    query name, calls, errors, cache hits, bytes processed/billed, slot time
+    and wall time. Totals go to a SQLite (WAL) file shared by the host's
+    workers so they can be reported from the CLI.
+
+    Every job uses the query cache and, if QUERY_MAX_BYTES_BILLED is set, is
+    capped by BigQuery itself. With QUERY_DRY_RUN_BUDGET_BYTES set, queries are
+    dry-run first and rejected above the budget. Estimates are keyed on the
+    query text and parameter types, not values, since the bytes a query scans
+    depend on its tables and columns rather than e.g. which user it is for;
+    they're reused for QUERY_DRY_RUN_CACHE_SECONDS, up to
+    QUERY_DRY_RUN_CACHE_SIZE queries, so this doesn't double every query's
+    latency. The stats file is opened on first use, not at import.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._estimates = OrderedDict()  # query shape hash -> (bytes, estimated at), least recently used first
+        self._lock = threading.Lock()
+        self._created = False
+
+    def _create(self, conn):
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS query_stats (
+            endpoint TEXT NOT NULL,
+            name TEXT NOT NULL,
+            calls INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0,
+            cache_hits INTEGER NOT NULL DEFAULT 0,
+            bytes_processed INTEGER NOT NULL DEFAULT 0,
+            bytes_billed INTEGER NOT NULL DEFAULT 0,
+            slot_millis INTEGER NOT NULL DEFAULT 0,
+            total_seconds REAL NOT NULL DEFAULT 0,
+            max_seconds REAL NOT NULL DEFAULT 0,
+            last_at REAL NOT NULL,
+            PRIMARY KEY (endpoint, name)
+        )
+        """)
+
+    def _conn(self):
+        # One connection per thread; sqlite3 connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                if not self._created:
+                    self._create(conn)
+                    self._created = True
+        return conn
+
+    def run(self, client, name, query, job_config=None, timeout=None, page_size=None):
+        """Run a query job and wait for it. Returns (finished job, row iterator)."""
+        job_config = job_config or bigquery.QueryJobConfig()
+        job_config.use_query_cache = True
+        if Config.QUERY_MAX_BYTES_BILLED:
+            job_config.maximum_bytes_billed = Config.QUERY_MAX_BYTES_BILLED
+        if Config.QUERY_DRY_RUN_BUDGET_BYTES and not job_config.dry_run:
+            self._check_budget(client, name, query, job_config)
+
+        started = time.time()
+        job = None
+        try:
+            job = client.query(query, job_config=job_config)
+            rows = job.result(timeout=timeout, page_size=page_size)
+        except Exception:
+            self._record(name, job, time.time() - started, failed=True)
+            raise
+        self._record(name, job, time.time() - started)
+        return job, rows
+
+    def _check_budget(self, client, name, query, job_config):
+        params = job_config.query_parameters or []
+        shape = [(param.to_api_repr().get('name'), param.to_api_repr()['parameterType']) for param in params]
+        key = hashlib.sha1(json.dumps([query, shape], sort_keys=True).encode()).hexdigest()
+        with self._lock:
+            cached = self._estimates.get(key)
+            if cached and time.time() - cached[1] < Config.QUERY_DRY_RUN_CACHE_SECONDS:
+                self._estimates.move_to_end(key)
+            else:
+                cached = None
+        if cached:
+            estimate = cached[0]
+        else:
+            dry_run = client.query(query, job_config=bigquery.QueryJobConfig(
+                query_parameters=params, dry_run=True, use_query_cache=False
+            ))
+            estimate = dry_run.total_bytes_processed or 0
+            with self._lock:
+                self._estimates[key] = (estimate, time.time())
+                self._estimates.move_to_end(key)
+                while len(self._estimates) > Config.QUERY_DRY_RUN_CACHE_SIZE:
+                    self._estimates.popitem(last=False)
+        if estimate > Config.QUERY_DRY_RUN_BUDGET_BYTES:
+            self._record(name, None, 0.0, failed=True)
+            raise QueryBudgetExceeded(
+                f"Query {name} would process {estimate} bytes, over the budget of {Config.QUERY_DRY_RUN_BUDGET_BYTES}"
+            )
+
+    def _record(self, name, job, seconds, failed=False):
+        endpoint = query_endpoint.get()
+        if endpoint is None:
+            endpoint = (request.endpoint or request.path) if has_request_context() else 'cli'
+        # A dry run's bytes are an estimate; it processes and bills nothing
+        ran = job is not None and not failed and not job.dry_run
+        try:
+            self._conn().execute(
+                """
+                INSERT INTO query_stats (endpoint, name, calls, errors, cache_hits, bytes_processed,
+                                         bytes_billed, slot_millis, total_seconds, max_seconds, last_at)
+                VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (endpoint, name) DO UPDATE SET
+                    calls = calls + 1,
+                    errors = errors + excluded.errors,
+                    cache_hits = cache_hits + excluded.cache_hits,
+                    bytes_processed = bytes_processed + excluded.bytes_processed,
+                    bytes_billed = bytes_billed + excluded.bytes_billed,
+                    slot_millis = slot_millis + excluded.slot_millis,
+                    total_seconds = total_seconds + excluded.total_seconds,
+                    max_seconds = MAX(max_seconds, excluded.max_seconds),
+                    last_at = excluded.last_at
+                """,
+                (
+                    endpoint, name, int(failed),
+                    int(bool(job is not None and job.cache_hit)),
+                    (job.total_bytes_processed or 0) if ran else 0,
+                    (job.total_bytes_billed or 0) if ran else 0,
+                    (job.slot_millis or 0) if ran else 0,
+                    seconds, seconds, time.time()
+                )
+            )
+        except sqlite3.Error as e:
+            # Profiling must never fail a query
+            logger.error(f"Error recording query stats: {str(e)}")
+
+    def report(self, order='bytes', limit=20, by_endpoint=True):
+        """Top queries by cost or latency, optionally folded across endpoints"""
+        group = "endpoint, name" if by_endpoint else "name"
+        rows = self._conn().execute(
+            f"""
+            SELECT {"endpoint" if by_endpoint else "'*'"} AS endpoint, name,
+                   SUM(calls) AS calls, SUM(errors) AS errors, SUM(cache_hits) AS cache_hits,
+                   SUM(bytes_processed) AS bytes_processed, SUM(bytes_billed) AS bytes_billed,
+                   SUM(slot_millis) AS slot_millis, SUM(total_seconds) AS total_seconds,
+                   MAX(max_seconds) AS max_seconds
+            FROM query_stats
+            GROUP BY {group}
+            ORDER BY {REPORT_ORDERS[order]}
+            LIMIT ?
+            """,
+            (limit,)
+        ).fetchall()
+        return [
+            {
+                'endpoint': endpoint,
+                'name': name,
+                'calls': calls,
+                'errors': errors,
+                'cache_hit_rate': cache_hits / calls if calls else None,
+                'bytes_processed': bytes_processed,
+                'bytes_billed': bytes_billed,
+                'slot_millis': slot_millis,
+                'avg_seconds': total_seconds / calls if calls else None,
+                'max_seconds': max_seconds
+            }
+            for endpoint, name, calls, errors, cache_hits, bytes_processed,
+                bytes_billed, slot_millis, total_seconds, max_seconds in rows
+        ]
+
+    def reset(self):
+        self._conn().execute("DELETE FROM query_stats")
+
+query_profiler = QueryProfiler(Config.QUERY_STATS_PATH)
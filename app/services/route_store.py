@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from config import Config
+import threading
+import hashlib
+import json
+
+def canonical_geometry(geometry):
+    """Serialize a GeoJSON geometry the same way every time so equal routes hash equally"""
+    return json.dumps(geometry, sort_keys=True, separators=(',', ':'))
+
+def route_hash(geometry):
+    return hashlib.sha256(canonical_geometry(geometry).encode()).hexdigest()
+
+def leg_key(start_coords, end_coords):
+    """Identify a leg by its (lat, lng) endpoints, rounded like OSRM request URLs"""
+    return tuple(round(value, 6) for value in (*start_coords, *end_coords))
+
+def join_geometries(geometries):
+    """Join consecutive leg LineStrings into one, dropping the repeated point where legs meet"""
+    coordinates = []
+    for geometry in geometries:
+        points = geometry['coordinates']
+        if coordinates and points and coordinates[-1] == points[0]:
+            points = points[1:]
+        coordinates.extend(points)
+    return {'type': 'LineString', 'coordinates': coordinates}
+
+class RouteCache:
+    """
+    In-process LRU of stored routes keyed by route hash. Entries hold the
+    serialized geometry, distance/duration and, when known, the corridor's
+    station results with the time they were found.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+route_cache = RouteCache(Config.ROUTE_CACHE_SIZE)
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from config import Config
+from app.services.singleflight import SingleFlight
+from app.services.deadline import DeadlineExceeded
+import threading
+import requests
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Shared by every RoutingService so identical in-flight requests are collapsed
+osrm_flights = SingleFlight()
+
+class RouteResponseCache:
+    """
+    In-process LRU of OSRM routes keyed by request URL, with a TTL. Tracks
+    hit/miss counts, including hits on entries put there by the prewarmer.
+    """
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # url -> (fetched_at, route, prewarmed)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prewarmed_hits = 0
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None or time.time() - entry[0] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            if entry[2]:
+                self.prewarmed_hits += 1
+            return entry[1]
+
+    def expires_in(self, url):
+        """Seconds until a cached route expires, 0 if it isn't cached"""
+        with self._lock:
+            entry = self._entries.get(url)
+        return max(0.0, entry[0] + self.ttl_seconds - time.time()) if entry else 0.0
+
+    def put(self, url, route, prewarmed=False):
+        with self._lock:
+            self._entries[url] = (time.time(), route, prewarmed)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'prewarmed_hits': self.prewarmed_hits,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'prewarm_hit_rate': self.prewarmed_hits / lookups if lookups else None
+        }
+
+route_response_cache = RouteResponseCache(
+    Config.ROUTE_RESPONSE_CACHE_SIZE,
+    Config.ROUTE_RESPONSE_TTL_HOURS * 3600
+)
+
+class RoutingService:
+    def __init__(self, base_url=None, table_url=None):
+        self.base_url = base_url or Config.OSRM_BASE_URL
+        self.table_url = table_url or Config.OSRM_TABLE_URL
+
+    def route_url(self, start_coords, end_coords):
+        """Build the OSRM route URL; coords are (lat, lng) and rounded so equal requests share a key"""
+        start_lat, start_lng = round(start_coords[0], 6), round(start_coords[1], 6)
+        end_lat, end_lng = round(end_coords[0], 6), round(end_coords[1], 6)
+        return f"{self.base_url}{start_lng},{start_lat};{end_lng},{end_lat}?geometries=geojson&overview=full"
+
+    def get_route(self, start_coords, end_coords, deadline=None):
+        """Get the best OSRM route between two (lat, lng) points"""
+        url = self.route_url(start_coords, end_coords)
+        route = route_response_cache.get(url)
+        if route is not None:
+            return route
+            
+        timeout = deadline.timeout() if deadline else None
+        try:
+            return osrm_flights.do(url, self._fetch_route, url, timeout, timeout=timeout)
+        except (requests.Timeout, TimeoutError):
+            raise DeadlineExceeded("OSRM route request timed out")
+
+    def get_table(self, origin, destinations, deadline=None):
+        """
+        Distances and durations from one (lat, lng) origin to many destinations,
+        in as few OSRM table requests as its coordinate limit allows. Returns one
+        {'distance', 'duration'} per destination, or None where OSRM found no route.
+        """
+        per_request = Config.OSRM_TABLE_MAX_COORDINATES - 1  # The origin takes one slot
+        legs = []
+        for i in range(0, len(destinations), per_request):
+            legs.extend(self._get_table_chunk(origin, destinations[i:i + per_request], deadline))
+        return legs
+
+    def _get_table_chunk(self, origin, destinations, deadline=None):
+        coords = ";".join(f"{round(lng, 6)},{round(lat, 6)}" for lat, lng in [origin, *destinations])
+        url = f"{self.table_url}{coords}?sources=0&annotations=distance,duration"
+        timeout = deadline.timeout() if deadline else None
+        try:
+            return osrm_flights.do(url, self._fetch_table, url, timeout, timeout=timeout)
+        except (requests.Timeout, TimeoutError):
+            raise DeadlineExceeded("OSRM table request timed out")
+
+    def _fetch_table(self, url, timeout=None):
+        response = requests.get(url, timeout=timeout)
+        table = response.json()
+        
+        if response.status_code != 200 or table.get('code') != 'Ok':
+            raise Exception("Failed to get distance table from OSRM")
+            
+        # Row 0 is the origin; column 0 is the origin itself
+        distances = table['distances'][0][1:]
+        durations = table['durations'][0][1:]
+        return [
+            {'distance': distance, 'duration': duration} if distance is not None and duration is not None else None
+            for distance, duration in zip(distances, durations)
+        ]
+
+    def refresh_route(self, start_coords, end_coords):
+        """Re-fetch a route into the cache ahead of expiry (used by the prewarmer)"""
+        url = self.route_url(start_coords, end_coords)
+        return osrm_flights.do(url, self._fetch_route, url, None, True)
+
+    def route_expires_in(self, start_coords, end_coords):
+        return route_response_cache.expires_in(self.route_url(start_coords, end_coords))
+
+    def _fetch_route(self, url, timeout=None, prewarmed=False):
+        response = requests.get(url, timeout=timeout)
+        route_data = response.json()
+        
+        if response.status_code != 200 or 'routes' not in route_data or not route_data['routes']:
+            raise Exception("Failed to get route from OSRM")
+            
+        route_response_cache.put(url, route_data['routes'][0], prewarmed=prewarmed)
+        return route_data['routes'][0]
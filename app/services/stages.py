@@ -0,0 +1,106 @@
+from flask import current_app, has_app_context, has_request_context, request
+from app.services.query_profiler import query_endpoint
+from config import Config
+import concurrent.futures
+import threading
+import time
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_stage_executor():
+    """
+    The process's stage pool, shared by every StageGraph and sized by
+    TRIP_STAGE_WORKERS from the running app (or Config outside an app).
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                settings = current_app.config if has_app_context() else vars(Config)
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=settings['TRIP_STAGE_WORKERS'], thread_name_prefix='stage'
+                )
+    return _executor
+
+class StageGraph:
+    """
+    Runs named stages on an executor as soon as the stages they depend on
+    finish. A stage is called with its dependencies' results first, then its
+    own arguments; if a dependency fails, so does the stage. Each stage's
+    start offset and duration are recorded in timings (milliseconds).
+
+    A stage is only submitted once its dependencies are done, so no worker
+    ever waits on another and graphs can share one bounded executor. Stages
+    don't get the request context; queries they run are profiled under the
+    endpoint that added them.
+    """
+    def __init__(self, executor=None):
+        self.executor = executor or get_stage_executor()
+        self.started = time.time()
+        self.futures = {}
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, func, *args, after=(), **kwargs):
+        dependencies = [self.futures[dependency] for dependency in after]
+        endpoint = (request.endpoint or request.path) if has_request_context() else None
+        future = concurrent.futures.Future()
+        remaining = [len(dependencies)]
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            token = query_endpoint.set(endpoint)
+            began = time.time()
+            try:
+                future.set_result(func(*[dependency.result() for dependency in dependencies], *args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                query_endpoint.reset(token)
+                with self._lock:
+                    self.timings[name] = {
+                        'start_ms': round((began - self.started) * 1000, 1),
+                        'duration_ms': round((time.time() - began) * 1000, 1)
+                    }
+
+        def dependency_done(dependency):
+            if dependency.exception() is not None:
+                # Only the first failure settles the stage
+                with self._lock:
+                    if future.done():
+                        return
+                    future.set_exception(dependency.exception())
+                return
+            with self._lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0 and not future.done()
+            if ready:
+                self._submit(future, run)
+
+        self.futures[name] = future
+        if dependencies:
+            for dependency in dependencies:
+                dependency.add_done_callback(dependency_done)
+        else:
+            self._submit(future, run)
+        return future
+
+    def _submit(self, future, run):
+        try:
+            self.executor.submit(run)
+        except RuntimeError as e:
+            # The executor is shutting down
+            future.set_exception(e)
+
+    def wait(self):
+        """Block until every stage has finished or failed"""
+        concurrent.futures.wait(list(self.futures.values()))
+
+    def result(self, name):
+        return self.futures[name].result()
+
+    def summary(self):
+        """Stage timings plus the wall time since the graph started"""
+        return {'total_ms': round((time.time() - self.started) * 1000, 1), 'stages': dict(self.timings)}
@@ -0,0 +1,187 @@
+import threading
+import logging
+import heapq
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+LEAF_SIZE = 16
+
+def to_unit_vector(lat, lng):
+    """Point on the unit sphere, so straight-line (chord) distance orders like great-circle distance"""
+    lat, lng = math.radians(lat), math.radians(lng)
+    return (math.cos(lat) * math.cos(lng), math.cos(lat) * math.sin(lng), math.sin(lat))
+
+def km_to_chord2(km):
+    """Squared chord length on the unit sphere for a great-circle distance"""
+    chord = 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+    return chord * chord
+
+def chord2_to_km(chord2):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord2) / 2))
+
+class KDTree:
+    """
+    3-d tree over unit-sphere points. Internal nodes are (axis, split, left, right)
+    tuples and leaves are lists of point indices.
+    """
+    def __init__(self, points):
+        self.points = points
+        self.root = self._build(list(range(len(points))), 0) if points else []
+
+    def _build(self, indices, depth):
+        if len(indices) <= LEAF_SIZE:
+            return indices
+        axis = depth % 3
+        indices.sort(key=lambda i: self.points[i][axis])
+        mid = len(indices) // 2
+        return (
+            axis,
+            self.points[indices[mid]][axis],
+            self._build(indices[:mid], depth + 1),
+            self._build(indices[mid:], depth + 1)
+        )
+
+    def _dist2(self, i, q):
+        p = self.points[i]
+        return (p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2 + (p[2] - q[2]) ** 2
+
+    def nearest(self, q, k, max_dist2=float('inf'), predicate=None):
+        """k nearest points within max_dist2 that pass predicate, as sorted (dist2, index) pairs"""
+        if k < 1:
+            return []
+        heap = []  # Max-heap of (-dist2, index)
+
+        def bound():
+            return -heap[0][0] if len(heap) == k else max_dist2
+
+        # Stack of (node, lower bound on dist2 to anything in it)
+        stack = [(self.root, 0.0)]
+        while stack:
+            node, min_d2 = stack.pop()
+            if min_d2 > bound():
+                continue
+            if isinstance(node, list):
+                for i in node:
+                    d2 = self._dist2(i, q)
+                    if d2 > bound() or (predicate and not predicate(i)):
+                        continue
+                    if len(heap) < k:
+                        heapq.heappush(heap, (-d2, i))
+                    else:
+                        heapq.heapreplace(heap, (-d2, i))
+                continue
+            axis, split, left, right = node
+            diff = q[axis] - split
+            near, far = (left, right) if diff < 0 else (right, left)
+            # Far side is pushed first so the near side is searched first
+            stack.append((far, diff * diff))
+            stack.append((near, min_d2))
+        return sorted((-d2, i) for d2, i in heap)
+
+    def within(self, q, max_dist2, predicate=None):
+        """All points within max_dist2 that pass predicate, as sorted (dist2, index) pairs"""
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                for i in node:
+                    d2 = self._dist2(i, q)
+                    if d2 <= max_dist2 and (not predicate or predicate(i)):
+                        found.append((d2, i))
+                continue
+            axis, split, left, right = node
+            diff = q[axis] - split
+            if diff < 0 or diff * diff <= max_dist2:
+                stack.append(left)
+            if diff >= 0 or diff * diff <= max_dist2:
+                stack.append(right)
+        found.sort()
+        return found
+
+class StationIndex:
+    """Spatial index over stored stations with connection-type and power filters"""
+    def __init__(self, stations):
+        self.stations = stations
+        self.tree = KDTree([to_unit_vector(s['latitude'], s['longitude']) for s in stations])
+        self._types = [{t.lower() for t in s.get('connection_types') or []} for s in stations]
+        self.built_at = time.time()
+
+    def _predicate(self, connection_type=None, min_power_kw=None):
+        if not connection_type and min_power_kw is None:
+            return None
+        wanted = connection_type.lower() if connection_type else None
+
+        def matches(i):
+            if min_power_kw is not None and (self.stations[i].get('max_power_kw') or 0) < min_power_kw:
+                return False
+            if wanted and not any(wanted in t for t in self._types[i]):
+                return False
+            return True
+        return matches
+
+    def _results(self, pairs):
+        return [{**self.stations[i], 'distance_km': round(chord2_to_km(d2), 3)} for d2, i in pairs]
+
+    def nearest(self, lat, lng, k=10, radius_km=None, connection_type=None, min_power_kw=None):
+        max_dist2 = km_to_chord2(radius_km) if radius_km is not None else float('inf')
+        pairs = self.tree.nearest(
+            to_unit_vector(lat, lng), k, max_dist2,
+            self._predicate(connection_type, min_power_kw)
+        )
+        return self._results(pairs)
+
+    def within(self, lat, lng, radius_km, connection_type=None, min_power_kw=None, limit=None):
+        pairs = self.tree.within(
+            to_unit_vector(lat, lng), km_to_chord2(radius_km),
+            self._predicate(connection_type, min_power_kw)
+        )
+        return self._results(pairs[:limit] if limit else pairs)
+
+    def filter(self, connection_type=None, min_power_kw=None, limit=None):
+        predicate = self._predicate(connection_type, min_power_kw)
+        matches = [s for i, s in enumerate(self.stations) if not predicate or predicate(i)]
+        return matches[:limit] if limit else matches
+
+class StationIndexCache:
+    """
+    Holds the current StationIndex. The first call builds it; after
+    refresh_seconds a rebuild runs in the background while the old index
+    keeps serving queries.
+    """
+    def __init__(self, refresh_seconds):
+        self.refresh_seconds = refresh_seconds
+        self._index = None
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+    def _build(self, loader):
+        stations = loader()
+        index = StationIndex(stations)
+        logger.info(f"Built station index with {len(stations)} stations")
+        return index
+
+    def _rebuild(self, loader):
+        try:
+            self._index = self._build(loader)
+        except Exception as e:
+            logger.error(f"Error rebuilding station index: {str(e)}")
+        finally:
+            self._rebuilding = False
+
+    def get(self, loader):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._build(loader)
+            return self._index
+
+        if time.time() - self._index.built_at > self.refresh_seconds:
+            with self._lock:
+                if not self._rebuilding:
+                    self._rebuilding = True
+                    threading.Thread(target=self._rebuild, args=(loader,), daemon=True).start()
+        return self._index
@@ -0,0 +1,318 @@
+from flask import current_app, has_app_context
+from config import Config
+from app.services.singleflight import SingleFlight
+import threading
+import sqlite3
+import logging
+import math
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+KM_PER_DEGREE = 111.32
+
+# Shared by every tile fetch so concurrent misses on one tile make one OCM call
+tile_flights = SingleFlight()
+
+def tile_key(lat, lng, size=None):
+    """Grid cell (row, col) containing a point"""
+    size = size or Config.STATION_TILE_DEGREES
+    return (math.floor(lat / size), math.floor(lng / size))
+
+def tile_id(source, key):
+    return f"{source}:{key[0]}:{key[1]}"
+
+def tile_bounds(key, size=None):
+    """(min_lat, min_lng, max_lat, max_lng) of a tile"""
+    size = size or Config.STATION_TILE_DEGREES
+    return (key[0] * size, key[1] * size, (key[0] + 1) * size, (key[1] + 1) * size)
+
+def tile_center(key, size=None):
+    min_lat, min_lng, max_lat, max_lng = tile_bounds(key, size)
+    return ((min_lat + max_lat) / 2, (min_lng + max_lng) / 2)
+
+def tile_radius_km(key, size=None):
+    """Distance from a tile's center to its corners, i.e. the OCM radius that covers it"""
+    min_lat, min_lng, max_lat, max_lng = tile_bounds(key, size)
+    return haversine_km((min_lat + max_lat) / 2, (min_lng + max_lng) / 2, max_lat, max_lng)
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+def corridor_tiles(coordinates, corridor_km, size=None):
+    """
+    Minimal set of tiles within corridor_km of a route.
+    coordinates: GeoJSON [lng, lat] pairs. Returns {tile key: [(lat, lng, km along route), ...]}
+    with the route points near each tile, used later to measure station distance.
+    """
+    size = size or Config.STATION_TILE_DEGREES
+    tiles = {}
+    last = None
+    along = 0.0
+    for lng, lat in coordinates:
+        # Thin dense OSRM geometry to roughly one point per step
+        if last:
+            step = haversine_km(last[0], last[1], lat, lng)
+            if step < Config.STATION_CORRIDOR_STEP_KM:
+                continue
+            along += step
+        last = (lat, lng, along)
+
+        dlat = corridor_km / KM_PER_DEGREE
+        dlng = corridor_km / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+        min_row, min_col = tile_key(lat - dlat, lng - dlng, size)
+        max_row, max_col = tile_key(lat + dlat, lng + dlng, size)
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                tiles.setdefault((row, col), []).append(last)
+    return tiles
+
+def stations_in_corridor(corridor, tile_stations, corridor_km):
+    """
+    Pick the stations from fetched tiles that are within corridor_km of the route.
+    Each station counts towards the stretch of route (STATION_SEGMENT_KM long)
+    nearest to it, and only the STATION_MAX_PER_SEGMENT closest per stretch are
+    kept, so long or dense routes don't return thousands of stations.
+    Returns a list of (raw OCM station, distance to route in km), unique by
+    station ID, in route order.
+    """
+    found = {}
+    for key, stations in tile_stations.items():
+        points = corridor.get(key)
+        if not points:
+            continue
+        for station in stations:
+            address = station.get('AddressInfo') or {}
+            lat, lng = address.get('Latitude'), address.get('Longitude')
+            if lat is None or lng is None:
+                continue
+            distance, along = min((haversine_km(lat, lng, p_lat, p_lng), p_along) for p_lat, p_lng, p_along in points)
+            if distance <= corridor_km and (station.get('ID') not in found or distance < found[station.get('ID')][1]):
+                found[station.get('ID')] = (station, distance, along)
+
+    segments = {}
+    for station, distance, along in found.values():
+        segments.setdefault(int(along // Config.STATION_SEGMENT_KM), []).append((distance, along, station))
+    kept = []
+    for segment in sorted(segments):
+        nearest = sorted(segments[segment], key=lambda entry: entry[0])[:Config.STATION_MAX_PER_SEGMENT]
+        kept.extend(sorted(nearest, key=lambda entry: entry[1]))
+    return [(station, round(distance, 2)) for distance, along, station in kept]
+
+class TileCache:
+    """
+    OCM results per tile in a SQLite (WAL) file shared by all workers on the
+    host, with a TTL and a cap on the number of tiles kept. Hit/miss counts
+    cover lookups made while searching for stations, not prewarming.
+    """
+    def __init__(self, path, ttl_seconds, max_tiles):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_tiles = max_tiles
+        self._local = threading.local()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.prewarmed_hits = 0
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS ocm_tiles (
+            tile TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            prewarmed INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+        try:
+            # Cache files created before prewarming don't have the column yet
+            conn.execute("ALTER TABLE ocm_tiles ADD COLUMN prewarmed INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass
+        conn.execute("CREATE INDEX IF NOT EXISTS ocm_tiles_fetched_at ON ocm_tiles (fetched_at)")
+
+    def _conn(self):
+        # One connection per thread; sqlite3 connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, source, keys):
+        """Fresh cached stations for the given tiles, {tile key: [raw stations]}"""
+        ids = {tile_id(source, key): key for key in keys}
+        found = {}
+        prewarmed = 0
+        for tile, data, fetched_at, was_prewarmed in self._rows(list(ids)):
+            if fetched_at >= time.time() - self.ttl_seconds:
+                found[ids[tile]] = json.loads(data)
+                prewarmed += was_prewarmed
+        self.hits += len(found)
+        self.misses += len(ids) - len(found)
+        self.prewarmed_hits += prewarmed
+        return found
+
+    def stale_tiles(self, source, keys, ahead_seconds):
+        """Tiles that are missing or will expire within ahead_seconds"""
+        ids = {tile_id(source, key): key for key in keys}
+        cutoff = time.time() - self.ttl_seconds + ahead_seconds
+        fresh = {tile for tile, data, fetched_at, prewarmed in self._rows(list(ids)) if fetched_at >= cutoff}
+        return [key for tile, key in ids.items() if tile not in fresh]
+
+    def _rows(self, id_list):
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(id_list), 500):
+            chunk = id_list[start:start + 500]
+            yield from self._conn().execute(
+                f"SELECT tile, data, fetched_at, prewarmed FROM ocm_tiles WHERE tile IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'prewarmed_hits': self.prewarmed_hits,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'prewarm_hit_rate': self.prewarmed_hits / lookups if lookups else None
+        }
+
+    def put(self, source, key, stations, prewarmed=False):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO ocm_tiles (tile, data, fetched_at, prewarmed) VALUES (?, ?, ?, ?)",
+            (tile_id(source, key), json.dumps(stations), time.time(), int(prewarmed))
+        )
+        self._puts += 1
+        if self._puts % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        """Drop expired tiles, then the oldest ones beyond max_tiles"""
+        try:
+            conn = self._conn()
+            conn.execute("DELETE FROM ocm_tiles WHERE fetched_at < ?", (time.time() - self.ttl_seconds,))
+            count = conn.execute("SELECT COUNT(*) FROM ocm_tiles").fetchone()[0]
+            if count > self.max_tiles:
+                conn.execute(
+                    "DELETE FROM ocm_tiles WHERE tile IN (SELECT tile FROM ocm_tiles ORDER BY fetched_at LIMIT ?)",
+                    (count - self.max_tiles,)
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Tile cache eviction failed: {str(e)}")
+
+_tile_cache = None
+_tile_cache_lock = threading.Lock()
+
+def get_tile_cache():
+    """
+    The host's tile cache, opened on first use with the running app's settings
+    (or Config outside an app) rather than at import time.
+    """
+    global _tile_cache
+    if _tile_cache is None:
+        with _tile_cache_lock:
+            if _tile_cache is None:
+                settings = current_app.config if has_app_context() else vars(Config)
+                _tile_cache = TileCache(
+                    settings['STATION_TILE_CACHE_PATH'],
+                    settings['STATION_TILE_TTL_HOURS'] * 3600,
+                    settings['STATION_TILE_CACHE_MAX_TILES']
+                )
+    return _tile_cache
+
+def fetch_area(fetch, bounds, deadline=None, splits=0):
+    """
+    Stations inside bounds (min_lat, min_lng, max_lat, max_lng). OCM returns at
+    most STATION_TILE_MAX_RESULTS per query, so an area that hits the limit is
+    split into quadrants, up to STATION_TILE_MAX_SPLITS times. Returns
+    (stations, complete), or (None, False) if the first request fails;
+    complete is False when the result may still be missing stations.
+    """
+    min_lat, min_lng, max_lat, max_lng = bounds
+    lat, lng = (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+    timeout = deadline.timeout(Config.OCM_TIMEOUT_SECONDS) if deadline else None
+    stations = fetch(lat, lng, haversine_km(lat, lng, max_lat, max_lng), timeout)
+    if stations is None:
+        return None, False
+    inside = [
+        station for station in stations
+        if min_lat <= (station.get('AddressInfo') or {}).get('Latitude', 1e9) < max_lat
+        and min_lng <= (station.get('AddressInfo') or {}).get('Longitude', 1e9) < max_lng
+    ]
+    if len(stations) < Config.STATION_TILE_MAX_RESULTS:
+        return inside, True
+    if splits >= Config.STATION_TILE_MAX_SPLITS:
+        return inside, False
+
+    found = {}
+    for quadrant in (
+        (min_lat, min_lng, lat, lng), (min_lat, lng, lat, max_lng),
+        (lat, min_lng, max_lat, lng), (lat, lng, max_lat, max_lng)
+    ):
+        quadrant_stations, complete = fetch_area(fetch, quadrant, deadline, splits + 1)
+        if quadrant_stations is None:
+            # Keep what the truncated query returned, but don't claim it's complete
+            return inside, False
+        found.update((station.get('ID'), station) for station in quadrant_stations)
+        if not complete:
+            break
+    return list(found.values()), complete
+
+def fetch_tile(source, key, fetch, deadline=None, prewarmed=False):
+    """
+    Fetch one tile from OCM and cache it. fetch(lat, lng, radius_km, timeout)
+    returns the raw OCM station list, or None on failure (which isn't cached).
+    Tiles that are still truncated after splitting are returned but not cached,
+    so the next search tries again.
+    """
+    def load():
+        stations, complete = fetch_area(fetch, tile_bounds(key), deadline)
+        if stations is None:
+            return None
+        if complete:
+            get_tile_cache().put(source, key, stations, prewarmed=prewarmed)
+        else:
+            logger.warning(f"Tile {key} has more than {Config.STATION_TILE_MAX_RESULTS} stations per query even after splitting; not caching it")
+        return stations
+
+    timeout = deadline.timeout(Config.OCM_TIMEOUT_SECONDS) if deadline else None
+    return tile_flights.do(tile_id(source, key), load, timeout=timeout)
+
+def find_corridor_stations(source, coordinates, corridor_km, fetch, deadline=None, only_tiles=None):
+    """
+    Stations within corridor_km of a route, served from the tile cache where
+    possible. Returns (list of (raw station, distance_km), pending tile keys)
+    where pending tiles are the ones not fetched before the deadline ran out
+    or whose lookup failed.
+    """
+    corridor = corridor_tiles(coordinates, corridor_km)
+    keys = [key for key in corridor if only_tiles is None or key in only_tiles]
+    tile_stations = get_tile_cache().get_many(source, keys)
+    misses = [key for key in keys if key not in tile_stations]
+    logger.info(f"Corridor covers {len(keys)} tiles, {len(misses)} not cached")
+
+    pending = []
+    for i, key in enumerate(misses):
+        if deadline and deadline.remaining() < Config.STATION_SEARCH_RESERVE_SECONDS:
+            pending.extend(misses[i:])
+            logger.warning(f"Deadline reached with {len(misses) - i} tiles left")
+            break
+        try:
+            stations = fetch_tile(source, key, fetch, deadline)
+        except Exception as e:
+            logger.warning(f"OCM lookup failed for tile {key}: {str(e)}")
+            pending.append(key)
+            continue
+        if stations is not None:
+            tile_stations[key] = stations
+        else:
+            pending.append(key)
+
+    return stations_in_corridor(corridor, tile_stations, corridor_km), pending
@@ -0,0 +1,186 @@
+from google.cloud import bigquery
+from config import Config
+from app.schemas import TRIPS_SCHEMA, TRIP_STATIONS_SCHEMA
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+# Selected alongside route_geometry so multi-stop trips' geometry can be joined from their legs
+LEGS_COLUMN = '_export_legs'
+
+def _pyarrow():
+    # Optional dependency, only needed for exports
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Trip export needs pyarrow (pip install pyarrow)")
+    return pyarrow
+
+def _storage_client():
+    """BigQuery Storage Read API client if google-cloud-bigquery-storage is installed"""
+    try:
+        from google.cloud import bigquery_storage
+    except ImportError:
+        return None
+    return bigquery_storage.BigQueryReadClient()
+
+def _arrow_type(pa, field_type):
+    return {
+        'STRING': pa.string(),
+        'FLOAT': pa.float64(),
+        'FLOAT64': pa.float64(),
+        'INTEGER': pa.int64(),
+        'INT64': pa.int64(),
+        'BOOLEAN': pa.bool_(),
+        'BOOL': pa.bool_(),
+        'TIMESTAMP': pa.timestamp('us', tz='UTC')
+    }.get(field_type, pa.string())
+
+class TripExporter:
+    """
+    Streams trips, and optionally their stations, to Parquet or Arrow IPC files.
+    Results are read through the Storage Read API when it's installed, otherwise
+    page by page; either way one record batch is held in memory at a time.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.storage = _storage_client()
+
+    def export(self, out_dir, fmt='parquet', columns=None, filters=None, include_stations=False):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        trip_columns = self._columns(columns, TRIPS_SCHEMA)
+        conditions, params = self.db.trip_filter_conditions(filters)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        os.makedirs(out_dir, exist_ok=True)
+        started = time.time()
+
+        # Trips stored by route_hash get their geometry from the routes table;
+        # multi-stop trips have no route_hash and are joined from their legs as they're written
+        select = ', '.join(
+            "COALESCE(t.route_geometry, r.route_geometry) AS route_geometry" if column == 'route_geometry' else f"t.{column}"
+            for column in trip_columns
+        )
+        join = ""
+        if 'route_geometry' in trip_columns:
+            select += f", t.legs AS {LEGS_COLUMN}"
+            # One row per hash: concurrent inserts can store a route twice
+            join = f"""
+            LEFT JOIN (
+                SELECT route_hash, ANY_VALUE(route_geometry) AS route_geometry
+                FROM `{self.db.dataset}.{Config.BQ_ROUTES_TABLE}`
+                GROUP BY route_hash
+            ) r ON r.route_hash = t.route_hash
+            """
+        # Filter before joining, since the filter columns aren't qualified
+        query = f"""
+        SELECT {select}
+        FROM (SELECT * FROM `{self.db.dataset}.{Config.BQ_TRIPS_TABLE}` {where}) t
+        {join}
+        """
+        stats = {'files': [], 'trips': 0, 'stations': 0}
+        path = os.path.join(out_dir, f"trips.{EXPORT_FORMATS[fmt]}")
+        stats['trips'] = self._write(self._query(query, params), path, fmt)
+        stats['files'].append(path)
+
+        if include_stations:
+            query = f"""
+            SELECT {', '.join(self._columns(None, TRIP_STATIONS_SCHEMA))}
+            FROM `{self.db.dataset}.{self.db.trip_stations_table}`
+            WHERE trip_id IN (
+                SELECT trip_id FROM `{self.db.dataset}.{Config.BQ_TRIPS_TABLE}` {where}
+            )
+            """
+            path = os.path.join(out_dir, f"trip_stations.{EXPORT_FORMATS[fmt]}")
+            stats['stations'] = self._write(self._query(query, params), path, fmt)
+            stats['files'].append(path)
+
+        stats['seconds'] = round(time.time() - started, 2)
+        logger.info(f"Exported trips: {stats}")
+        return stats
+
+    @staticmethod
+    def _columns(columns, schema):
+        names = [field.name for field in schema]
+        if not columns:
+            return names
+        unknown = [column for column in columns if column not in names]
+        if unknown:
+            raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+        return list(columns)
+
+    def _query(self, query, params):
+        job_config = bigquery.QueryJobConfig(query_parameters=params)
+        return self.db.run_query('export_trips', query, job_config, page_size=Config.EXPORT_PAGE_ROWS)
+
+    def _record_batches(self, results):
+        pa = _pyarrow()
+        if self.storage is not None and hasattr(results, 'to_arrow_iterable'):
+            yield from results.to_arrow_iterable(bqstorage_client=self.storage)
+            return
+
+        schema = pa.schema([(field.name, _arrow_type(pa, field.field_type)) for field in results.schema])
+        for page in results.pages:
+            rows = [row.values() for row in page]
+            if not rows:
+                continue
+            yield pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+                schema=schema
+            )
+
+    def _join_leg_geometries(self, batch):
+        """Fill in multi-stop trips' route_geometry from their legs' routes and drop the legs helper column"""
+        pa = _pyarrow()
+        trips = [
+            {'route_geometry': geometry, 'legs': legs}
+            for geometry, legs in zip(batch.column('route_geometry').to_pylist(), batch.column(LEGS_COLUMN).to_pylist())
+        ]
+        if any(trip['legs'] and not trip['route_geometry'] for trip in trips):
+            self.db.attach_route_geometry(trips)
+        names = [name for name in batch.schema.names if name != LEGS_COLUMN]
+        arrays = [
+            pa.array([trip['route_geometry'] for trip in trips], type=pa.string()) if name == 'route_geometry'
+            else batch.column(name)
+            for name in names
+        ]
+        return pa.RecordBatch.from_arrays(arrays, names=names)
+
+    def _write(self, results, path, fmt):
+        """Write record batches to path as they arrive; returns the row count"""
+        pa = _pyarrow()
+        writer = None
+        rows = 0
+        try:
+            for batch in self._record_batches(results):
+                if LEGS_COLUMN in batch.schema.names:
+                    batch = self._join_leg_geometries(batch)
+                if writer is None:
+                    writer = self._open(pa, path, fmt, batch.schema)
+                if fmt == 'parquet':
+                    writer.write_table(pa.Table.from_batches([batch]))
+                else:
+                    writer.write_batch(batch)
+                rows += batch.num_rows
+            if writer is None:
+                # No rows: still write a file with the right columns
+                schema = pa.schema([
+                    (field.name, _arrow_type(pa, field.field_type)) for field in results.schema if field.name != LEGS_COLUMN
+                ])
+                writer = self._open(pa, path, fmt, schema)
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
+    @staticmethod
+    def _open(pa, path, fmt, schema):
+        if fmt == 'parquet':
+            return pa.parquet.ParquetWriter(path, schema)
+        return pa.ipc.new_file(path, schema)
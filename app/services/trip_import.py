@@ -0,0 +1,262 @@
+from google.cloud import bigquery
+from google.api_core.exceptions import Conflict
+from config import Config
+from app.schemas import TRIPS_SCHEMA
+from app.services.heatmap import get_heatmap, record_trip
+from app.services.trip_versions import bump_trip_versions
+from datetime import datetime, timezone
+import hashlib
+import logging
+import json
+import math
+import uuid
+import csv
+import os
+
+logger = logging.getLogger(__name__)
+
+# Filled in by the importer when a file doesn't provide them
+COMPUTED_FIELDS = {'trip_id', 'updated_at', 'average_speed_kph', 'energy_used_kWh', 'cost_dollars', 'start_battery_capacity_kWh'}
+ENERGY_FIELDS = ('energy_used_kWh', 'cost_dollars', 'start_battery_capacity_kWh')
+
+def _parse(field, value):
+    """Coerce one file value to its TRIPS_SCHEMA type; blanks become None"""
+    if value is None or value == '':
+        return None
+    if field.field_type in ('FLOAT', 'INTEGER'):
+        number = float(value)
+        # NaN and inf parse as floats but aren't valid JSON for the load job
+        if not math.isfinite(number):
+            raise ValueError(f"{value!r} is not a finite number")
+        return number if field.field_type == 'FLOAT' else int(number)
+    if field.field_type == 'TIMESTAMP':
+        if isinstance(value, datetime):
+            return value.isoformat()
+        # Validate, but hand the load job the original text
+        datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        return str(value)
+    return str(value)
+
+def read_rows(path):
+    """Yield raw dict rows from a CSV or Parquet file"""
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet import needs pyarrow (pip install pyarrow)")
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+    else:
+        with open(path, newline='') as f:
+            yield from csv.DictReader(f)
+
+class TripImporter:
+    """
+    Loads historical trips from CSV/Parquet files with BigQuery load jobs.
+    Rows are validated against TRIPS_SCHEMA and missing energy, cost and speed
+    are computed from the vehicle table, one chunk at a time; the next chunk is
+    prepared while the previous load job runs. Load job ids are derived from
+    the file, run and chunk number, so re-running after a crash resumes from
+    the progress file and never loads a chunk twice.
+
+    Rows with an inline route_geometry are added to the heatmap once their
+    chunk has loaded. Rows that only reference stored routes aren't, so run
+    rebuild-heatmap after importing those.
+    """
+    def __init__(self, db):
+        self.db = db
+        self.fields = {field.name: field for field in TRIPS_SCHEMA}
+        self.vehicles = {}
+        self.imported_at = None
+
+    def import_file(self, path, user_id=None, chunk_rows=None, restart=False):
+        progress_path = f"{path}.import-progress.json"
+        file_id = self._file_id(path)
+        progress = None if restart else self._load_progress(progress_path, file_id)
+        if progress:
+            logger.info(f"Resuming import of {path} after {progress['rows_read']} rows")
+            progress.setdefault('imported_at', datetime.now(timezone.utc).isoformat())
+            progress.setdefault('submitted', progress['chunks'])
+            if progress['submitted'] > progress['chunks']:
+                # Rebuilt with the same rows and job ids, so a load that did finish is found, not repeated
+                logger.info(f"Chunks {progress['chunks']}-{progress['submitted'] - 1} were submitted before the restart")
+        else:
+            progress = {
+                'file_id': file_id,
+                'run_id': uuid.uuid4().hex[:8],
+                'imported_at': datetime.now(timezone.utc).isoformat(),
+                'chunk_rows': chunk_rows or Config.IMPORT_CHUNK_ROWS,
+                'rows_read': 0, 'chunks': 0, 'submitted': 0, 'loaded': 0, 'rejected': 0, 'errors': []
+            }
+            # Job ids derive from run_id, so it has to be on disk before the first job starts
+            self._save_progress(progress_path, progress)
+        skip = progress['rows_read']
+        self.imported_at = progress['imported_at']
+
+        pending = None  # (load job, rows read once it's done, rows in it, rejected rows, heatmap routes)
+        chunk = []
+        line = skip
+        for line, raw in enumerate(read_rows(path), start=1):
+            if line <= skip:
+                continue
+            chunk.append((line, raw))
+            if len(chunk) >= progress['chunk_rows']:
+                pending = self._load_chunk(chunk, line, user_id, pending, progress, progress_path)
+                chunk = []
+        if chunk:
+            pending = self._load_chunk(chunk, line, user_id, pending, progress, progress_path)
+        self._finish(pending, progress, progress_path)
+        progress['rows_read'] = max(progress['rows_read'], line)
+        self._save_progress(progress_path, progress)
+        get_heatmap().flush()
+
+        logger.info(f"Imported {path}: {progress['loaded']} loaded, {progress['rejected']} rejected")
+        return progress
+
+    def _load_chunk(self, chunk, last_line, default_user_id, pending, progress, progress_path):
+        """Validate and complete a chunk, start its load job, then wait for the previous one"""
+        rows = []
+        rejected = []
+        needs_energy = []
+        for line, raw in chunk:
+            row, error = self._validate(raw, default_user_id)
+            if error:
+                rejected.append({'row': line, 'error': error})
+            elif any(row[name] is None for name in ENERGY_FIELDS):
+                needs_energy.append((line, row))
+            else:
+                rows.append(row)
+
+        # One vehicle lookup per chunk for car types not seen yet
+        unknown = {row['car_type'] for line, row in needs_energy} - set(self.vehicles)
+        if unknown:
+            found = self.db.get_vehicles(unknown)
+            self.vehicles.update({car_type: found.get(car_type) for car_type in unknown})
+        for line, row in needs_energy:
+            vehicle_data = self.vehicles[row['car_type']]
+            if not vehicle_data:
+                rejected.append({'row': line, 'error': f"No efficiency data found for vehicle type: {row['car_type']}"})
+                continue
+            energy = self.db.calculate_trip_energy(
+                {'distance': row['distance_meters'], 'duration': row['duration_seconds']},
+                vehicle_data, row['battery_level_start']
+            )
+            for name in ENERGY_FIELDS:
+                if row[name] is None:
+                    row[name] = energy[name]
+            rows.append(row)
+
+        chunk_number = progress['chunks'] + (1 if pending else 0)
+        job = None
+        if rows:
+            # Recorded before submitting, so a crash mid-submit resumes into the same job id
+            progress['submitted'] = max(progress['submitted'], chunk_number + 1)
+            self._save_progress(progress_path, progress)
+            job = self._start_load(progress, chunk_number, rows)
+        self._finish(pending, progress, progress_path)
+        return (job, last_line, len(rows), rejected, self._heatmap_routes(rows))
+
+    def _validate(self, raw, default_user_id):
+        """A TRIPS_SCHEMA row from a file row, or (None, reason) if it can't be imported"""
+        row = {}
+        for name, field in self.fields.items():
+            try:
+                row[name] = _parse(field, raw.get(name))
+            except (TypeError, ValueError) as e:
+                return None, f"Bad value for {name}: {str(e)}"
+
+        row['user_id'] = row['user_id'] or default_user_id
+        row['trip_id'] = row['trip_id'] or str(uuid.uuid4())
+        # Marks the import as a change to the user's trip listings
+        row['updated_at'] = row['updated_at'] or self.imported_at
+        missing = [
+            name for name, field in self.fields.items()
+            if field.mode == 'REQUIRED' and name not in COMPUTED_FIELDS and row[name] is None
+        ]
+        if missing:
+            return None, f"Missing {', '.join(missing)}"
+        if row['duration_seconds'] <= 0:
+            return None, "duration_seconds must be positive"
+
+        if row['average_speed_kph'] is None:
+            row['average_speed_kph'] = (row['distance_meters'] / 1000) / (row['duration_seconds'] / 3600)
+        return row, None
+
+    @staticmethod
+    def _heatmap_routes(rows):
+        """(user_id, geometry, energy) for rows that carry their own route geometry"""
+        routes = []
+        for row in rows:
+            if not row['route_geometry']:
+                continue
+            try:
+                geometry = json.loads(row['route_geometry'])
+            except ValueError:
+                logger.warning(f"Not adding trip {row['trip_id']} to the heatmap: route_geometry isn't JSON")
+                continue
+            routes.append((row['user_id'], geometry, row['energy_used_kWh']))
+        return routes
+
+    def _start_load(self, progress, chunk_number, rows):
+        job_config = bigquery.LoadJobConfig(
+            schema=TRIPS_SCHEMA,
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+        )
+        job_id = f"trip_import_{progress['file_id']}_{progress['run_id']}_{chunk_number}"
+        destination = f"{self.db.dataset}.{Config.BQ_TRIPS_TABLE}"
+        try:
+            return self.db.client.load_table_from_json(rows, destination, job_config=job_config, job_id=job_id)
+        except Conflict:
+            # The chunk was submitted before the progress file was last saved
+            existing = self.db.client.get_job(job_id)
+            if existing.state != 'DONE':
+                return existing
+            if not existing.error_result:
+                logger.info(f"Chunk {chunk_number} already loaded by job {job_id}")
+                return None
+            logger.warning(f"Retrying chunk {chunk_number}; job {job_id} failed: {existing.error_result}")
+            return self.db.client.load_table_from_json(
+                rows, destination, job_config=job_config, job_id=f"{job_id}_{uuid.uuid4().hex[:8]}"
+            )
+
+    def _finish(self, pending, progress, progress_path):
+        """Wait for a chunk's load job, then record it in the progress file"""
+        if pending is None:
+            return
+        job, rows_read, rows, rejected, routes = pending
+        if job is not None:
+            job.result()
+        if rows:
+            bump_trip_versions(everyone=True)
+        for user_id, geometry, energy_used_kWh in routes:
+            record_trip(user_id, geometry, energy_used_kWh)
+        progress['chunks'] += 1
+        progress['loaded'] += rows
+        progress['rejected'] += len(rejected)
+        progress['errors'].extend(rejected[:Config.IMPORT_MAX_REPORTED_ERRORS - len(progress['errors'])])
+        progress['rows_read'] = rows_read
+        self._save_progress(progress_path, progress)
+
+    @staticmethod
+    def _file_id(path):
+        stat = os.stat(path)
+        key = f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+        return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def _load_progress(progress_path, file_id):
+        try:
+            with open(progress_path) as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # A changed file starts over
+        return progress if progress.get('file_id') == file_id else None
+
+    @staticmethod
+    def _save_progress(progress_path, progress):
+        tmp_path = f"{progress_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(progress, f)
+        os.replace(tmp_path, progress_path)
@@ -0,0 +1,146 @@
+from flask import current_app, has_app_context
+from config import Config
+import threading
+import sqlite3
+import logging
+import uuid
+import time
+
+logger = logging.getLogger(__name__)
+
+# Version row for listings across all users
+ALL_USERS = '*'
+# Bumped by bulk writes (repricing, imports) that can touch any user's trips
+EPOCH = '*epoch'
+
+class TripVersionStore:
+    """
+    Version counters for each user's set of trips, in a SQLite (WAL) file
+    shared by the host's workers, so conditional listing requests are answered
+    without querying BigQuery. Every trip write made here bumps the writer's
+    counters at once. Writes made on other hosts are picked up by re-reading
+    the trip-set fingerprint from BigQuery at most every
+    TRIP_VERSION_RECHECK_SECONDS per user. Tags include a generation created
+    with the file, so a recreated store never reissues an old tag.
+    """
+    def __init__(self, path, recheck_seconds):
+        self.path = path
+        self.recheck_seconds = recheck_seconds
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS trip_versions (
+            user_id TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            source_tag TEXT,
+            checked_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS trip_versions_meta (generation TEXT NOT NULL)")
+        conn.execute(
+            "INSERT INTO trip_versions_meta (generation) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM trip_versions_meta)",
+            (uuid.uuid4().hex[:8],)
+        )
+        self.generation = conn.execute("SELECT generation FROM trip_versions_meta").fetchone()[0]
+
+    def _conn(self):
+        # One connection per thread; sqlite3 connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def bump(self, *user_ids):
+        """
+        Record that these users' trips changed. Their next read re-syncs with
+        BigQuery without counting this write a second time.
+        """
+        now = time.time()
+        self._conn().executemany(
+            """
+            INSERT INTO trip_versions (user_id, version, updated_at, source_tag, checked_at)
+            VALUES (?, 1, ?, NULL, 0)
+            ON CONFLICT (user_id) DO UPDATE SET
+                version = version + 1, updated_at = excluded.updated_at, checked_at = 0
+            """,
+            [(user_id, now) for user_id in {*user_ids, ALL_USERS}]
+        )
+
+    def bump_all(self):
+        """Invalidate every user's listings, e.g. after an import or repricing"""
+        self.bump(EPOCH)
+
+    def get(self, user_id, fetch_tag):
+        """
+        (tag, updated_at) for a user's trips, or all trips with user_id None.
+        fetch_tag() returns the trip-set fingerprint from BigQuery; it's only
+        called when the user's entry is new, was just bumped, or is due a recheck.
+        """
+        key = ALL_USERS if user_id is None else user_id
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT version, updated_at, checked_at FROM trip_versions WHERE user_id = ?", (key,)
+        ).fetchone()
+        now = time.time()
+        if row is None or now - row[2] > self.recheck_seconds:
+            source_tag = fetch_tag()
+            # A changed fingerprint only counts as a new version if this host didn't cause it
+            conn.execute(
+                """
+                INSERT INTO trip_versions (user_id, version, updated_at, source_tag, checked_at)
+                VALUES (?, 1, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    version = version + (checked_at > 0 AND source_tag IS NOT excluded.source_tag),
+                    updated_at = CASE WHEN checked_at > 0 AND source_tag IS NOT excluded.source_tag
+                                      THEN excluded.updated_at ELSE updated_at END,
+                    source_tag = excluded.source_tag,
+                    checked_at = excluded.checked_at
+                """,
+                (key, now, source_tag, now)
+            )
+        rows = dict(
+            (name, (version, updated_at)) for name, version, updated_at in conn.execute(
+                "SELECT user_id, version, updated_at FROM trip_versions WHERE user_id IN (?, ?)", (key, EPOCH)
+            )
+        )
+        version, updated_at = rows[key]
+        epoch, epoch_at = rows.get(EPOCH, (0, 0))
+        return f"{self.generation}.{epoch}.{version}", max(updated_at, epoch_at)
+
+_trip_versions = None
+_trip_versions_lock = threading.Lock()
+
+def get_trip_versions():
+    """
+    The host's trip version store, opened on first use with the running app's
+    settings (or Config outside an app) rather than at import time.
+    """
+    global _trip_versions
+    if _trip_versions is None:
+        with _trip_versions_lock:
+            if _trip_versions is None:
+                settings = current_app.config if has_app_context() else vars(Config)
+                _trip_versions = TripVersionStore(
+                    settings['TRIP_VERSIONS_PATH'],
+                    settings['TRIP_VERSION_RECHECK_SECONDS']
+                )
+    return _trip_versions
+
+def bump_trip_versions(*user_ids, everyone=False):
+    """
+    Record a committed trip write. The versions only decide 304s, so failing
+    to record one is logged rather than failing the write.
+    """
+    try:
+        versions = get_trip_versions()
+        if everyone:
+            versions.bump_all()
+        else:
+            versions.bump(*user_ids)
+    except Exception as e:
+        logger.error(f"Error bumping trip versions: {str(e)}")
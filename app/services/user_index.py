@@ -0,0 +1,40 @@
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class UserIndex:
+    """
+    In-memory set of taken usernames and emails. A hit means the name is
+    definitely taken; a miss still has to go through the conditional insert,
+    since other workers may have registered it since we warmed up.
+    """
+    def __init__(self):
+        self.usernames = set()
+        self.emails = set()
+        self.warm = False
+        self._lock = threading.Lock()
+
+    def warm_up(self, db):
+        try:
+            usernames, emails = db.get_all_usernames_and_emails()
+            with self._lock:
+                self.usernames.update(usernames)
+                self.emails.update(emails)
+                self.warm = True
+            logger.info(f"Warmed user index with {len(usernames)} users")
+        except Exception as e:
+            logger.error(f"Error warming user index: {str(e)}")
+
+    def has_username(self, username):
+        return username in self.usernames
+
+    def has_email(self, email):
+        return email in self.emails
+
+    def add(self, username, email):
+        with self._lock:
+            self.usernames.add(username)
+            self.emails.add(email)
+
+user_index = UserIndex()
@@ -0,0 +1,147 @@
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from collections import OrderedDict
+import threading
+import secrets
+import sqlite3
+import pickle
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+class SqliteSessionInterface(SessionInterface):
+    """
+    Server-side sessions kept in a small in-memory LRU backed by a SQLite
+    (WAL) file shared by all workers on the host. Sessions are only written
+    when they change or when their expiry needs refreshing, and expired rows
+    are swept periodically instead of accumulating on disk.
+    """
+    def __init__(self, path, memory_max=10000, memory_ttl=2, sweep_interval=300):
+        self.path = path
+        self.memory_max = memory_max
+        self.memory_ttl = memory_ttl  # How long another worker's change may go unseen
+        self.sweep_interval = sweep_interval
+        self._memory = OrderedDict()  # sid -> (cached_at, expires, data)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._next_sweep = 0
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            sid TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            expires REAL NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+
+    def _conn(self):
+        # One connection per thread; sqlite3 connections can't be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, sid, expires, data):
+        with self._lock:
+            self._memory[sid] = (time.time(), expires, data)
+            self._memory.move_to_end(sid)
+            while len(self._memory) > self.memory_max:
+                self._memory.popitem(last=False)
+
+    def _forget(self, sid):
+        with self._lock:
+            self._memory.pop(sid, None)
+
+    def _load(self, sid):
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(sid)
+        if cached and now - cached[0] < self.memory_ttl:
+            return cached[1], cached[2]
+
+        row = self._conn().execute(
+            "SELECT data, expires FROM sessions WHERE sid = ?", (sid,)
+        ).fetchone()
+        if not row or row[1] < now:
+            self._forget(sid)
+            return None
+        data, expires = row
+        self._remember(sid, expires, data)
+        return expires, data
+
+    def _sweep(self, now):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        try:
+            deleted = self._conn().execute("DELETE FROM sessions WHERE expires < ?", (now,)).rowcount
+            with self._lock:
+                for sid in [sid for sid, entry in self._memory.items() if entry[1] < now]:
+                    del self._memory[sid]
+            if deleted:
+                logger.info(f"Swept {deleted} expired sessions")
+        except sqlite3.Error as e:
+            logger.error(f"Session sweep failed: {str(e)}")
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.config['SESSION_COOKIE_NAME'])
+        if sid:
+            loaded = self._load(sid)
+            if loaded:
+                session = ServerSideSession(pickle.loads(loaded[1]), sid=sid)
+                session.stored_expires = loaded[0]
+                return session
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = app.config['SESSION_COOKIE_NAME']
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        now = time.time()
+        self._sweep(now)
+
+        if not session:
+            if session.modified and not session.new:
+                self._conn().execute("DELETE FROM sessions WHERE sid = ?", (session.sid,))
+                self._forget(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        stored_expires = getattr(session, 'stored_expires', 0)
+        # Unchanged sessions are only rewritten once half their lifetime has passed
+        if not (session.modified or session.new or stored_expires - now < lifetime / 2):
+            return
+
+        expires = now + lifetime
+        data = pickle.dumps(dict(session), pickle.HIGHEST_PROTOCOL)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)",
+            (session.sid, data, expires)
+        )
+        self._remember(session.sid, expires, data)
+
+        response.set_cookie(
+            name, session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+bp = Blueprint('stations', __name__)
+
+from app.stations import routes
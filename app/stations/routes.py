@@ -0,0 +1,72 @@
+from flask import request, jsonify
+from flask_login import login_required
+from app.database import BigQueryDatabase
+from app.services.station_index import StationIndexCache
+from app.services.query_profiler import QueryBudgetExceeded
+from app.errors import handle_query_budget_error
+from config import Config
+import logging
+from app.stations import bp
+
+logger = logging.getLogger(__name__)
+
+# Create database instance
+db = BigQueryDatabase()
+
+# Stations are served from memory; the index is rebuilt from BigQuery in the background
+station_index = StationIndexCache(Config.STATION_INDEX_REFRESH_SECONDS)
+
+def station_filters(args):
+    """Connection type and minimum power filters shared by both endpoints"""
+    return {
+        'connection_type': args.get('connection_type'),
+        'min_power_kw': args.get('min_power_kw', type=float)
+    }
+
+@bp.route('/nearby', methods=['GET'])
+@login_required
+def nearby_stations():
+    try:
+        lat = request.args.get('lat', type=float)
+        lng = request.args.get('lng', type=float)
+        if lat is None or lng is None:
+            return jsonify({'error': 'lat and lng are required'}), 400
+            
+        k = max(1, min(request.args.get('k', 10, type=int), 100))
+        radius_km = request.args.get('radius_km', type=float)
+        
+        index = station_index.get(db.get_stored_stations)
+        stations = index.nearest(lat, lng, k=k, radius_km=radius_km, **station_filters(request.args))
+        
+        return jsonify({'stations': stations, 'count': len(stations)}), 200
+        
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
+    except Exception as e:
+        logger.error(f"Error finding nearby stations: {str(e)}")
+        return jsonify({'error': 'Failed to find nearby stations'}), 500
+
+@bp.route('/search', methods=['GET'])
+@login_required
+def search_stations():
+    try:
+        lat = request.args.get('lat', type=float)
+        lng = request.args.get('lng', type=float)
+        radius_km = request.args.get('radius_km', 25, type=float)
+        limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+        
+        index = station_index.get(db.get_stored_stations)
+        if lat is not None and lng is not None:
+            stations = index.within(lat, lng, radius_km, limit=limit, **station_filters(request.args))
+        else:
+            stations = index.filter(limit=limit, **station_filters(request.args))
+            
+        return jsonify({'stations': stations, 'count': len(stations)}), 200
+        
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
+    except Exception as e:
+        logger.error(f"Error searching stations: {str(e)}")
+        return jsonify({'error': 'Failed to search stations'}), 500
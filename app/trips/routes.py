@@ -1,9 +1,15 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app
 from flask_login import login_required, current_user
 from app.database import BigQueryDatabase
-from app.services.charging import ChargingService
+from app.services.deadline import Deadline, DeadlineExceeded
+from app.services.heatmap import get_heatmap
+from app.services.trip_versions import get_trip_versions
+from app.services.query_profiler import QueryBudgetExceeded
+from app.errors import handle_query_budget_error
 import logging
 import traceback
+import hashlib
+import math
 import json
 from app.trips import bp
 import uuid
@@ -27,6 +33,22 @@ VALID_CAR_TYPES = [
     'Volkswagen ID.4'
 ]
 
+def request_deadline(data):
+    """
+    Build the request deadline, letting the client shorten or extend it up to
+    the configured max. Returns (deadline, error message).
+    """
+    seconds = current_app.config['TRIP_DEADLINE_SECONDS']
+    if data.get('deadline_seconds') is not None:
+        try:
+            seconds = float(data['deadline_seconds'])
+        except (TypeError, ValueError):
+            return None, 'deadline_seconds must be a number'
+        if not math.isfinite(seconds) or seconds <= 0:
+            return None, 'deadline_seconds must be positive'
+        seconds = min(seconds, current_app.config['TRIP_DEADLINE_MAX_SECONDS'])
+    return Deadline(seconds), None
+
 @bp.route('/create', methods=['POST'])
 @login_required
 def create_trip():
@@ -39,32 +61,359 @@ def create_trip():
         if not all(k in data for k in required_fields):
             return jsonify({'error': 'Missing required fields'}), 400
             
+        deadline, error = request_deadline(data)
+        if error:
+            return jsonify({'error': error}), 400
+            
         # Create trip
         result = db.create_trip(
             user_id=current_user.id,
             car_type=data['car_type'],
             battery_level_start=data['battery_level_start'],
             start_coords=(data['start_lat'], data['start_lng']),
-            end_coords=(data['end_lat'], data['end_lng'])
+            end_coords=(data['end_lat'], data['end_lng']),
+            deadline=deadline
         )
         
         return jsonify(result), 201
         
+    except DeadlineExceeded as e:
+        logger.error(f"Trip creation deadline exceeded: {str(e)}")
+        return jsonify({'error': 'Trip creation timed out'}), 504
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
     except Exception as e:
         logger.error(f"Error creating trip: {str(e)}")
         return jsonify({'error': 'Failed to create trip'}), 500
 
+@bp.route('/batch', methods=['POST'])
+@login_required
+def create_trips_batch():
+    try:
+        data = request.get_json()
+        trips = data.get('trips')
+        
+        # Validate input
+        if not isinstance(trips, list) or not trips:
+            return jsonify({'error': 'trips must be a non-empty list'}), 400
+        if len(trips) > current_app.config['TRIP_BATCH_MAX_SIZE']:
+            return jsonify({'error': f"At most {current_app.config['TRIP_BATCH_MAX_SIZE']} trips per batch"}), 400
+            
+        required_fields = ['start_lat', 'start_lng', 'end_lat', 'end_lng', 
+                         'car_type', 'battery_level_start']
+        for i, trip in enumerate(trips):
+            if not all(k in trip for k in required_fields):
+                return jsonify({'error': f'Missing required fields in trip {i}'}), 400
+                
+        deadline, error = request_deadline(data)
+        if error:
+            return jsonify({'error': error}), 400
+            
+        # Create trips
+        results = db.create_trips_batch(
+            user_id=current_user.id,
+            trips=[{
+                'car_type': trip['car_type'],
+                'battery_level_start': trip['battery_level_start'],
+                'start_coords': (trip['start_lat'], trip['start_lng']),
+                'end_coords': (trip['end_lat'], trip['end_lng'])
+            } for trip in trips],
+            deadline=deadline
+        )
+        
+        return jsonify({
+            'trips': results,
+            'created': sum(1 for result in results if 'error' not in result)
+        }), 201
+        
+    except DeadlineExceeded as e:
+        logger.error(f"Batch trip creation deadline exceeded: {str(e)}")
+        return jsonify({'error': 'Batch trip creation timed out'}), 504
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
+    except Exception as e:
+        logger.error(f"Error creating trip batch: {str(e)}")
+        return jsonify({'error': 'Failed to create trips'}), 500
+
+def parse_waypoints(data):
+    """(lat, lng) waypoints from the request, or an error message"""
+    waypoints = data.get('waypoints')
+    if not isinstance(waypoints, list) or len(waypoints) < 2:
+        return None, 'waypoints must be a list of at least two points'
+    if len(waypoints) > current_app.config['TRIP_MAX_WAYPOINTS']:
+        return None, f"At most {current_app.config['TRIP_MAX_WAYPOINTS']} waypoints per trip"
+    if not all(isinstance(w, dict) and 'lat' in w and 'lng' in w for w in waypoints):
+        return None, 'Each waypoint needs lat and lng'
+    return [(w['lat'], w['lng']) for w in waypoints], None
+
+@bp.route('/multi', methods=['POST'])
+@login_required
+def create_multi_stop_trip():
+    try:
+        data = request.get_json()
+        
+        # Validate input
+        if not all(k in data for k in ['waypoints', 'car_type', 'battery_level_start']):
+            return jsonify({'error': 'Missing required fields'}), 400
+        waypoints, error = parse_waypoints(data)
+        if error:
+            return jsonify({'error': error}), 400
+            
+        deadline, error = request_deadline(data)
+        if error:
+            return jsonify({'error': error}), 400
+            
+        result = db.create_multi_stop_trip(
+            user_id=current_user.id,
+            car_type=data['car_type'],
+            battery_level_start=data['battery_level_start'],
+            waypoints=waypoints,
+            deadline=deadline
+        )
+        
+        return jsonify(result), 201
+        
+    except DeadlineExceeded as e:
+        logger.error(f"Multi-stop trip deadline exceeded: {str(e)}")
+        return jsonify({'error': 'Trip creation timed out'}), 504
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
+    except Exception as e:
+        logger.error(f"Error creating multi-stop trip: {str(e)}")
+        return jsonify({'error': 'Failed to create trip'}), 500
+
+@bp.route('/<trip_id>/replan', methods=['POST'])
+@login_required
+def replan_trip(trip_id):
+    """Change a trip's stops; only legs with new endpoints are routed again"""
+    try:
+        data = request.get_json()
+        waypoints, error = parse_waypoints(data)
+        if error:
+            return jsonify({'error': error}), 400
+            
+        deadline, error = request_deadline(data)
+        if error:
+            return jsonify({'error': error}), 400
+            
+        result = db.replan_trip(
+            trip_id=trip_id,
+            user_id=current_user.id,
+            waypoints=waypoints,
+            deadline=deadline
+        )
+        if result is None:
+            return jsonify({'error': 'Trip not found'}), 404
+            
+        return jsonify(result), 200
+        
+    except DeadlineExceeded as e:
+        logger.error(f"Trip replan deadline exceeded: {str(e)}")
+        return jsonify({'error': 'Trip replanning timed out'}), 504
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
+    except Exception as e:
+        logger.error(f"Error replanning trip: {str(e)}")
+        return jsonify({'error': 'Failed to replan trip'}), 500
+
+@bp.route('/reachable', methods=['POST'])
+@login_required
+def reachable_destinations():
+    try:
+        data = request.get_json()
+        
+        # Validate input
+        required_fields = ['origin_lat', 'origin_lng', 'destinations', 'car_type', 'battery_level_start']
+        if not all(k in data for k in required_fields):
+            return jsonify({'error': 'Missing required fields'}), 400
+        destinations = data['destinations']
+        if not isinstance(destinations, list) or not destinations:
+            return jsonify({'error': 'destinations must be a non-empty list'}), 400
+        if len(destinations) > current_app.config['REACHABLE_MAX_DESTINATIONS']:
+            return jsonify({'error': f"At most {current_app.config['REACHABLE_MAX_DESTINATIONS']} destinations per call"}), 400
+        if not all(isinstance(d, dict) and 'lat' in d and 'lng' in d for d in destinations):
+            return jsonify({'error': 'Each destination needs lat and lng'}), 400
+        if not all(is_coordinate(d['lat'], d['lng']) for d in destinations):
+            return jsonify({'error': 'Each destination lat and lng must be numbers in range'}), 400
+        if not is_coordinate(data['origin_lat'], data['origin_lng']):
+            return jsonify({'error': 'origin_lat and origin_lng must be numbers in range'}), 400
+        if not is_number(data['battery_level_start']) or not 0 <= data['battery_level_start'] <= 100:
+            return jsonify({'error': 'battery_level_start must be a percentage between 0 and 100'}), 400
+            
+        deadline, error = request_deadline(data)
+        if error:
+            return jsonify({'error': error}), 400
+            
+        results = db.check_reachability(
+            car_type=data['car_type'],
+            battery_level_start=data['battery_level_start'],
+            origin=(data['origin_lat'], data['origin_lng']),
+            destinations=[(d['lat'], d['lng']) for d in destinations],
+            deadline=deadline
+        )
+        
+        return jsonify({
+            'destinations': results,
+            'reachable_count': sum(1 for result in results if result['reachable'])
+        }), 200
+        
+    except DeadlineExceeded as e:
+        logger.error(f"Reachability deadline exceeded: {str(e)}")
+        return jsonify({'error': 'Reachability check timed out'}), 504
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
+    except Exception as e:
+        logger.error(f"Error checking reachability: {str(e)}")
+        return jsonify({'error': 'Failed to check reachability'}), 500
+
+def is_number(value):
+    """A finite int or float from JSON; bools, NaN and infinities don't count"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def is_coordinate(lat, lng):
+    return is_number(lat) and is_number(lng) and -90 <= lat <= 90 and -180 <= lng <= 180
+
+def parse_pending_points(data):
+    """
+    The [lng, lat] points a partial station search returned as
+    stations_pending_points, checked before they're searched again.
+    Returns (points, error message).
+    """
+    points = data.get('stations_pending_points')
+    if points is None:
+        return None, None
+    if not isinstance(points, list):
+        return None, 'stations_pending_points must be a list'
+    if len(points) > current_app.config['STATIONS_PENDING_MAX_POINTS']:
+        return None, f"At most {current_app.config['STATIONS_PENDING_MAX_POINTS']} stations_pending_points per call"
+    for point in points:
+        if not (
+            isinstance(point, list) and len(point) == 2 and is_coordinate(point[1], point[0])
+        ):
+            return None, 'Each pending point must be a [lng, lat] pair of numbers'
+    return points, None
+
+@bp.route('/<trip_id>/stations', methods=['POST'])
+@login_required
+def fill_trip_stations(trip_id):
+    """Fill in stations for a trip whose station search came back partial"""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        sample_points, error = parse_pending_points(data)
+        if error:
+            return jsonify({'error': error}), 400
+        deadline, error = request_deadline(data)
+        if error:
+            return jsonify({'error': error}), 400
+            
+        result = db.fill_trip_stations(
+            trip_id=trip_id,
+            user_id=current_user.id,
+            sample_points=sample_points,
+            deadline=deadline
+        )
+        if result is None:
+            return jsonify({'error': 'Trip not found'}), 404
+            
+        return jsonify(result), 200
+        
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
+    except Exception as e:
+        logger.error(f"Error filling trip stations: {str(e)}")
+        return jsonify({'error': 'Failed to find trip stations'}), 500
+
+@bp.route('/tiles/<int:z>/<int:x>/<int:y>', methods=['GET'])
+@login_required
+def heatmap_tile(z, x, y):
+    """Binned trip counts and average kWh/km for one map tile of the user's routes"""
+    try:
+        if not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+            return jsonify({'error': 'Tile out of range'}), 400
+            
+        heatmap = get_heatmap()
+        generation, version, updated_at = heatmap.tile_version(current_user.id, z, x, y)
+        etag = f'{current_user.id}-{z}-{x}-{y}-{generation}.{version}'
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify({
+                'z': z,
+                'x': x,
+                'y': y,
+                'bins': heatmap.bins,
+                'cells': heatmap.tile(current_user.id, z, x, y) if version else []
+            })
+        # Weak: compression changes the body's bytes per Accept-Encoding
+        response.set_etag(etag, weak=True)
+        if updated_at:
+            response.last_modified = updated_at
+        response.cache_control.private = True
+        response.cache_control.max_age = current_app.config['HEATMAP_MAX_AGE_SECONDS']
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error serving heatmap tile: {str(e)}")
+        return jsonify({'error': 'Failed to get heatmap tile'}), 500
+
+def listing_validators(user_id, *request_parts):
+    """
+    Weak ETag and Last-Modified for a trip listing, from the trip-set version
+    of one user (or all). Versions are kept on the host, so a current client is
+    usually answered without a BigQuery query.
+    """
+    tag, updated_at = get_trip_versions().get(user_id, lambda: db.get_trip_set_version(user_id)[0])
+    digest = hashlib.sha1(json.dumps([user_id, *request_parts], sort_keys=True).encode()).hexdigest()[:16]
+    # Rounded up to whole seconds so the header never predates the data
+    last_modified = math.floor(updated_at) + 1 if updated_at else None
+    return f"{digest}.{tag}", last_modified
+
+def with_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    # Clients may keep the listing but must revalidate before reusing it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def not_modified(etag, last_modified):
+    """
+    A 304 response if the client's copy is current, else None. Only the ETag
+    is trusted: Last-Modified has one-second resolution and BigQuery stamps a
+    write when its job starts rather than when it commits, so If-Modified-Since
+    alone can't prove a listing is unchanged.
+    """
+    if request.if_none_match and request.if_none_match.contains_weak(etag):
+        return with_validators(Response(status=304), etag, last_modified)
+    return None
+
 @bp.route('/list', methods=['GET'])
 @login_required
 def list_trips():
     try:
-        trips = db.get_user_trips(current_user.username)
-        # Format the response to include route geometry
-        formatted_trips = [{
-            **trip,
-            'route_geometry': json.loads(trip['route_geometry']) if trip.get('route_geometry') else None
-        } for trip in trips]
-        return jsonify({'trips': formatted_trips}), 200
+        fmt = request.args.get('format')
+        etag, last_modified = listing_validators(current_user.id, 'list', fmt)
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+            
+        trips = db.get_user_trips(current_user.id)
+        if fmt == 'csv':
+            return with_validators(Response(trips.to_csv(), mimetype='text/csv'), etag, last_modified), 200
+        # Route geometry is stored as JSON text, so it's embedded without re-parsing
+        body = '{"trips":' + trips.to_json(raw_json=('route_geometry',)) + '}'
+        return with_validators(Response(body, mimetype='application/json'), etag, last_modified), 200
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
     except Exception as e:
         logger.error(f"Error listing trips: {str(e)}")
         return jsonify({'error': 'Failed to retrieve trips'}), 500
@@ -104,15 +453,26 @@ def search_trips():
         if 'user_id' in filters:
             valid_filters['user_id'] = filters['user_id']
             
+        # Clients re-posting the same search get a 304 until trips in its scope change
+        etag, last_modified = listing_validators(
+            valid_filters.get('user_id'), 'search', valid_filters, filters.get('format')
+        )
+        cached = not_modified(etag, last_modified)
+        if cached:
+            return cached
+            
         # Get filtered trips
         db = BigQueryDatabase()
         trips = db.search_trips(valid_filters)
         
-        return jsonify({
-            'trips': trips,
-            'count': len(trips)
-        }), 200
+        if filters.get('format') == 'csv':
+            return with_validators(Response(trips.to_csv(), mimetype='text/csv'), etag, last_modified), 200
+        body = '{"trips":' + trips.to_json() + ',"count":' + str(len(trips)) + '}'
+        return with_validators(Response(body, mimetype='application/json'), etag, last_modified), 200
         
+    except QueryBudgetExceeded as e:
+        logger.warning(f"Query budget exceeded: {str(e)}")
+        return handle_query_budget_error(e)
     except Exception as e:
         logger.error(f"Error searching trips: {str(e)}")
         return jsonify({'error': 'Failed to search trips'}), 500 
\ No newline at end of file
@@ -1,8 +1,14 @@
 import os
 
+basedir = os.path.abspath(os.path.dirname(__file__))
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-please-change'
-    SESSION_TYPE = 'filesystem'
+    SESSION_TYPE = 'sqlite'  # 'sqlite' uses app.sessions, anything else goes to Flask-Session
+    SESSION_SQLITE_PATH = os.environ.get('SESSION_SQLITE_PATH') or 'sessions.db'
+    SESSION_MEMORY_MAX = 10000      # Sessions kept in the per-process memory tier
+    SESSION_MEMORY_TTL = 2          # Seconds a memory-tier entry is trusted before re-reading SQLite
+    SESSION_SWEEP_INTERVAL = 300    # Seconds between expired-session sweeps
     REMEMBER_COOKIE_SECURE = False  # Set to True in production
     SESSION_COOKIE_SECURE = False   # Set to True in production
     
@@ -14,10 +20,112 @@ class Config:
     BQ_DATASET = "ev_tracker"
     
     # OSRM Config
-    OSRM_BASE_URL = "http://router.project-osrm.org/route/v1/driving/" 
+    # Both can point at a local OSRM (or osrm_stub.py) for development
+    OSRM_BASE_URL = os.environ.get('OSRM_BASE_URL') or "http://router.project-osrm.org/route/v1/driving/" 
+    OSRM_TABLE_URL = os.environ.get('OSRM_TABLE_URL') or "http://router.project-osrm.org/table/v1/driving/"
+    REACHABLE_MAX_DESTINATIONS = 100    # Destinations accepted by one /trips/reachable call
+    OSRM_TABLE_MAX_COORDINATES = 100    # Public OSRM's table limit, origin included; larger tables are split
+    
+    # Request deadline Config (seconds)
+    TRIP_DEADLINE_SECONDS = 15          # Default budget for /trips/create
+    TRIP_DEADLINE_MAX_SECONDS = 60      # Upper bound for client-supplied deadline_seconds
+    OCM_TIMEOUT_SECONDS = 5             # Cap for a single OCM call
+    STATION_SEARCH_RESERVE_SECONDS = 1  # Budget kept back to store stations and respond
+    STATIONS_PENDING_MAX_POINTS = 500   # Points accepted by one /trips/<id>/stations call
+    
+    # Station tile cache Config
+    STATION_TILE_DEGREES = 0.1              # Grid cell size for OCM lookups (~11 km)
+    STATION_CORRIDOR_KM = 10                # Stations within this distance of a route are returned
+    STATION_CORRIDOR_STEP_KM = 1            # Route points closer than this are skipped when building the corridor
+    STATION_TILE_MAX_RESULTS = 200          # maxresults for one tile's OCM query
+    STATION_TILE_MAX_SPLITS = 2             # Times a tile that hits maxresults is split into quadrants
+    STATION_SEGMENT_KM = 10                 # Stretch of route the per-segment station cap applies to
+    STATION_MAX_PER_SEGMENT = 10            # Closest stations kept per stretch of route
+    STATION_TILE_CACHE_PATH = os.environ.get('STATION_TILE_CACHE_PATH') or 'ocm_tiles.db'
+    STATION_TILE_TTL_HOURS = 24
+    STATION_TILE_CACHE_MAX_TILES = 100000
+    
+    # OSRM response cache Config
+    ROUTE_RESPONSE_CACHE_SIZE = 5000
+    ROUTE_RESPONSE_TTL_HOURS = 6
+    
+    # Corridor prewarm Config
+    PREWARM_ENABLED = os.environ.get('PREWARM_ENABLED') == '1'
+    PREWARM_INTERVAL_SECONDS = 1800
+    PREWARM_LOOKBACK_DAYS = 7           # Trip history mined for frequent corridors
+    PREWARM_MAX_CORRIDORS = 50
+    PREWARM_CORRIDOR_DECIMALS = 2       # Endpoints are grouped to this many decimal places (~1 km)
+    PREWARM_MAX_UPSTREAM_CALLS = 200    # OSRM + OCM calls allowed per cycle
+    PREWARM_REFRESH_AHEAD_SECONDS = 3600  # Refresh entries expiring within this window
+    
+    # Station index Config
+    STATION_INDEX_REFRESH_SECONDS = 900     # Rebuild the in-memory station index this often
+    
+    # Charging planner Config
+    CAR_CHARGE_DATA_PATH = os.path.join(basedir, 'final_AI_car_data.csv')
+    CHARGE_RESERVE_PERCENT = 10         # Never plan to arrive anywhere below this
+    CHARGE_TARGET_PERCENT = 80          # Don't plan to charge above this (charging slows down)
+    CHARGE_STOP_OVERHEAD_MINUTES = 5    # Time lost per stop besides charging
+    DC_FAST_MIN_KW = 50                 # Chargers at or above this aren't limited by the car's AC rate
+    DEFAULT_CHARGE_RATE_KW = 7          # Used when a car has no charge time data
+    
+    # Batch trip Config
+    TRIP_BATCH_MAX_SIZE = 100   # Trips accepted by one /trips/batch call
+    TRIP_BATCH_WORKERS = 8      # Concurrent OSRM/OCM calls per batch
+    BQ_INSERT_MAX_PARAMETERS = 9000     # Per multi-row INSERT; BigQuery allows 10,000
+    BQ_INSERT_MAX_BYTES = 5000000       # Rough cap on one INSERT's values; BigQuery requests are limited to 10 MB
+    TRIP_STAGE_WORKERS = 32     # Threads shared by the stages of every create_trip in a process
+    
+    # Trip export Config
+    EXPORT_PAGE_ROWS = 50000    # Rows per page when the Storage Read API isn't installed
+    
+    # Trip import Config
+    IMPORT_CHUNK_ROWS = 50000           # Rows per load job
+    IMPORT_MAX_REPORTED_ERRORS = 100    # Rejected rows listed in the progress file
+    
+    # Route heatmap Config
+    HEATMAP_PATH = os.environ.get('HEATMAP_PATH') or 'heatmap.db'
+    HEATMAP_MIN_ZOOM = 4
+    HEATMAP_MAX_ZOOM = 14
+    HEATMAP_BINS = 32                   # Cells per tile side
+    HEATMAP_MAX_AGE_SECONDS = 60        # Cache-Control max-age for served tiles
+    
+    # Trip listing cache Config
+    TRIP_VERSIONS_PATH = os.environ.get('TRIP_VERSIONS_PATH') or 'trip_versions.db'
+    TRIP_VERSION_RECHECK_SECONDS = 60   # How stale a listing can look after a write on another host
+    
+    # Response compression Config
+    COMPRESS_MIN_BYTES = 1024           # Smaller responses aren't worth compressing
+    COMPRESS_LEVEL = 6
+    
+    # Query profiling Config
+    QUERY_STATS_PATH = os.environ.get('QUERY_STATS_PATH') or 'query_stats.db'
+    QUERY_MAX_BYTES_BILLED = int(os.environ.get('QUERY_MAX_BYTES_BILLED') or 0)          # 0 = no cap; enforced by BigQuery
+    QUERY_DRY_RUN_BUDGET_BYTES = int(os.environ.get('QUERY_DRY_RUN_BUDGET_BYTES') or 0)  # 0 = no dry-run check
+    QUERY_DRY_RUN_CACHE_SECONDS = 600   # How long a query's dry-run estimate is reused
+    QUERY_DRY_RUN_CACHE_SIZE = 1000     # Distinct queries whose estimates are kept
+    
+    # Multi-stop trip Config
+    TRIP_MAX_WAYPOINTS = 10     # Start, stops and destination of one multi-stop trip
+    
+    # Route store Config
+    ROUTE_CACHE_SIZE = 2000             # Routes kept in the in-process cache
+    ROUTE_STATIONS_TTL_HOURS = 24       # How long a route's stored station results are reused
+    
+    # Password hashing Config
+    # Changing the method or salt length rehashes existing passwords on next login.
+    # Include the iteration count in the method so stored hashes can be compared to it.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:260000'
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_MAX_PENDING = 32  # Hash jobs allowed in flight before callers block
+    REGISTRATION_MAX_ATTEMPTS = 5   # Tries when a registration's transaction conflicts with another
     
     # Add table names
     BQ_USERS_TABLE = 'users'
     BQ_TRIPS_TABLE = 'trips'
     BQ_TRIP_STATIONS_TABLE = 'trip_stations'
-    BQ_CAR_BATTERY_TABLE = 'car_battery_speed' 
\ No newline at end of file
+    BQ_ROUTES_TABLE = 'routes'
+    BQ_LOCKS_TABLE = 'locks'
+    BQ_CAR_ENERGY_COSTS_TABLE = 'car_energy_costs'
+    BQ_CAR_BATTERY_TABLE = 'car_battery_speed' 
@@ -0,0 +1,68 @@
+"""
+Minimal OSRM-compatible stand-in for local development.
+
+Answers /route/v1/driving/ and /table/v1/driving/ with straight-line
+distances at a fixed speed, so the app runs without the public OSRM server:
+
+    python osrm_stub.py 5002
+    OSRM_BASE_URL=http://localhost:5002/route/v1/driving/ \
+    OSRM_TABLE_URL=http://localhost:5002/table/v1/driving/ python app.py
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import json
+import math
+import sys
+
+SPEED_KPH = 80
+DETOUR_FACTOR = 1.3  # Roads are longer than straight lines
+
+def distance_m(a, b):
+    lng1, lat1, lng2, lat2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371000.0 * math.asin(math.sqrt(h)) * DETOUR_FACTOR
+
+def duration_s(meters):
+    return meters / (SPEED_KPH / 3.6)
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # Not urlparse: it would split the ';'-separated coordinates off as path params
+        path, _, query = self.path.partition('?')
+        query = parse_qs(query)
+        service, _, _, coords = (path.strip('/').split('/', 3) + [''] * 4)[:4]
+        try:
+            points = [tuple(map(float, pair.split(','))) for pair in coords.split(';')]
+        except ValueError:
+            return self._send(400, {'code': 'InvalidQuery'})
+
+        if service == 'route' and len(points) >= 2:
+            meters = sum(distance_m(a, b) for a, b in zip(points, points[1:]))
+            return self._send(200, {'code': 'Ok', 'routes': [{
+                'distance': meters,
+                'duration': duration_s(meters),
+                'geometry': {'type': 'LineString', 'coordinates': [list(p) for p in points]}
+            }]})
+
+        if service == 'table':
+            sources = [int(i) for i in query['sources'][0].split(';')] if 'sources' in query else range(len(points))
+            distances = [[distance_m(points[s], p) for p in points] for s in sources]
+            return self._send(200, {
+                'code': 'Ok',
+                'distances': distances,
+                'durations': [[duration_s(d) for d in row] for row in distances]
+            })
+
+        self._send(400, {'code': 'InvalidService'})
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5002
+    ThreadingHTTPServer(('127.0.0.1', port), Handler).serve_forever()
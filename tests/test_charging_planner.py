@@ -0,0 +1,96 @@
+from itertools import combinations
+import random
+
+from app.services.charging_planner import (
+    plan_charging_stops, route_profile, car_charge_rate_kw, station_charge_rate_kw
+)
+from config import Config
+
+CAR = 'Test car without charge data'
+BATTERY_KWH = 60.0
+
+def straight_route(degrees=5.0, step=0.01):
+    """A route due north along the prime meridian, one point per ~1.1 km"""
+    return {'type': 'LineString', 'coordinates': [[0.0, i * step] for i in range(int(degrees / step) + 1)]}
+
+def random_stations(rng, route, n):
+    points = rng.sample(route['coordinates'][1:-1], n)
+    return [
+        {
+            'id': i,
+            'latitude': lat,
+            'longitude': lng,
+            'connections': [{'power_kw': rng.choice((None, 7, 22, 50, 150))}]
+        }
+        for i, (lng, lat) in enumerate(points)
+    ]
+
+def brute_force_minutes(route, stations, energy_used_kWh, start_energy_kWh):
+    """
+    Fewest total charging minutes over every ordered subset of stations, or
+    None if no subset gets there, under the planner's model: each stop charges
+    just enough to reach the next with the reserve left, at most up to
+    CHARGE_TARGET_PERCENT, plus a fixed overhead per stop.
+    """
+    profile = route_profile(route['coordinates'])
+    route_km = profile[-1][2]
+    reserve = BATTERY_KWH * Config.CHARGE_RESERVE_PERCENT / 100
+    max_leg = BATTERY_KWH * (Config.CHARGE_TARGET_PERCENT - Config.CHARGE_RESERVE_PERCENT) / 100
+    start_usable = start_energy_kWh - reserve
+    car_rate = car_charge_rate_kw(CAR)
+
+    stops = []
+    for station in stations:
+        along_km = next(km for lat, lng, km in profile if (lat, lng) == (station['latitude'], station['longitude']))
+        stops.append((along_km * energy_used_kWh / route_km, station_charge_rate_kw(station, car_rate)))
+    stops.sort()
+
+    best = None
+    for size in range(len(stops) + 1):
+        for chain in combinations(stops, size):
+            positions = [e for e, _ in chain] + [energy_used_kWh]
+            if positions[0] > start_usable:
+                continue
+            if any(b - a > max_leg for a, b in zip(positions, positions[1:])):
+                continue
+            hours = 0.0
+            usable = start_usable
+            for (e, rate), next_e in zip(chain, positions[1:]):
+                charge = max(0.0, (next_e - e) - (usable - e))
+                hours += charge / rate + Config.CHARGE_STOP_OVERHEAD_MINUTES / 60
+                usable = next_e
+            if best is None or hours < best:
+                best = hours
+    return best * 60 if best is not None else None
+
+def test_plan_matches_brute_force():
+    rng = random.Random(7)
+    route = straight_route()
+    for _ in range(150):
+        stations = random_stations(rng, route, rng.randint(0, 9))
+        energy_used_kWh = rng.uniform(20, 160)
+        start_energy_kWh = rng.uniform(10, BATTERY_KWH)
+
+        plan = plan_charging_stops(route, energy_used_kWh, start_energy_kWh, BATTERY_KWH, stations, CAR)
+        expected = brute_force_minutes(route, stations, energy_used_kWh, start_energy_kWh)
+
+        if expected is None:
+            assert plan['feasible'] is False
+            continue
+        assert plan['feasible'] is True
+        # Stop minutes are rounded to 0.1 each before summing
+        assert abs(plan['total_charge_minutes'] - expected) <= 0.1 * (len(plan['stops']) + 1)
+        assert plan['needs_charging'] == bool(plan['stops'])
+        assert plan['arrival_soc_percent'] >= Config.CHARGE_RESERVE_PERCENT - 0.1
+
+def test_no_stops_when_start_charge_covers_trip():
+    route = straight_route(1.0)
+    plan = plan_charging_stops(route, 10.0, 50.0, BATTERY_KWH, [], CAR)
+
+    assert plan == {
+        'needs_charging': False,
+        'feasible': True,
+        'stops': [],
+        'total_charge_minutes': 0.0,
+        'arrival_soc_percent': round(100 * 40.0 / BATTERY_KWH, 1)
+    }
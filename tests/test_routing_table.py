@@ -0,0 +1,63 @@
+from http.server import ThreadingHTTPServer
+import threading
+
+import pytest
+
+import osrm_stub
+from app.services.routing import RoutingService
+from config import Config
+
+class CountingHandler(osrm_stub.Handler):
+    table_requests = []
+
+    def do_GET(self):
+        if '/table/' in self.path:
+            coords = self.path.split('?')[0].rsplit('/', 1)[1]
+            self.table_requests.append(len(coords.split(';')))
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def routing():
+    CountingHandler.table_requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CountingHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    yield RoutingService(f"{base}/route/v1/driving/", f"{base}/table/v1/driving/")
+    server.shutdown()
+    server.server_close()
+
+def test_table_returns_one_leg_per_destination(routing):
+    origin = (48.85, 2.35)
+    destinations = [(48.85 + i / 100, 2.35) for i in range(1, 6)]
+
+    legs = routing.get_table(origin, destinations)
+
+    assert len(legs) == len(destinations)
+    distances = [leg['distance'] for leg in legs]
+    assert distances == sorted(distances) and distances[0] > 0
+
+def test_zero_duration_destination_is_routable(routing):
+    origin = (48.85, 2.35)
+
+    legs = routing.get_table(origin, [origin, (48.9, 2.35)])
+
+    assert legs[0] == {'distance': 0.0, 'duration': 0.0}
+    assert legs[1] is not None
+
+def test_table_is_split_at_osrm_coordinate_limit(routing):
+    origin = (45.0, 5.0)
+    destinations = [(45.0 + i / 1000, 5.0) for i in range(1, Config.REACHABLE_MAX_DESTINATIONS + 51)]
+
+    legs = routing.get_table(origin, destinations)
+
+    assert len(legs) == len(destinations)
+    assert all(leg is not None for leg in legs)
+    assert max(CountingHandler.table_requests) <= Config.OSRM_TABLE_MAX_COORDINATES
+    assert sum(count - 1 for count in CountingHandler.table_requests) == len(destinations)
+    # Legs stay in destination order across requests
+    distances = [leg['distance'] for leg in legs]
+    assert distances == sorted(distances)
@@ -0,0 +1,47 @@
+import random
+
+from app.services.station_index import KDTree, to_unit_vector, km_to_chord2
+
+def brute_nearest(points, q, k, max_dist2=float('inf'), predicate=None):
+    pairs = [
+        (sum((a - b) ** 2 for a, b in zip(p, q)), i) for i, p in enumerate(points)
+        if not predicate or predicate(i)
+    ]
+    return sorted(pair for pair in pairs if pair[0] <= max_dist2)[:k]
+
+def random_points(rng, n):
+    return [to_unit_vector(rng.uniform(40, 55), rng.uniform(-5, 15)) for _ in range(n)]
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(1)
+    for n in (0, 1, 15, 16, 17, 200, 1000):
+        points = random_points(rng, n)
+        tree = KDTree(points)
+        for _ in range(25):
+            q = to_unit_vector(rng.uniform(38, 57), rng.uniform(-7, 17))
+            k = rng.choice((1, 3, 10, 50))
+            assert tree.nearest(q, k) == brute_nearest(points, q, k)
+
+def test_nearest_with_radius_and_predicate_matches_brute_force():
+    rng = random.Random(2)
+    points = random_points(rng, 500)
+    tree = KDTree(points)
+    for _ in range(50):
+        q = to_unit_vector(rng.uniform(40, 55), rng.uniform(-5, 15))
+        max_dist2 = km_to_chord2(rng.choice((5, 50, 200)))
+        modulus = rng.choice((2, 3, 7))
+        predicate = lambda i: i % modulus == 0
+        assert tree.nearest(q, 10, max_dist2, predicate) == brute_nearest(points, q, 10, max_dist2, predicate)
+
+def test_within_matches_brute_force():
+    rng = random.Random(3)
+    points = random_points(rng, 500)
+    tree = KDTree(points)
+    for _ in range(50):
+        q = to_unit_vector(rng.uniform(40, 55), rng.uniform(-5, 15))
+        max_dist2 = km_to_chord2(rng.choice((5, 50, 200)))
+        assert tree.within(q, max_dist2) == brute_nearest(points, q, len(points), max_dist2)
+
+def test_nearest_with_no_k_finds_nothing():
+    points = random_points(random.Random(4), 50)
+    assert KDTree(points).nearest(points[0], 0) == []